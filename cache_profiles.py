@@ -0,0 +1,160 @@
+"""Gateway intents and member-cache profiles for ModBot.
+
+The profile is picked with ``BOT_CACHE_PROFILE``:
+
+* ``full``: every intent, every member and presence cached, guilds chunked at startup.
+* ``balanced`` (default): no presences, only members in voice or seen joining are cached
+  and guilds are never chunked. Handlers must not assume a member is cached; they
+  fetch the one member they need, and exits go through ``on_raw_member_remove``.
+* ``minimal``: like ``balanced`` but only members in voice are cached.
+
+``BOT_CHUNK_GUILDS=1/0`` overrides the startup chunking of any profile.
+
+Running this module compares the memory the guild/member cache takes under
+each profile for synthetic guilds:
+
+    python cache_profiles.py --guilds 50 --members 5000
+"""
+import argparse
+import gc
+import os
+import tracemalloc
+from typing import Dict
+
+import discord
+
+DEFAULT_PROFILE = 'balanced'
+
+
+def _intents(presences: bool) -> discord.Intents:
+    intents = discord.Intents.all()
+    intents.presences = presences
+    intents.message_content = True
+    intents.auto_moderation = True
+    return intents
+
+
+def _profiles() -> Dict[str, dict]:
+    return {
+        'full': {
+            'intents': _intents(presences=True),
+            'member_cache_flags': discord.MemberCacheFlags.all(),
+            'chunk_guilds_at_startup': True,
+        },
+        'balanced': {
+            'intents': _intents(presences=False),
+            'member_cache_flags': discord.MemberCacheFlags(voice=True, joined=True),
+            'chunk_guilds_at_startup': False,
+        },
+        'minimal': {
+            'intents': _intents(presences=False),
+            'member_cache_flags': discord.MemberCacheFlags(voice=True, joined=False),
+            'chunk_guilds_at_startup': False,
+        },
+    }
+
+
+def client_options(profile: str = None) -> dict:
+    """Keyword arguments for ``commands.Bot`` for the configured cache profile"""
+    profile = profile or os.getenv('BOT_CACHE_PROFILE', DEFAULT_PROFILE)
+    profiles = _profiles()
+    if profile not in profiles:
+        raise ValueError(f"Unknown BOT_CACHE_PROFILE {profile!r}, expected one of {', '.join(profiles)}")
+
+    options = profiles[profile]
+    chunk_override = os.getenv('BOT_CHUNK_GUILDS')
+    if chunk_override is not None:
+        options['chunk_guilds_at_startup'] = chunk_override.lower() in ('1', 'true', 'yes')
+    return options
+
+
+def _user(user_id: int) -> dict:
+    return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'global_name': None, 'avatar': None}
+
+
+def _member(user_id: int) -> dict:
+    return {
+        'user': _user(user_id),
+        'roles': [],
+        'joined_at': '2024-01-01T00:00:00+00:00',
+        'deaf': False,
+        'mute': False,
+        'flags': 0,
+    }
+
+
+def _presence(user_id: int) -> dict:
+    return {'user': {'id': str(user_id)}, 'status': 'online', 'activities': [], 'client_status': {'desktop': 'online'}}
+
+
+def _guild(guild_id: int, members: int, online: float, voice: float, presences: bool) -> dict:
+    """A GUILD_CREATE payload shaped like the gateway sends it for a large guild"""
+    member_ids = [guild_id * 1000000 + i for i in range(members)]
+    online_ids = member_ids[:int(members * online)]
+    voice_ids = member_ids[:int(members * voice)]
+    # Without the presences intent large guilds only ship members that are in voice
+    sent_ids = online_ids if presences else voice_ids
+    return {
+        'id': str(guild_id),
+        'name': f'guild{guild_id}',
+        'icon': None,
+        'owner_id': str(member_ids[0]),
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id + 1), 'type': 2, 'name': 'voice', 'position': 0, 'permission_overwrites': [],
+                      'bitrate': 64000, 'user_limit': 0}],
+        'members': [_member(user_id) for user_id in sent_ids],
+        'presences': [_presence(user_id) for user_id in online_ids] if presences else [],
+        'voice_states': [{'user_id': str(user_id), 'channel_id': str(guild_id + 1), 'session_id': 's', 'deaf': False,
+                          'mute': False, 'self_deaf': False, 'self_mute': False, 'self_video': False,
+                          'suppress': False, 'request_to_speak_timestamp': None} for user_id in voice_ids],
+        'member_count': members,
+        'large': True,
+        'emojis': [], 'features': [], 'verification_level': 0, 'explicit_content_filter': 0,
+        'default_message_notifications': 0, 'mfa_level': 0, 'afk_timeout': 0, 'premium_tier': 0,
+        'nsfw_level': 0, 'preferred_locale': 'en-US', 'system_channel_id': None,
+    }
+
+
+def measure(profile: str, guilds: int, members: int, online: float, voice: float) -> int:
+    """Bytes retained by the connection state after loading (and, if enabled, chunking) the guilds"""
+    options = _profiles()[profile]
+    presences = options['intents'].presences
+    payloads = [_guild(10000 + i * 10, members, online, voice, presences) for i in range(guilds)]
+    chunks = [[_member(guild_id * 1000000 + i) for i in range(members)] for guild_id in (10000 + i * 10 for i in range(guilds))]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    client = discord.Client(**options)
+    state = client._connection
+    for payload, chunk in zip(payloads, chunks):
+        guild = state._get_create_guild(payload)
+        if options['chunk_guilds_at_startup']:
+            for data in chunk:
+                guild._add_member(discord.Member(data=data, guild=guild, state=state))
+
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del client, state
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare guild/member cache memory across cache profiles")
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--online', type=float, default=0.2, help="Fraction of members online")
+    parser.add_argument('--voice', type=float, default=0.01, help="Fraction of members in voice")
+    args = parser.parse_args()
+
+    print(f"{args.guilds} guilds x {args.members} members, {args.online:.0%} online, {args.voice:.0%} in voice")
+    for profile in _profiles():
+        retained = measure(profile, args.guilds, args.members, args.online, args.voice)
+        print(f"{profile:<10}{retained / 1024 / 1024:>10.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
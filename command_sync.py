@@ -0,0 +1,55 @@
+"""Skip the global application command sync when the command tree has not changed."""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger('ModBot')
+
+
+def command_tree_hash(tree) -> str:
+    """Hash the payload ``tree.sync()`` would upload for the global commands"""
+    payload = [command.to_dict(tree) for command in tree.get_commands()]
+    payload.sort(key=lambda command: (command.get('type', 1), command['name']))
+    serialized = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+async def sync_command_tree(tree, collection, application_id: int, force: bool = False) -> bool:
+    """Sync the global command tree only if its hash differs from the stored one.
+
+    The hash and the duration of the last real sync are kept in ``collection`` under
+    one document per application, so the time saved by skipping can be logged.
+    Returns True when a sync was performed.
+    """
+    tree_hash = command_tree_hash(tree)
+    key = f"command_tree:{application_id}"
+
+    stored = None
+    try:
+        stored = await collection.find_one({"_id": key})
+    except Exception as e:
+        logger.error(f"Error reading stored command tree hash: {str(e)}")
+
+    if not force and stored and stored.get('hash') == tree_hash:
+        logger.info(
+            f"Command tree unchanged ({tree_hash[:12]}), skipped global sync "
+            f"saving ~{stored.get('sync_seconds', 0):.2f}s at startup"
+        )
+        return False
+
+    started = time.perf_counter()
+    await tree.sync()
+    elapsed = time.perf_counter() - started
+    logger.info(f"Synced global command tree ({tree_hash[:12]}) in {elapsed:.2f}s{' (forced)' if force else ''}")
+
+    try:
+        await collection.update_one(
+            {"_id": key},
+            {"$set": {"hash": tree_hash, "sync_seconds": elapsed, "synced_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Error storing command tree hash: {str(e)}")
+    return True
@@ -0,0 +1,73 @@
+"""Short-lived cache of the guild configs read on every message."""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger('ModBot')
+
+
+class GuildConfigCache:
+    """Cache the config subtrees the message listeners need, per guild, for ``ttl`` seconds.
+
+    Configs are edited from the dashboard, so there is no change notification;
+    a guild's configs are reloaded at most once per ``ttl`` and concurrent
+    misses for the same guild share one query. A load that raises (the
+    datastore is down) is cached as None for only ``failure_ttl``, so the
+    features come back soon after it recovers. ``invalidate`` drops a guild the
+    bot left.
+    """
+
+    def __init__(self, load: Callable[..., Awaitable[Optional[dict]]], keys: Iterable[str], ttl: float = 60.0,
+                 max_guilds: int = 20000, failure_ttl: float = 5.0):
+        self.load = load
+        self.keys = tuple(keys)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_guilds = max_guilds
+        # guild_id -> (expires_at, configs)
+        self._entries: OrderedDict = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, guild_id: int) -> Optional[dict]:
+        entry = self._entries.get(guild_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        future = self._loading.get(guild_id)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._load(guild_id))
+            self._loading[guild_id] = future
+        return await asyncio.shield(future)
+
+    async def _load(self, guild_id: int) -> Optional[dict]:
+        ttl = self.ttl
+        try:
+            configs = await self.load(guild_id, *self.keys)
+        except Exception as e:
+            logger.error(f"Error loading configs for guild {guild_id}: {str(e)}")
+            configs = None
+            # Still cached briefly, so an outage doesn't send every message to the datastore
+            ttl = self.failure_ttl
+        finally:
+            self._loading.pop(guild_id, None)
+        self._entries[guild_id] = (time.monotonic() + ttl, configs)
+        self._entries.move_to_end(guild_id)
+        while len(self._entries) > self.max_guilds:
+            self._entries.popitem(last=False)
+        return configs
+
+    def invalidate(self, guild_id: int):
+        self._entries.pop(guild_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'guilds': len(self._entries),
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,150 @@
+"""Local banned-term filter for the auto_mod config.
+
+Each guild's terms are merged into a trie and emitted as one regular
+expression, so a message is scanned in a single pass and the engine only ever
+follows the trie branch matching the next character, however many terms there
+are. Terms match whole words, case-insensitively; a trailing ``*`` makes a term
+match as a prefix (``spam*`` also catches ``spammer``). The compiled pattern is
+kept per guild and rebuilt only when the guild's term list changes.
+"""
+import argparse
+import random
+import re
+import string
+import time
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+MAX_TERMS = 1000
+MAX_TERM_LENGTH = 64
+
+# Trie marker keys; real keys are single characters
+_WORD_END = 'word'
+_PREFIX_END = 'prefix'
+
+
+def _normalise(terms: Iterable[str]) -> Tuple[str, ...]:
+    cleaned = []
+    for term in terms:
+        # lower(), not casefold(): the pattern is matched against the raw text with IGNORECASE,
+        # which would never match a folded term like 'strasse' against 'Straße'
+        term = str(term).strip().lower()
+        if term.rstrip('*') and len(term) <= MAX_TERM_LENGTH:
+            cleaned.append(term)
+    return tuple(sorted(set(cleaned))[:MAX_TERMS])
+
+
+def _trie_pattern(node: dict) -> str:
+    if node.get(_PREFIX_END):
+        # Anything may follow, so longer terms under this one are redundant
+        return ''
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if len(char) == 1]
+    if node.get(_WORD_END):
+        alternatives.append(r'(?!\w)')
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return '(?:' + '|'.join(alternatives) + ')'
+
+
+def compile_terms(terms: Iterable[str]) -> Optional[Pattern]:
+    """One case-insensitive pattern matching any of the terms, or None if there are none"""
+    terms = _normalise(terms)
+    if not terms:
+        return None
+    root: dict = {}
+    for term in terms:
+        prefix = term.endswith('*')
+        node = root
+        for char in term.rstrip('*'):
+            node = node.setdefault(char, {})
+        node[_PREFIX_END if prefix else _WORD_END] = True
+    return re.compile(r'(?<!\w)' + _trie_pattern(root), re.IGNORECASE)
+
+
+class ContentFilter:
+    """Compiled banned-term patterns per guild"""
+
+    def __init__(self):
+        # guild_id -> (terms list the pattern was built from, normalised terms, pattern)
+        self._patterns: Dict[int, tuple] = {}
+        self.compiles = 0
+        self.scans = 0
+        self.matches = 0
+
+    def _pattern(self, guild_id: int, terms: List[str]) -> Optional[Pattern]:
+        cached = self._patterns.get(guild_id)
+        # Cached configs are reused as-is until they expire, so identity is the usual hit
+        if cached is not None and cached[0] is terms:
+            return cached[2]
+        normalised = _normalise(terms)
+        if cached is not None and cached[1] == normalised:
+            self._patterns[guild_id] = (terms, normalised, cached[2])
+            return cached[2]
+        pattern = compile_terms(normalised)
+        self.compiles += 1
+        self._patterns[guild_id] = (terms, normalised, pattern)
+        return pattern
+
+    def scan(self, guild_id: int, terms: List[str], text: str) -> Optional[str]:
+        """The first banned term found in ``text``, or None"""
+        if not text or not terms:
+            return None
+        pattern = self._pattern(guild_id, terms)
+        if pattern is None:
+            return None
+        self.scans += 1
+        match = pattern.search(text)
+        if match is None:
+            return None
+        self.matches += 1
+        return match.group(0)
+
+    def forget(self, guild_id: int):
+        self._patterns.pop(guild_id, None)
+
+    def stats(self) -> dict:
+        return {
+            'guilds': len(self._patterns),
+            'compiles': self.compiles,
+            'scans': self.scans,
+            'matches': self.matches,
+        }
+
+
+def _random_word(rng: random.Random, low: int, high: int) -> str:
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the filter's throughput on synthetic messages")
+    parser.add_argument('--terms', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=20, help="Words per message")
+    parser.add_argument('--hit-rate', type=float, default=0.01, help="Fraction of messages containing a term")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    terms = [_random_word(rng, 4, 10) + ('*' if index % 10 == 0 else '') for index in range(args.terms)]
+    messages = []
+    for _ in range(args.messages):
+        words = [_random_word(rng, 2, 9) for _ in range(args.words)]
+        if rng.random() < args.hit_rate:
+            words[rng.randrange(len(words))] = rng.choice(terms).rstrip('*').upper()
+        messages.append(' '.join(words))
+
+    engine = ContentFilter()
+    started = time.perf_counter()
+    engine.scan(0, terms, '')
+    engine.scan(0, terms, 'warm up')
+    compile_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matched = sum(1 for message in messages if engine.scan(0, terms, message))
+    elapsed = time.perf_counter() - started
+    print(f"{args.terms} terms compiled in {compile_seconds * 1000:.1f}ms")
+    print(f"{args.messages} messages of {args.words} words in {elapsed:.3f}s: "
+          f"{args.messages / elapsed:,.0f} msgs/s on one core, {matched} matched")
+    print(engine.stats())
+
+
+if __name__ == '__main__':
+    main()
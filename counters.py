@@ -0,0 +1,110 @@
+"""Write-behind aggregation of the per-guild counters stored on the ``server`` table."""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, update
+
+from sqlmodels import Server, get_engine
+
+logger = logging.getLogger('ModBot')
+
+
+class ServerCounters:
+    """Accumulate ``voice_time``/``download_count`` deltas per guild and flush them in batches.
+
+    Each flush applies every pending delta with one ``UPDATE ... CASE`` statement
+    per chunk of guilds, run in a worker thread. Deltas from a failed flush are
+    merged back so they are retried on the next one.
+    """
+
+    def __init__(self, flush_interval: float = 60.0, chunk_size: int = 500):
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        # discord_id -> [voice_time seconds, download_count]
+        self._deltas: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0])
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.last_flush_at: Optional[datetime] = None
+        self.last_flush_rows = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of guilds with deltas waiting to be flushed"""
+        return len(self._deltas)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "last_flush_rows": self.last_flush_rows,
+        }
+
+    def add_voice_time(self, guild_id: int, seconds: float):
+        if seconds > 0:
+            self._deltas[str(guild_id)][0] += seconds
+
+    def add_downloads(self, guild_id: int, count: int = 1):
+        self._deltas[str(guild_id)][1] += count
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="server-counters")
+
+    async def close(self, retries: int = 3):
+        """Stop the periodic flush and flush whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for attempt in range(retries):
+            if await self.flush():
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logger.error(f"Lost counter deltas for {self.pending} guilds on shutdown")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """Apply all pending deltas; returns False if they had to be requeued"""
+        async with self._lock:
+            if not self._deltas:
+                return True
+            deltas, self._deltas = self._deltas, defaultdict(lambda: [0.0, 0])
+            try:
+                await asyncio.to_thread(self._apply, deltas)
+            except Exception as e:
+                logger.error(f"Error flushing server counters for {len(deltas)} guilds: {str(e)}")
+                for discord_id, (voice_time, downloads) in deltas.items():
+                    self._deltas[discord_id][0] += voice_time
+                    self._deltas[discord_id][1] += downloads
+                return False
+
+            self.last_flush_at = datetime.utcnow()
+            self.last_flush_rows = len(deltas)
+            return True
+
+    def _apply(self, deltas: Dict[str, List[float]]):
+        items = list(deltas.items())
+        with get_engine().begin() as conn:
+            for start in range(0, len(items), self.chunk_size):
+                chunk = dict(items[start:start + self.chunk_size])
+                voice_time = {discord_id: delta[0] for discord_id, delta in chunk.items() if delta[0]}
+                downloads = {discord_id: delta[1] for discord_id, delta in chunk.items() if delta[1]}
+
+                values = {}
+                if voice_time:
+                    values['voice_time'] = Server.voice_time + case(voice_time, value=Server.discord_id, else_=0)
+                if downloads:
+                    values['download_count'] = Server.download_count + case(downloads, value=Server.discord_id, else_=0)
+                if values:
+                    conn.execute(update(Server).where(Server.discord_id.in_(list(chunk))).values(**values))
@@ -0,0 +1,535 @@
+"""Audio/video downloads for the download_audio and download_video features.
+
+Extraction (yt-dlp) and transcoding (FFmpeg) run in a process pool so the
+event loop never blocks on them. Each guild has a small bounded queue that is
+worked through one job at a time, which keeps a single busy guild from taking
+every worker. Finished files are handed back as paths so they can be streamed
+to Discord from disk instead of being read into memory.
+
+With a ``MediaCache`` the cache is checked before anything is queued, finished
+files are moved into it, and identical requests already being processed are
+joined instead of downloaded twice.
+
+Links must be http(s) and resolve to public addresses; live streams and media
+longer than ``DOWNLOAD_MAX_DURATION`` seconds are refused before anything is
+downloaded. A job that outlives ``job_timeout`` gets its pool retired: new jobs
+go to a fresh pool and the old one's processes are killed once its other jobs
+finish, then the stuck job's partial files are removed.
+
+The bot only accepts local files as sources when ``DOWNLOAD_ALLOW_LOCAL=1``.
+Running this module pushes local files through the same pipeline, without
+Discord or the network:
+
+    python downloads.py /path/to/media.mp4 /path/to/other.webm --kind audio --workers 2
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import glob
+import ipaddress
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+from media_cache import MediaCache, cache_key
+from usage import UsageRollups, download_counters
+from write_behind import WriteBehindBuffer
+
+logger = logging.getLogger('ModBot')
+
+KINDS = ('audio', 'video')
+# Discord's upload limit for guilds without boosts
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+# Longer media would not fit the upload limit anyway and only ties up a worker
+MAX_DURATION = int(os.getenv('DOWNLOAD_MAX_DURATION', '3600'))
+
+
+class DownloadError(Exception):
+    """The media could not be fetched or converted"""
+
+
+class MediaTooLarge(DownloadError):
+    """The media is over the guild's upload limit"""
+
+
+class DownloadQueueFull(DownloadError):
+    """The guild already has the maximum number of downloads queued"""
+
+
+class DownloadResult:
+    """A finished download on local disk"""
+
+    def __init__(self, path: str, filename: str, title: str, size: int, seconds: float, cached: bool = False,
+                 temporary: bool = True):
+        self.path = path
+        self.filename = filename
+        self.title = title
+        self.size = size
+        self.seconds = seconds
+        # Served from the media cache without any work
+        self.cached = cached
+        # Deleted after delivery; files owned by the media cache are not
+        self.temporary = temporary
+
+
+def is_local_source(source: str) -> bool:
+    return source.startswith('file://') or '://' not in source
+
+
+def _local_path(source: str) -> str:
+    return source[len('file://'):] if source.startswith('file://') else source
+
+
+def _ffmpeg_audio(path: str, output: str, max_bytes: int):
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', path, '-vn',
+         '-c:a', 'libmp3lame', '-q:a', '4', '-fs', str(max_bytes + 1), output],
+        check=True, capture_output=True, timeout=600,
+    )
+
+
+def _fetch_local(path: str, kind: str, workdir: str, token: str, max_bytes: int) -> dict:
+    if not os.path.isfile(path):
+        raise DownloadError(f"No such file: {path}")
+    title, ext = os.path.splitext(os.path.basename(path))
+    if kind == 'audio' and shutil.which('ffmpeg'):
+        output = os.path.join(workdir, f'{token}.mp3')
+        _ffmpeg_audio(path, output, max_bytes)
+    else:
+        # Without FFmpeg (or for video) the file is delivered as it is
+        if os.path.getsize(path) > max_bytes:
+            raise MediaTooLarge(f"{title} is over the {max_bytes // (1024 * 1024)} MiB upload limit")
+        output = os.path.join(workdir, f'{token}{ext}')
+        shutil.copyfile(path, output)
+    return {'path': output, 'title': title}
+
+
+_system_getaddrinfo = socket.getaddrinfo
+
+
+def _is_public(address: str) -> bool:
+    return ipaddress.ip_address(address.split('%')[0]).is_global
+
+
+def check_public_url(url: str):
+    """Reject anything but http(s) URLs whose host only resolves to public addresses"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise DownloadError("Only http(s) links are supported")
+    try:
+        addresses = {info[4][0] for info in _system_getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise DownloadError(f"Could not resolve {parts.hostname}") from None
+    if not all(_is_public(address) for address in addresses):
+        raise DownloadError("Links to private or local addresses are not allowed")
+
+
+def _public_getaddrinfo(host, *args, **kwargs):
+    results = _system_getaddrinfo(host, *args, **kwargs)
+    if not all(_is_public(result[4][0]) for result in results):
+        raise socket.gaierror(f"{host} resolves to a private or local address")
+    return results
+
+
+def _guard_connections():
+    """Make every connection of this worker process fail for non-public addresses.
+
+    yt-dlp follows redirects and extractors fetch further URLs on their own, so
+    checking the submitted link alone is not enough.
+    """
+    socket.getaddrinfo = _public_getaddrinfo
+
+
+def _fetch_remote(url: str, kind: str, workdir: str, token: str, max_bytes: int) -> dict:
+    import yt_dlp
+
+    check_public_url(url)
+    _guard_connections()
+
+    options = {
+        'outtmpl': os.path.join(workdir, f'{token}.%(ext)s'),
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        # Skips the download instead of fetching and then rejecting it
+        'max_filesize': max_bytes,
+    }
+    if kind == 'audio':
+        options['format'] = 'bestaudio/best'
+        options['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '128'}]
+    else:
+        options['format'] = f'best[ext=mp4][filesize<{max_bytes}]/best[filesize<{max_bytes}]/best[filesize_approx<{max_bytes}]/best'
+
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+            # Live streams never finish and would hold the worker until the job timeout
+            if info.get('is_live') or info.get('live_status') in ('is_live', 'is_upcoming', 'post_live'):
+                raise DownloadError("Live streams cannot be downloaded")
+            if (info.get('duration') or 0) > MAX_DURATION:
+                raise DownloadError(f"Media longer than {MAX_DURATION // 60} minutes cannot be downloaded")
+            # Where the link ended up and what FFmpeg would be pointed at, not just the submitted link
+            for resolved in [info.get('webpage_url')] + [fmt.get('url') for fmt in info.get('requested_formats') or [info]]:
+                if resolved:
+                    check_public_url(resolved)
+            info = ydl.process_ie_result(info, download=True)
+    except DownloadError:
+        raise
+    except Exception as e:
+        # yt-dlp's exceptions do not always survive pickling back to the parent
+        raise DownloadError(str(e)) from None
+
+    files = glob.glob(os.path.join(workdir, f'{token}.*'))
+    if not files:
+        raise MediaTooLarge(f"{info.get('title', url)} is over the {max_bytes // (1024 * 1024)} MiB upload limit")
+    return {'path': files[0], 'title': info.get('title') or token}
+
+
+def fetch_media(source: str, kind: str, workdir: str, max_bytes: int, token: str) -> dict:
+    """Download and convert one source into ``workdir/<token>.*``; runs in a worker process"""
+    started = time.perf_counter()
+    os.makedirs(workdir, exist_ok=True)
+    if is_local_source(source):
+        result = _fetch_local(_local_path(source), kind, workdir, token, max_bytes)
+    else:
+        result = _fetch_remote(source, kind, workdir, token, max_bytes)
+
+    size = os.path.getsize(result['path'])
+    if size > max_bytes:
+        os.remove(result['path'])
+        raise MediaTooLarge(f"{result['title']} is over the {max_bytes // (1024 * 1024)} MiB upload limit")
+    result['size'] = size
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+class DownloadManager:
+    """Per-guild download queues in front of a shared process pool.
+
+    ``submit`` fails fast with ``DownloadQueueFull`` once a guild has
+    ``per_guild_queue`` jobs waiting. Completed downloads are recorded in
+    ``DownloadActivities`` in batches and counted towards ``Server.download_count``.
+    """
+
+    def __init__(self, activities, counters, workers: int = 2, per_guild_queue: int = 3, job_timeout: float = 300.0,
+                 workdir: Optional[str] = None, allow_local: Optional[bool] = None, idle_timeout: float = 60.0,
+                 cache: Optional[MediaCache] = None, rollups: Optional[UsageRollups] = None):
+        self.activities = WriteBehindBuffer(activities, batch_size=50, flush_interval=5.0)
+        self.counters = counters
+        self.rollups = rollups
+        self.workers = workers
+        self.per_guild_queue = per_guild_queue
+        self.job_timeout = job_timeout
+        self.idle_timeout = idle_timeout
+        self.workdir = workdir or os.path.join(tempfile.gettempdir(), 'protonn-downloads')
+        if allow_local is None:
+            allow_local = os.getenv('DOWNLOAD_ALLOW_LOCAL', '0').lower() in ('1', 'true', 'yes')
+        self.allow_local = allow_local
+        self.cache = cache
+
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # Jobs running in the current pool, so a retired pool is only killed once they are done
+        self._pool_jobs: Set[asyncio.Future] = set()
+        self._retiring: Set[asyncio.Task] = set()
+        # retired pool -> tokens of its timed-out jobs, whose partial files go once it is killed
+        self._retired: Dict[concurrent.futures.ProcessPoolExecutor, List[str]] = {}
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._consumers: Dict[int, asyncio.Task] = {}
+        # cache key -> future of the download already running for it
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self.activities.start()
+        self._sweep_workdir()
+
+    def _sweep_workdir(self):
+        """Remove partial files left behind by jobs that were killed or crashed"""
+        cutoff = time.time() - self.job_timeout
+        for path in glob.glob(os.path.join(self.workdir, '*')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_job_files(self, token: str):
+        for path in glob.glob(os.path.join(self.workdir, f'{token}.*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def queued(self, guild_id: int) -> int:
+        queue = self._queues.get(guild_id)
+        return queue.qsize() if queue else 0
+
+    def _get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        # Created on first use so idle bots do not keep worker processes around
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def submit(self, guild_id: int, user_id: int, source: str, kind: str,
+                     max_bytes: int = DEFAULT_MAX_BYTES) -> DownloadResult:
+        """Queue a download for the guild and wait for the file"""
+        if kind not in KINDS:
+            raise DownloadError(f"Unknown download kind {kind!r}")
+        if is_local_source(source):
+            if not self.allow_local:
+                raise DownloadError("Only http(s) links can be downloaded")
+        elif urlsplit(source).scheme not in ('http', 'https'):
+            raise DownloadError("Only http(s) links can be downloaded")
+
+        if self.cache is not None:
+            entry = self.cache.get(cache_key(source, kind), max_bytes)
+            if entry is not None:
+                return DownloadResult(entry.path, self._filename(entry.title, entry.path), entry.title, entry.size, 0.0,
+                                      cached=True, temporary=False)
+
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = asyncio.Queue(maxsize=self.per_guild_queue)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            queue.put_nowait(((guild_id, user_id, source, kind, max_bytes), future))
+        except asyncio.QueueFull:
+            raise DownloadQueueFull(f"This server already has {self.per_guild_queue} downloads queued") from None
+        if guild_id not in self._consumers:
+            self._consumers[guild_id] = asyncio.create_task(self._consume(guild_id, queue))
+        return await future
+
+    async def _consume(self, guild_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                job, future = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[guild_id]
+                    del self._consumers[guild_id]
+                    return
+                continue
+            if future.cancelled():
+                continue
+            try:
+                result = await self._run(*job)
+                self.completed += 1
+                if not future.cancelled():
+                    future.set_result(result)
+                else:
+                    self.discard(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_exception(DownloadError("The bot is shutting down"))
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+
+    @staticmethod
+    def _filename(title: str, path: str) -> str:
+        return f"{title[:80]}{os.path.splitext(path)[1]}"
+
+    async def _run(self, guild_id: int, user_id: int, source: str, kind: str, max_bytes: int) -> DownloadResult:
+        if self.cache is None:
+            return await self._fetch(source, kind, max_bytes)
+
+        key = cache_key(source, kind)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            result = await asyncio.shield(inflight)
+            if result.size <= max_bytes:
+                return result
+        # Another guild may have finished the same request while this job was queued
+        entry = self.cache.get(key, max_bytes, count=False)
+        if entry is not None:
+            return DownloadResult(entry.path, self._filename(entry.title, entry.path), entry.title, entry.size, 0.0,
+                                  cached=True, temporary=False)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._fetch(source, kind, max_bytes)
+            entry = await asyncio.to_thread(self.cache.put, key, result.path, result.title)
+            result.path = entry.path
+            result.temporary = False
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Joined requests see the error; nobody else has to retrieve it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _fetch(self, source: str, kind: str, max_bytes: int) -> DownloadResult:
+        loop = asyncio.get_running_loop()
+        token = uuid.uuid4().hex
+        pool = self._get_pool()
+        job = loop.run_in_executor(pool, fetch_media, source, kind, self.workdir, max_bytes, token)
+        self._pool_jobs.add(job)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(job), timeout=self.job_timeout)
+        except asyncio.TimeoutError:
+            self._retire_pool(pool, job, token)
+            raise DownloadError(f"Download took longer than {self.job_timeout:.0f}s") from None
+        except Exception:
+            self._remove_job_files(token)
+            raise
+        finally:
+            self._pool_jobs.discard(job)
+        return DownloadResult(result['path'], self._filename(result['title'], result['path']), result['title'],
+                              result['size'], result['seconds'])
+
+    def _retire_pool(self, pool: concurrent.futures.ProcessPoolExecutor, stuck: asyncio.Future, token: str):
+        """Move new jobs to a fresh pool and kill the old one once its other jobs are done"""
+        if pool in self._retired:
+            # Another job in the same pool timed out first; its task kills the pool
+            self._retired[pool].append(token)
+            return
+        if pool is not self._pool:
+            return
+        others = self._pool_jobs - {stuck}
+        self._pool = None
+        self._pool_jobs = set()
+        self._retired[pool] = [token]
+        logger.warning(f"Recycling the download pool after a job ran over {self.job_timeout:.0f}s")
+        task = asyncio.create_task(self._terminate(pool, others))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _terminate(self, pool: concurrent.futures.ProcessPoolExecutor, others: Set[asyncio.Future]):
+        if others:
+            await asyncio.wait(others, timeout=self.job_timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+        # The executor has no per-job cancellation; stop its processes directly
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        await asyncio.sleep(1)
+        for token in self._retired.pop(pool, []):
+            self._remove_job_files(token)
+
+    async def record(self, guild_id: int, user_id: int, kind: str, source: str, result: DownloadResult):
+        """Count a delivered download; written to Mongo and MySQL in batches"""
+        self.counters.add_downloads(guild_id)
+        if self.rollups is not None:
+            self.rollups.add(guild_id, download_counters(kind, result.size, result.cached))
+        await self.activities.put({
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "kind": kind,
+            "source": source,
+            "size": result.size,
+            "cached": result.cached,
+            "rolled_up": self.rollups is not None,
+            "created_at": datetime.utcnow()
+        })
+
+    def forget(self, source: str, kind: str):
+        """Drop a cached result whose file is gone, so the next submit downloads it again"""
+        if self.cache is not None:
+            self.cache.forget(cache_key(source, kind))
+
+    def discard(self, result: DownloadResult):
+        """Remove a delivered file unless the media cache owns it"""
+        if not result.temporary:
+            return
+        try:
+            os.remove(result.path)
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        """Fail queued jobs, stop the workers and flush the activity records"""
+        for task in self._consumers.values():
+            task.cancel()
+        for queue in self._queues.values():
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                if not future.done():
+                    future.set_exception(DownloadError("The bot is shutting down"))
+        self._consumers.clear()
+        self._queues.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for task in self._retiring:
+            task.cancel()
+        for pool in self._retired:
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in list((getattr(pool, '_processes', None) or {}).values()):
+                if process.is_alive():
+                    process.terminate()
+        self._retired.clear()
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.sync)
+        await self.activities.close()
+
+
+class _NullCounters:
+    def add_downloads(self, guild_id: int, count: int = 1):
+        pass
+
+
+class _NullCollection:
+    name = 'DownloadActivities'
+
+    async def insert_many(self, documents, ordered=False):
+        pass
+
+
+async def _benchmark(sources, kind: str, workers: int, max_bytes: int, cache_dir: Optional[str], rounds: int):
+    cache = MediaCache(cache_dir) if cache_dir else None
+    manager = DownloadManager(_NullCollection(), _NullCounters(), workers=workers, per_guild_queue=len(sources),
+                              allow_local=True, cache=cache)
+    manager.start()
+    for round_number in range(1, rounds + 1):
+        started = time.perf_counter()
+        # One guild per source so the jobs spread over the pool
+        results = await asyncio.gather(
+            *(manager.submit(index, 0, source, kind, max_bytes) for index, source in enumerate(sources)),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - started
+        for source, result in zip(sources, results):
+            if isinstance(result, Exception):
+                print(f"{source}: {type(result).__name__}: {result}")
+            else:
+                origin = 'cache' if result.cached else f'{result.seconds:.2f}s'
+                print(f"{source}: {result.filename} {result.size / 1024:.0f} KiB ({origin})")
+                manager.discard(result)
+        print(f"round {round_number}: {len(sources)} jobs on {workers} workers in {elapsed:.3f}s")
+    if cache is not None:
+        print(f"cache: {cache.stats()}")
+    await manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local media files through the download pipeline")
+    parser.add_argument('sources', nargs='+')
+    parser.add_argument('--kind', choices=KINDS, default='audio')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-mib', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024))
+    parser.add_argument('--cache', help="Media cache directory; repeated rounds are then served from it")
+    parser.add_argument('--rounds', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.sources, args.kind, args.workers, args.max_mib * 1024 * 1024, args.cache, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
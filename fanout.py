@@ -0,0 +1,124 @@
+"""Bounded-concurrency fan-out of per-guild work for the background loops."""
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import discord
+
+logger = logging.getLogger('ModBot')
+
+
+def guild_bucket(guild_id: int, buckets: int) -> int:
+    """Stable bucket of a guild, the same across restarts and processes"""
+    return zlib.crc32(guild_id.to_bytes(8, 'little')) % buckets
+
+
+class GuildFanout:
+    """Run a coroutine for every guild with at most ``concurrency`` in flight.
+
+    Guilds are split into ``buckets`` hash buckets whose start times are spread
+    over the first ``spread`` fraction of the ``budget``, so a tick does not hit
+    Discord and the datastores all at once. Guilds not started before the budget
+    runs out are skipped and go first on the next tick. Work already in flight
+    is never cancelled, since a half-done send would be repeated next tick; the
+    tick stops waiting for it at the end of the budget instead, and the guild
+    is left out of later ticks until it finishes.
+    """
+
+    def __init__(self, name: str, concurrency: int = 10, budget: Optional[float] = None, buckets: int = 1,
+                 spread: float = 0.5, history: int = 20):
+        self.name = name
+        self.concurrency = concurrency
+        self.budget = budget
+        self.buckets = max(1, buckets)
+        self.spread = spread
+        self.ticks = deque(maxlen=history)
+        self._carry: Set[int] = set()
+        # guild_id -> work that outlived its tick's budget and is still running
+        self._stalled: Dict[int, asyncio.Task] = {}
+
+    def _schedule(self, guilds: List[discord.Guild]) -> List[tuple]:
+        """(start offset, guild) pairs, carried-over guilds first"""
+        step = (self.budget or 0) * self.spread / self.buckets
+        schedule = []
+        for guild in guilds:
+            if guild.id in self._carry:
+                schedule.append((0.0, -1, guild))
+            else:
+                bucket = guild_bucket(guild.id, self.buckets)
+                schedule.append((bucket * step, bucket, guild))
+        schedule.sort(key=lambda item: (item[0], item[1]))
+        return [(offset, guild) for offset, _, guild in schedule]
+
+    async def _run_one(self, fn: Callable[[discord.Guild], Awaitable], guild: discord.Guild, semaphore: asyncio.Semaphore,
+                       tick: dict):
+        try:
+            await fn(guild)
+            tick['processed'] += 1
+        except Exception as e:
+            tick['failed'] += 1
+            logger.error(f"Error in {self.name} for guild {guild.id}: {str(e)}")
+        finally:
+            semaphore.release()
+
+    async def run(self, guilds: Iterable[discord.Guild], fn: Callable[[discord.Guild], Awaitable]) -> dict:
+        """Process the guilds and return this tick's coverage"""
+        self._stalled = {guild_id: task for guild_id, task in self._stalled.items() if not task.done()}
+        busy = {guild.id for guild in guilds if guild.id in self._stalled}
+        guilds = [guild for guild in guilds if guild.id not in busy]
+        started = time.monotonic()
+        deadline = started + self.budget if self.budget else None
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tick = {'started_at': time.time(), 'guilds': len(guilds) + len(busy), 'processed': 0, 'failed': 0, 'skipped': 0,
+                'stalled': 0}
+        running: Dict[int, asyncio.Task] = {}
+        skipped: Set[int] = set()
+
+        schedule = self._schedule(guilds)
+        for index, (offset, guild) in enumerate(schedule):
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                if deadline is None:
+                    await semaphore.acquire()
+                else:
+                    await asyncio.wait_for(semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                skipped = {guild.id for _, guild in schedule[index:]}
+                break
+            running[guild.id] = asyncio.create_task(self._run_one(fn, guild, semaphore, tick))
+
+        if running:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait(running.values(), timeout=timeout)
+        # Stuck work keeps running, but no longer holds up the tick
+        stalled = {guild_id: task for guild_id, task in running.items() if not task.done()}
+        self._stalled.update(stalled)
+
+        self._carry = skipped | busy
+        tick['skipped'] = len(skipped) + len(busy)
+        tick['stalled'] = len(stalled)
+        tick['duration'] = round(time.monotonic() - started, 3)
+        total = tick['guilds']
+        tick['coverage'] = round((tick['processed'] + tick['failed']) / total, 4) if total else 1.0
+        self.ticks.append(tick)
+        if skipped or busy or stalled:
+            logger.warning(
+                f"{self.name} covered {tick['coverage']:.0%} of {total} guilds within {self.budget:.0f}s, "
+                f"{tick['skipped']} carried over to the next tick, {len(stalled)} still running"
+            )
+        return tick
+
+    def stats(self) -> dict:
+        last = self.ticks[-1] if self.ticks else None
+        return {
+            'last_tick': last,
+            'avg_coverage': round(sum(t['coverage'] for t in self.ticks) / len(self.ticks), 4) if self.ticks else None,
+            'avg_duration': round(sum(t['duration'] for t in self.ticks) / len(self.ticks), 3) if self.ticks else None,
+            'carried_over': len(self._carry),
+            'stalled': sum(1 for task in self._stalled.values() if not task.done()),
+        }
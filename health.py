@@ -0,0 +1,211 @@
+"""Liveness and readiness endpoints for the orchestrator.
+
+``/healthz`` answers whether the process is alive: the event loop is responsive
+and the background loops keep beating. ``/readyz`` answers whether it should
+receive traffic: the gateway is connected, the required datastores answered
+the last probe and no shutdown is in progress. Datastore pings run in a
+background probe so the endpoints never touch the databases themselves.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from discord.ext import tasks
+
+logger = logging.getLogger('ModBot')
+
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8002'))
+
+
+def _ms(seconds: float) -> Optional[float]:
+    """Gateway latency is nan/inf until the first heartbeat ack"""
+    if seconds != seconds or seconds == float('inf'):
+        return None
+    return round(seconds * 1000, 1)
+
+
+class HealthMonitor:
+    """Background probes and the HTTP endpoints that report them"""
+
+    def __init__(self, bot, port: int = HEALTH_PORT, probe_interval: float = 10.0, probe_timeout: float = 3.0,
+                 lag_interval: float = 0.5, max_loop_lag: float = 5.0):
+        self.bot = bot
+        self.port = port
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.lag_interval = lag_interval
+        self.max_loop_lag = max_loop_lag
+
+        self._probes: Dict[str, dict] = {}
+        self._loops: Dict[str, dict] = {}
+        self._statuses: Dict[str, Callable[[], dict]] = {}
+        self.loop_lag = 0.0
+        self.max_recent_lag = 0.0
+        self.started = time.time()
+        # The loops wait for the gateway, so their staleness clock starts once the bot is ready
+        self.ready_since: Optional[float] = None
+
+        self._tasks = []
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_probe(self, name: str, ping: Callable[[], Awaitable], required: bool = True):
+        """Ping a dependency every probe interval; required ones gate readiness"""
+        self._probes[name] = {'ping': ping, 'required': required, 'ok': None, 'latency_ms': None,
+                              'error': None, 'checked_at': None}
+
+    def add_status(self, name: str, status: Callable[[], dict]):
+        """Include extra state (e.g. circuit breakers) in the /readyz body"""
+        self._statuses[name] = status
+
+    def watch_loop(self, name: str, loop: tasks.Loop, interval: float):
+        """Expect ``heartbeat(name)`` from a background loop at least every ``interval`` seconds"""
+        self._loops[name] = {'loop': loop, 'interval': interval, 'last_beat': None}
+
+    def heartbeat(self, name: str):
+        if name in self._loops:
+            self._loops[name]['last_beat'] = time.time()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._probe_loop()), asyncio.create_task(self._lag_loop())]
+
+        app = web.Application()
+        app.router.add_get('/healthz', self.healthz)
+        app.router.add_get('/readyz', self.readyz)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
+        logger.info(f"Health endpoints listening on port {self.port}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _probe(self, name: str, probe: dict):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe['ping'](), timeout=self.probe_timeout)
+            probe.update(ok=True, error=None, latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        except Exception as e:
+            probe.update(ok=False, error=str(e) or type(e).__name__, latency_ms=None)
+            logger.warning(f"Health probe {name} failed: {probe['error']}")
+        probe['checked_at'] = time.time()
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self._probe(name, probe) for name, probe in self._probes.items()))
+            await asyncio.sleep(self.probe_interval)
+
+    async def _lag_loop(self):
+        """Measure how late the loop wakes up from a short sleep"""
+        window_started = time.monotonic()
+        previous_max = current_max = 0.0
+        while True:
+            expected = time.monotonic() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, time.monotonic() - expected)
+            current_max = max(current_max, self.loop_lag)
+            if time.monotonic() - window_started >= 60:
+                previous_max, current_max = current_max, 0.0
+                window_started = time.monotonic()
+            # Worst lag seen over the last one to two minutes
+            self.max_recent_lag = max(previous_max, current_max)
+
+    def gateway_status(self) -> dict:
+        bot = self.bot
+        shards = {}
+        if getattr(bot, 'shards', None):
+            for shard_id, shard in bot.shards.items():
+                shards[shard_id] = {'closed': shard.is_closed(), 'latency_ms': _ms(shard.latency)}
+        else:
+            ws = bot.ws
+            shards[bot.shard_id or 0] = {
+                'closed': ws is None or not ws.open,
+                'latency_ms': _ms(bot.latency),
+            }
+        return {
+            'ready': bot.is_ready(),
+            'closed': bot.is_closed(),
+            'guilds': len(bot.guilds),
+            'shard_count': bot.shard_count or 1,
+            'shards': shards,
+        }
+
+    def loop_status(self) -> Dict[str, dict]:
+        now = time.time()
+        if self.ready_since is None and self.bot.is_ready():
+            self.ready_since = now
+        status = {}
+        for name, watched in self._loops.items():
+            since = watched['last_beat'] or self.ready_since
+            age = now - since if since else None
+            loop: tasks.Loop = watched['loop']
+            status[name] = {
+                'running': loop.is_running(),
+                'failed': loop.failed(),
+                'last_beat_age_s': round(age, 1) if age is not None else None,
+                # A missed iteration plus some slack before the loop counts as stuck
+                'stale': age is not None and age > watched['interval'] * 2 + 60,
+            }
+        return status
+
+    def probe_status(self) -> Dict[str, dict]:
+        now = time.time()
+        return {
+            name: {
+                'ok': probe['ok'],
+                'required': probe['required'],
+                'latency_ms': probe['latency_ms'],
+                'error': probe['error'],
+                'age_s': round(now - probe['checked_at'], 1) if probe['checked_at'] else None,
+            }
+            for name, probe in self._probes.items()
+        }
+
+    def is_alive(self) -> bool:
+        if self.loop_lag > self.max_loop_lag:
+            return False
+        return not any(loop['stale'] or loop['failed'] for loop in self.loop_status().values())
+
+    def is_ready(self) -> bool:
+        gateway = self.gateway_status()
+        if not gateway['ready'] or gateway['closed'] or any(shard['closed'] for shard in gateway['shards'].values()):
+            return False
+        shutdown = getattr(self.bot, 'shutdown', None)
+        if shutdown is not None and not shutdown.accepting:
+            return False
+        stale_after = self.probe_interval * 3 + self.probe_timeout
+        for probe in self.probe_status().values():
+            if probe['required'] and (not probe['ok'] or probe['age_s'] is None or probe['age_s'] > stale_after):
+                return False
+        return self.is_alive()
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        alive = self.is_alive()
+        body = {
+            'status': 'ok' if alive else 'unhealthy',
+            'uptime_s': round(time.time() - self.started, 1),
+            'loop_lag_ms': round(self.loop_lag * 1000, 1),
+            'max_loop_lag_ms': round(self.max_recent_lag * 1000, 1),
+            'loops': self.loop_status(),
+        }
+        return web.json_response(body, status=200 if alive else 503)
+
+    async def readyz(self, request: web.Request) -> web.Response:
+        ready = self.is_ready()
+        body = {
+            'status': 'ready' if ready else 'not ready',
+            'gateway': self.gateway_status(),
+            'dependencies': self.probe_status(),
+            'loop_lag_ms': round(self.loop_lag * 1000, 1),
+            'loops': self.loop_status(),
+        }
+        for name, status in self._statuses.items():
+            body[name] = status()
+        return web.json_response(body, status=200 if ready else 503)
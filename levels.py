@@ -0,0 +1,252 @@
+"""Message XP and levels for the level_rewards config, without a write per message.
+
+Awards are rate limited per member by ``cooldown`` and accumulated in memory;
+every ``flush_interval`` seconds the deltas go to ``MemberLevels`` as one
+unordered ``bulk_write`` of ``$inc`` upserts. Each member's running total and
+next level threshold are kept in a bounded LRU, so a level-up check is a single
+comparison against a precomputed table. Leaderboards read the
+``guild_id, xp`` index and are cached for a few seconds per guild.
+"""
+import asyncio
+import logging
+import random
+import time
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from resilience import mongo_store
+
+logger = logging.getLogger('ModBot')
+
+MAX_LEVEL = 1000
+
+# Returned by the stored-XP lookup when Mongo is unavailable
+_UNAVAILABLE = object()
+
+
+def xp_for_next_level(level: int) -> int:
+    """XP needed to go from ``level`` to ``level + 1``"""
+    return 5 * level ** 2 + 50 * level + 100
+
+
+# LEVEL_THRESHOLDS[n] is the total XP at which level n is reached
+LEVEL_THRESHOLDS: List[int] = [0]
+for _level in range(MAX_LEVEL):
+    LEVEL_THRESHOLDS.append(LEVEL_THRESHOLDS[-1] + xp_for_next_level(_level))
+
+
+def level_for_xp(xp: int) -> int:
+    return bisect_right(LEVEL_THRESHOLDS, xp) - 1
+
+
+class MemberXP:
+    __slots__ = ('xp', 'level', 'last_award')
+
+    def __init__(self, xp: Optional[int], last_award: float):
+        # None until the stored total has been read
+        self.xp = xp
+        self.level = level_for_xp(xp) if xp is not None else 0
+        self.last_award = last_award
+
+
+class LevelEngine:
+    """Award message XP in memory and flush it to Mongo in batches"""
+
+    def __init__(self, collection, cooldown: float = 60.0, xp_range: Tuple[int, int] = (15, 25),
+                 flush_interval: float = 30.0, max_members: int = 200000, leaderboard_ttl: float = 30.0):
+        self.collection = collection
+        self.cooldown = cooldown
+        self.xp_range = xp_range
+        self.flush_interval = flush_interval
+        self.max_members = max_members
+        self.leaderboard_ttl = leaderboard_ttl
+        # (guild_id, user_id) -> running totals, least recently active first
+        self._members: OrderedDict = OrderedDict()
+        # (guild_id, user_id) -> [xp, messages, highest level reached]
+        self._deltas: Dict[Tuple[int, int], list] = defaultdict(lambda: [0, 0, 0])
+        # The deltas a running flush swapped out, until its write has finished
+        self._inflight: Dict[Tuple[int, int], list] = {}
+        self._leaderboards: Dict[int, Tuple[float, List[dict]]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.awards = 0
+        self.on_cooldown = 0
+        self.last_flush_ops = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._deltas)
+
+    async def award(self, guild_id: int, user_id: int) -> Optional[int]:
+        """Give XP for a message; returns the new level on a level-up, otherwise None"""
+        key = (guild_id, user_id)
+        now = time.monotonic()
+        member = self._members.get(key)
+        if member is not None:
+            if now - member.last_award < self.cooldown:
+                self.on_cooldown += 1
+                return None
+            member.last_award = now
+            self._members.move_to_end(key)
+        else:
+            # Claim the cooldown before the lookup so messages sent meanwhile don't award twice
+            member = MemberXP(None, now)
+            self._members[key] = member
+            if len(self._members) > self.max_members:
+                self._members.popitem(last=False)
+
+        if member.xp is None:
+            if key in self._deltas or key in self._inflight:
+                # Unflushed XP from before the member was evicted; read with flushes held off so
+                # the stored total and the pending delta don't overlap or miss each other
+                async with self._lock:
+                    stored = await self._stored(guild_id, user_id)
+                    pending = self._deltas[key][0] if key in self._deltas else 0
+            else:
+                stored = await self._stored(guild_id, user_id)
+                pending = 0
+            if stored is _UNAVAILABLE:
+                # Without the stored total a level-up can't be detected; count the XP and look it up again next award
+                self._add_delta(key)
+                return None
+            member.xp = (stored.get("xp", 0) if stored else 0) + pending
+            member.level = level_for_xp(member.xp)
+
+        gained = self._add_delta(key)
+        member.xp += gained
+        delta = self._deltas[key]
+
+        if member.level < MAX_LEVEL and member.xp >= LEVEL_THRESHOLDS[member.level + 1]:
+            member.level = level_for_xp(member.xp)
+            delta[2] = max(delta[2], member.level)
+            return member.level
+        return None
+
+    async def _stored(self, guild_id: int, user_id: int):
+        return await mongo_store.call(
+            lambda: self.collection.find_one({"guild_id": guild_id, "user_id": user_id}, {"xp": 1, "_id": 0}),
+            fallback=_UNAVAILABLE
+        )
+
+    def _add_delta(self, key: Tuple[int, int]) -> int:
+        gained = random.randint(*self.xp_range)
+        delta = self._deltas[key]
+        delta[0] += gained
+        delta[1] += 1
+        self.awards += 1
+        return gained
+
+    async def rank(self, guild_id: int, user_id: int) -> Optional[dict]:
+        """A member's stored XP and level, including their unflushed XP"""
+        stored = await mongo_store.call(
+            lambda: self.collection.find_one({"guild_id": guild_id, "user_id": user_id}, {"xp": 1, "messages": 1, "_id": 0})
+        )
+        delta = self._deltas.get((guild_id, user_id), (0, 0, 0))
+        if stored is None and not delta[0]:
+            return None
+        xp = (stored or {}).get("xp", 0) + delta[0]
+        level = level_for_xp(xp)
+        position = await mongo_store.call(lambda: self.collection.count_documents({"guild_id": guild_id, "xp": {"$gt": xp}})) + 1
+        return {
+            "xp": xp,
+            "level": level,
+            "level_xp": xp - LEVEL_THRESHOLDS[level],
+            "level_needed": xp_for_next_level(level),
+            "messages": (stored or {}).get("messages", 0) + delta[1],
+            "position": position,
+        }
+
+    async def leaderboard(self, guild_id: int, limit: int = 10) -> List[dict]:
+        """Top members of a guild by XP, cached for ``leaderboard_ttl`` seconds"""
+        cached = self._leaderboards.get(guild_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1][:limit]
+        rows = await mongo_store.call(
+            lambda: self.collection.find({"guild_id": guild_id}, {"user_id": 1, "xp": 1, "_id": 0}).sort("xp", DESCENDING).limit(25).to_list(length=25)
+        )
+        for row in rows:
+            row["level"] = level_for_xp(row["xp"])
+        self._leaderboards[guild_id] = (time.monotonic() + self.leaderboard_ttl, rows)
+        return rows[:limit]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="level-engine")
+
+    async def close(self, retries: int = 3):
+        """Stop the periodic flush and flush whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for attempt in range(retries):
+            if await self.flush():
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logger.error(f"Lost XP for {self.pending} members on shutdown")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            # Expired leaderboards of guilds nobody asked about again
+            now = time.monotonic()
+            for guild_id in [guild_id for guild_id, (expires, _) in self._leaderboards.items() if expires <= now]:
+                del self._leaderboards[guild_id]
+
+    async def flush(self) -> bool:
+        """Write all pending XP with one bulk_write; returns False if it had to be requeued"""
+        async with self._lock:
+            if not self._deltas:
+                return True
+            deltas, self._deltas = self._deltas, defaultdict(lambda: [0, 0, 0])
+            self._inflight = deltas
+            keys = list(deltas)
+            operations = []
+            for guild_id, user_id in keys:
+                xp, messages, level = deltas[(guild_id, user_id)]
+                update = {"$inc": {"xp": xp, "messages": messages}}
+                if level:
+                    update["$max"] = {"level": level}
+                operations.append(UpdateOne({"guild_id": guild_id, "user_id": user_id}, update, upsert=True))
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # An unordered bulk write applies every op that has no error, so only those are retried
+                failed = [keys[error['index']] for error in e.details.get('writeErrors', [])]
+                logger.error(f"Error flushing XP for {len(failed)} of {len(operations)} members: {str(e)}")
+                self._requeue(deltas, failed)
+                return False
+            except Exception as e:
+                logger.error(f"Error flushing XP for {len(operations)} members: {str(e)}")
+                self._requeue(deltas, keys)
+                return False
+            finally:
+                self._inflight = {}
+            self.last_flush_ops = len(operations)
+            return True
+
+    def _requeue(self, deltas: Dict[Tuple[int, int], list], keys: Iterable[Tuple[int, int]]):
+        for key in keys:
+            xp, messages, level = deltas[key]
+            delta = self._deltas[key]
+            delta[0] += xp
+            delta[1] += messages
+            delta[2] = max(delta[2], level)
+
+    def stats(self) -> dict:
+        return {
+            'members': len(self._members),
+            'pending': self.pending,
+            'awards': self.awards,
+            'on_cooldown': self.on_cooldown,
+            'last_flush_ops': self.last_flush_ops,
+        }
@@ -0,0 +1,160 @@
+"""Non-blocking logging with structured output and rate limiting of repeated records.
+
+Records are put on a queue by a ``QueueHandler`` on the event loop thread and
+written by a ``QueueListener`` thread, so slow stdout/stderr never stalls the
+loop. Guild/command context is attached from context variables, and records
+repeated from the same call site are throttled before they are even queued.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+_guild_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('log_guild_id', default=None)
+_command: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('log_command', default=None)
+_user_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('log_user_id', default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_log_context(guild_id: Optional[int] = None, command: Optional[str] = None, user_id: Optional[int] = None):
+    """Attach context to every record logged from the current task"""
+    _guild_id.set(guild_id)
+    _command.set(command)
+    _user_id.set(user_id)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current guild/command/user context onto the record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.guild_id = _guild_id.get()
+        record.command = _command.get()
+        record.user_id = _user_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Throttle records repeated from the same call site.
+
+    Each call site (logger, file, line) may log ``burst`` records per ``window``
+    seconds; after that only one in ``sample_rate`` records gets through, and the
+    next record that does carries the number suppressed in between.
+    Records below ``min_level`` are never throttled.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0, sample_rate: int = 100, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.sample_rate = sample_rate
+        self.min_level = min_level
+        # call site -> [window start, records in window, suppressed since last emitted]
+        self._sites: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            suppressed = site[2] if site else 0
+            site = self._sites[key] = [now, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            if len(self._sites) > 10000:
+                self._sites = {key: site}
+
+        site[1] += 1
+        if site[1] <= self.burst or random.randrange(self.sample_rate) == 0:
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+            return True
+        site[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in ('guild_id', 'command', 'user_id', 'suppressed'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic format, with the context appended when present"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        context = ' '.join(
+            f'{field}={getattr(record, field)}'
+            for field in ('guild_id', 'command', 'user_id', 'suppressed')
+            if getattr(record, field, None) is not None
+        )
+        return f'{message} [{context}]' if context else message
+
+
+def setup_logging(level: str = None, fmt: str = None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a writer thread.
+
+    ``LOG_LEVEL`` and ``LOG_FORMAT`` (``text`` or ``json``) are read from the
+    environment when not given.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -3,29 +3,56 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
 import motor.motor_asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 from typing import Dict, List, Optional
 from collections import defaultdict
 from functools import wraps
 import os
+import sys
+import time
 import string
 import random
-from utils import serverInitTemplate
-from sqldb import dbSql, Users, Server, Subscriptions
+from utils import serverInitTemplate, serverSnapshotTemplate
+from sqlalchemy import select
+from sqlmodels import get_session, dispose_engine, ping_database, Server, Subscriptions
+from replay import EventRecorder
+from command_sync import sync_command_tree
+from mongo_indexes import ensure_indexes, verify_query_plans
+from migrations import run_migrations
+from modlog import ModLogStore
+from counters import ServerCounters
+from voice_sessions import VoiceSessionTracker
+from purge import PurgeJob
+from message_cache import GuildMessageCache, CachedMessage
+from downloads import DownloadManager, DownloadError
+from media_cache import MediaCache
+from music import MusicEngine, MusicError
+from usage import UsageRollups
+from scheduler import DeliveryError, ReminderScheduler, parse_delay
+from levels import LevelEngine
+from config_cache import GuildConfigCache
+from content_filter import ContentFilter
+from spam import SpamDetector, ModerationQueue, timeout_duration
+from cache_profiles import client_options
+from log_setup import setup_logging, set_log_context
+from shutdown import ShutdownCoordinator
+from health import HealthMonitor
+from fanout import GuildFanout
+from resilience import mongo_store, mysql_store, MONGO_CLIENT_OPTIONS, breaker_states
 from dotenv import load_dotenv
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Setup logging; records are written from a background thread
+setup_logging()
 logger = logging.getLogger('ModBot')
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 MONGO_URI = os.getenv('MONGO_URI')
+GATEWAY_RECORD_PATH = os.getenv('GATEWAY_RECORD_PATH')
+# Force a global command sync even when the command tree hash is unchanged
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'yes') or '--force-sync' in sys.argv
 
 
 class RateLimiter:
@@ -110,14 +137,14 @@ class ReactionRolesSelect(discord.ui.Select):
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
 
-        selected_roles = [guild.get_role(int(role_id)) for role_id in self.values]
-        roles_to_add = [role for role in selected_roles if role not in member.roles]
-        roles_to_remove = [role for role in selected_roles if role in member.roles]
+        # Selecting a role toggles it; apply the whole diff in a single member edit
+        selected_roles = {guild.get_role(int(role_id)) for role_id in self.values} - {None}
+        current_roles = set(member.roles[1:])  # Exclude @everyone
+        roles_to_add = selected_roles - current_roles
+        roles_to_remove = selected_roles & current_roles
 
-        if roles_to_add:
-            await member.add_roles(*roles_to_add)
-        if roles_to_remove:
-            await member.remove_roles(*roles_to_remove)
+        if roles_to_add or roles_to_remove:
+            await member.edit(roles=list((current_roles | roles_to_add) - roles_to_remove))
 
         embed = discord.Embed(
             title="Roles Updated",
@@ -136,8 +163,10 @@ class ReactionRolesSelect(discord.ui.Select):
         )
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
-        self.placeholder = "React to update your roles"
-        await interaction.message.edit(view=self.view)
+        # Only edit the message when the view actually changes
+        if self.placeholder != "React to update your roles":
+            self.placeholder = "React to update your roles"
+            await interaction.message.edit(view=self.view)
 
 class ReactionRolesButton(discord.ui.Button):
     def __init__(self, role: discord.Role, guild_id: int):
@@ -178,6 +207,52 @@ class ReactionRolesButton(discord.ui.Button):
         )
         await interaction.response.send_message(embed=embed, ephemeral=True)
         
+class ModLogPageView(discord.ui.View):
+    def __init__(self, modlog: ModLogStore, guild: discord.Guild, user: Optional[discord.Member]):
+        super().__init__(timeout=300)
+        self.modlog = modlog
+        self.guild = guild
+        self.user = user
+        self.cursor = None
+
+    async def load_page(self) -> discord.Embed:
+        """Fetch the next page of records and build its embed"""
+        records, self.cursor = await self.modlog.history(
+            self.guild.id,
+            self.user.id if self.user else None,
+            before=self.cursor
+        )
+        self.next_page.disabled = self.cursor is None
+
+        embed = discord.Embed(
+            title=f"Moderation History - {self.user.name if self.user else self.guild.name}",
+            color=discord.Color.dark_gold()
+        )
+        for record in records:
+            if record['type'] == 'warn':
+                value = f"<@{record['user_id']}> warned by <@{record['moderator_id']}>\nReason: {record['reason']}"
+            else:
+                value = f"<@{record['user_id']}> triggered AutoMod ({record['trigger']}, {record['action']})"
+            embed.add_field(
+                name=f"{record['type'].title()} - <t:{int(record['created_at'].replace(tzinfo=timezone.utc).timestamp())}:R>",
+                value=value,
+                inline=False
+            )
+        if not records:
+            embed.description = "No moderation records found."
+        return embed
+
+    @discord.ui.button(label="Older", style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load_page()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+def is_premium_server(guild_id: int) -> bool:
+    """Blocking premium lookup, run it through mysql_store"""
+    with get_session() as session:
+        server = session.scalars(select(Server).filter_by(discord_id=str(guild_id))).first()
+        return bool(server and server.isPremium)
+
 def rate_limit(times: int, seconds: int, premium_multiplier: float = 2.0):
     """Rate limit decorator for app commands"""
     
@@ -189,17 +264,14 @@ def rate_limit(times: int, seconds: int, premium_multiplier: float = 2.0):
             user_id = interaction.user.id
             command_name = func.__name__
 
-            # Check if server is premium
+            # Check if server is premium, treating it as non-premium while MySQL is unavailable
             server_premium = False
             try:
-                server = Server.query.filter_by(discord_id=interaction.guild.id).first()
-                if server and server.isPremium:
-                    server_premium = True
+                server_premium = await mysql_store.run_sync(
+                    lambda: is_premium_server(interaction.guild.id), fallback=False
+                )
             except Exception as e:
                 logger.error(f"Error checking premium status: {str(e)}")
-                dbSql.session.rollback()
-            finally:
-                dbSql.session.close()
 
             # Adjust rate limit for premium servers
             effective_times = int(times * premium_multiplier) if server_premium else times
@@ -242,20 +314,60 @@ def rate_limit(times: int, seconds: int, premium_multiplier: float = 2.0):
         return wrapper
     return decorator
 
+class ModCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Tag every log record of the command with its guild, command and user"""
+        set_log_context(
+            guild_id=interaction.guild_id,
+            command=interaction.command.qualified_name if interaction.command else None,
+            user_id=interaction.user.id
+        )
+        # Interactions arriving during a shutdown would be cut off halfway
+        if not self.client.shutdown.accepting:
+            await interaction.response.send_message(
+                "The bot is restarting, please try again in a moment.", ephemeral=True
+            )
+            return False
+        return True
+
 class ModBot(commands.Bot):
     def __init__(self):
-        intents = discord.Intents.all()
-        intents.message_content = True
-        intents.auto_moderation = True
-        super().__init__(command_prefix='!', intents=intents)
-        
+        # Intents, member cache flags and startup chunking come from BOT_CACHE_PROFILE
+        super().__init__(command_prefix='!', tree_cls=ModCommandTree, **client_options())
+        self.event_recorder = None
+        self.mongo_client = None
+        self.shutdown = ShutdownCoordinator()
+        self.health = HealthMonitor(self)
+        # The replay harness turns this off so it never binds the health port
+        self.serve_health = True
+
     async def setup_hook(self):
         """Setup hook for the bot"""
+        # Record gateway events for the replay harness when requested
+        if GATEWAY_RECORD_PATH:
+            self.event_recorder = EventRecorder(GATEWAY_RECORD_PATH)
+            self.event_recorder.install(self)
+
         await self.load_extension('main')
-        await self.tree.sync()
+
+        self.mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
+        self.shutdown.register_close('mongo', self.mongo_client.close)
+        self.shutdown.register_close('mysql', dispose_engine)
+        self.shutdown.register_close('mysql workers', mysql_store.shutdown)
+
+        # Serve /healthz and /readyz while the rest of the startup runs
+        self.health.add_probe('mongo', lambda: self.mongo_client.admin.command('ping'))
+        # Only premium lookups depend on MySQL, so it is reported without gating readiness
+        self.health.add_probe('mysql', lambda: asyncio.to_thread(ping_database), required=False)
+        self.health.add_status('breakers', breaker_states)
+        if self.serve_health:
+            await self.health.start()
+
+        # Only sync global commands when their signatures changed since the last sync
+        await sync_command_tree(self.tree, self.mongo_client.Protonn.BotMeta, self.application_id, force=FORCE_COMMAND_SYNC)
 
         # Register persistent views for each guild
-        async for server in motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI).Protonn.ServerProperties.find({}):
+        async for server in self.mongo_client.Protonn.ServerProperties.find({}, {"server_id": 1, "configs.reaction_roles": 1}):
             if 'configs' in server and 'reaction_roles' in server['configs']:
                 reaction_roles = server['configs']['reaction_roles']
                 if reaction_roles.get('active'):
@@ -275,6 +387,19 @@ class ModBot(commands.Bot):
 
         logger.info("Bot setup completed")
 
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        # Once a shutdown starts, gateway events would feed buffers that are being drained
+        if not self.shutdown.accepting:
+            return
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def close(self):
+        """Close the bot, the health endpoints and any open event recording"""
+        await super().close()
+        await self.health.close()
+        if self.event_recorder:
+            self.event_recorder.close()
+
     async def on_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
         """Handle slash command errors comprehensively"""
         try:
@@ -374,14 +499,175 @@ class ModBot(commands.Bot):
 class ModerationCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+        self.mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
         self.db = self.mongo_client.Protonn.ServerProperties
+        self.snapshots = self.mongo_client.Protonn.ServerSnapshots
+        self.modlog = ModLogStore(self.mongo_client.Protonn.ModerationLogs)
+        self.modlog.start()
+        self.server_counters = ServerCounters()
+        self.server_counters.start()
+        self.voice_sessions = VoiceSessionTracker(self.mongo_client.Protonn.VoiceActivities, self.server_counters)
+        self.voice_sessions.start()
+        self.usage = UsageRollups(self.mongo_client.Protonn.UsageDaily)
+        self.usage.start()
+        self.media_cache = MediaCache()
+        self.downloads = DownloadManager(self.mongo_client.Protonn.DownloadActivities, self.server_counters,
+                                         cache=self.media_cache, rollups=self.usage)
+        self.downloads.start()
+        self.music = MusicEngine(self.mongo_client.Protonn.MusicActivites, rollups=self.usage)
+        self.music.start()
+        self.scheduler = ReminderScheduler(self.mongo_client.Protonn.ScheduledJobs, self.deliver_reminder,
+                                           ready=self.bot.wait_until_ready)
+        self.scheduler.start()
+        self.levels = LevelEngine(self.mongo_client.Protonn.MemberLevels)
+        self.levels.start()
+        # Configs the message listeners check on every message
+        self.message_configs = GuildConfigCache(self.fetch_configs, ("level_rewards", "auto_mod", "anti_spam"))
+        self.content_filter = ContentFilter()
+        # (guild, rule, user, channel, content) -> when its first AutoMod action was handled, oldest first
+        self.automod_seen: Dict[tuple, float] = {}
+        self.spam = SpamDetector()
+        self.moderation_queue = ModerationQueue()
+        self.moderation_queue.start()
+        # Running purge jobs keyed by channel id
+        self.purge_jobs: Dict[int, PurgeJob] = {}
+        self.buffers_flushed = False
+        self.migrations_task: Optional[asyncio.Task] = None
+        self.message_cache = GuildMessageCache()
+        # Per-guild work of the background loops, spread over their intervals
+        self.sends_fanout = GuildFanout('automated_sends', concurrency=10, budget=13, buckets=5)
+        self.snapshot_fanout = GuildFanout('update_server_properties', concurrency=10, budget=27, buckets=10)
+        self.init_fanout = GuildFanout('initialize_server', concurrency=20)
+
+        # On shutdown, finish in-flight purges and flush the buffers before the pools close
+        bot.shutdown.register_drain('purge jobs', self.drain_purge_jobs)
+        bot.shutdown.register_drain('migrations', self.stop_migrations)
+        bot.shutdown.register_drain('write buffers', self.flush_buffers)
+        bot.shutdown.register_close('cog mongo', self.mongo_client.close)
+        bot.health.watch_loop('update_server_properties', self.update_server_properties, 30)
+        bot.health.watch_loop('update_server_premiums', self.update_server_premiums, 3600)
+        bot.health.watch_loop('automated_sends', self.automated_sends, 15)
+        bot.health.add_status('server_counters', self.server_counters.stats)
+        bot.health.add_status('media_cache', self.media_cache.stats)
+        bot.health.add_status('music', self.music.stats)
+        bot.health.add_status('usage', self.usage.stats)
+        bot.health.add_status('scheduler', self.scheduler.stats)
+        bot.health.add_status('levels', self.levels.stats)
+        bot.health.add_status('message_configs', self.message_configs.stats)
+        bot.health.add_status('content_filter', self.content_filter.stats)
+        bot.health.add_status('spam', lambda: {**self.spam.stats(), 'actions': self.moderation_queue.stats()})
+        bot.health.add_status('fanout', lambda: {
+            fanout.name: fanout.stats() for fanout in (self.sends_fanout, self.snapshot_fanout, self.init_fanout)
+        })
 
         # Start background tasks
         self.update_server_properties.start()
         self.update_server_premiums.start()
         self.automated_sends.start()
-        self.cleanup_old_data.start()
+
+    async def cog_load(self):
+        """Provision the indexes the hot queries rely on and start the migrations"""
+        try:
+            await ensure_indexes(self.mongo_client.Protonn, ttl=False)
+        except Exception as e:
+            logger.error(f"Error provisioning Mongo indexes: {str(e)}")
+        # Backfills can take a while on large collections, so they don't hold up the login
+        self.migrations_task = asyncio.create_task(self.migrate())
+
+    async def migrate(self):
+        """Apply pending migrations, then create the TTL indexes and check the query plans"""
+        try:
+            await run_migrations(self.mongo_client.Protonn)
+            await ensure_indexes(self.mongo_client.Protonn)
+            await verify_query_plans(self.mongo_client.Protonn)
+        except Exception as e:
+            logger.error(f"Error applying Mongo migrations: {str(e)}")
+
+    async def stop_migrations(self):
+        """Interrupt running migrations; they resume from their last batch on the next start"""
+        if self.migrations_task:
+            self.migrations_task.cancel()
+            await asyncio.gather(self.migrations_task, return_exceptions=True)
+
+    def _find_configs(self, guild_id: int, keys: tuple):
+        return self.db.find_one({"server_id": guild_id}, {f"configs.{key}": 1 for key in keys} | {"_id": 0})
+
+    async def get_configs(self, guild_id: int, *keys: str) -> Optional[dict]:
+        """Fetch only the requested config subtrees of a guild's server properties"""
+        # Handlers treat missing configs as disabled features, so skip them while Mongo is down
+        server_properties = await mongo_store.call(lambda: self._find_configs(guild_id, keys), fallback=None)
+        return server_properties.get('configs') if server_properties else None
+
+    async def fetch_configs(self, guild_id: int, *keys: str) -> Optional[dict]:
+        """Like ``get_configs``, but raises while Mongo is down so caches can tell an outage from a missing guild"""
+        server_properties = await mongo_store.call(lambda: self._find_configs(guild_id, keys))
+        return server_properties.get('configs') if server_properties else None
+
+    async def save_snapshot(self, guild: discord.Guild):
+        """Store the guild's current text channels and non bot roles"""
+        channels = [{'id': channel.id, 'name': channel.name} for channel in guild.text_channels]
+        # Get every non bot role in the server
+        roles = [{'id': role.id, 'name': role.name} for role in guild.roles if not role.is_bot_managed()]
+        await mongo_store.call(lambda: self.snapshots.update_one(
+            {"server_id": guild.id},
+            {"$set": serverSnapshotTemplate(guild, channels, roles)},
+            upsert=True
+        ))
+
+    @staticmethod
+    def can_read_history(member: discord.Member, channel: Optional[discord.abc.GuildChannel]) -> bool:
+        """Whether a member can see a channel and read its past messages"""
+        if channel is None:
+            return False
+        permissions = channel.permissions_for(member)
+        return permissions.view_channel and permissions.read_message_history
+
+    def get_cached_message(self, guild: discord.Guild, message_id: int, reader: discord.Member) -> Optional[CachedMessage]:
+        """Look a message up in the guild LRU, then in the client's own message cache.
+
+        Messages in channels ``reader`` cannot read are treated as missing.
+        """
+        message = self.message_cache.get(guild.id, message_id)
+        if message is None:
+            cached = discord.utils.get(reversed(self.bot.cached_messages), id=message_id)
+            if cached is not None and cached.guild is not None and cached.guild.id == guild.id:
+                message = CachedMessage.from_message(cached)
+        if message is None or not self.can_read_history(reader, guild.get_channel_or_thread(message.channel_id)):
+            return None
+        return message
+
+    async def fetch_message_from_channels(self, guild: discord.Guild, message_id: int, first_channel: discord.abc.GuildChannel,
+                                          reader: discord.Member, budget: float = 5.0,
+                                          max_channels: int = 5) -> Optional[discord.Message]:
+        """Fetch a message from the invoking channel and the guild's recently active channels concurrently.
+
+        Only channels both the bot and ``reader`` can read are searched.
+        """
+        channel_ids = [first_channel.id] + self.message_cache.recent_channels(guild.id)
+        channels = []
+        for channel_id in dict.fromkeys(channel_ids):
+            channel = guild.get_channel_or_thread(channel_id)
+            if self.can_read_history(guild.me, channel) and self.can_read_history(reader, channel):
+                channels.append(channel)
+            if len(channels) == max_channels:
+                break
+
+        pending = {asyncio.create_task(channel.fetch_message(message_id)) for channel in channels}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        try:
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
 
     async def generate_unique_code(self):
         """Generate a unique 5-character alphanumeric code"""
@@ -389,21 +675,52 @@ class ModerationCog(commands.Cog):
         while True:
             code = ''.join(random.choices(characters, k=5))
             # Check if code already exists in database
-            existing = await self.mongo_client.Protonn.ClaimServer.find_one({"claim_code": code})
+            existing = await mongo_store.call(lambda: self.mongo_client.Protonn.ClaimServer.find_one({"claim_code": code}))
             if not existing:
                 return code
     
     @commands.Cog.listener()
     async def on_ready(self):
         """Initialize servers when bot is ready"""
+        # Pick up members who were already in voice before a restart or reconnect
+        self.voice_sessions.recover(self.bot.guilds)
         await self.initialize_server()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         """Cleanup when cog is unloaded"""
         self.update_server_properties.cancel()
         self.update_server_premiums.cancel()
         self.automated_sends.cancel()
-        self.cleanup_old_data.cancel()
+        await self.flush_buffers()
+
+    async def flush_buffers(self):
+        """Stop the scheduler and queued timeouts, then flush buffered moderation records, XP, downloads, music plays, usage rollups, voice sessions and counters"""
+        # The shutdown drains the buffers, then closing the bot unloads the cog and gets here again
+        if self.buffers_flushed:
+            return
+        self.buffers_flushed = True
+        # Reminders being delivered finish here; unclaimed ones stay pending for the next start
+        await self.scheduler.close()
+        await self.moderation_queue.close()
+        await self.modlog.close()
+        await self.levels.close()
+        await self.downloads.close()
+        await self.music.close()
+        await self.usage.close()
+        # Closing the voice sessions feeds the server counters, so they go last
+        await self.voice_sessions.close()
+        await self.server_counters.close()
+
+    async def drain_purge_jobs(self):
+        """Stop scanning in running purges and wait for their queued deletes"""
+        tasks = []
+        for job in self.purge_jobs.values():
+            job.stop()
+            if job.task:
+                tasks.append(job.task)
+        if tasks:
+            logger.info(f"Waiting for {len(tasks)} purge jobs to finish")
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def clean_data(self):
         """Clean up old data"""
@@ -412,168 +729,300 @@ class ModerationCog(commands.Cog):
 
     async def initialize_server(self):
         """Initialize server properties"""
-        guilds = self.bot.guilds  # Now properly named as plural
+        # No budget: every guild has to be initialized, only the concurrency is bounded
+        await self.init_fanout.run(self.bot.guilds, self.initialize_guild)
 
-        for guild in guilds:  # Clearer iteration variable name
-            try:
-                # list of dictionaries of all channels with keys as channel id and values as channel name of all text channels
-                channels = [{'id': channel.id, 'name': channel.name} for channel in guild.text_channels]
-                roles = [{'id': role.id, 'name': role.name} for role in guild.roles]
+    async def initialize_guild(self, guild: discord.Guild):
+        """Store a guild's snapshot and create its server properties if missing"""
+        await self.save_snapshot(guild)
 
-                # check for existing server properties
-                server_properties = await self.db.find_one({"server_id": guild.id})
-                if server_properties:
-                    continue
-   
-                await self.db.insert_one(serverInitTemplate(guild, channels, roles))
+        # check for existing server properties
+        server_properties = await mongo_store.call(lambda: self.db.find_one({"server_id": guild.id}, {"_id": 1}))
+        if server_properties:
+            return
 
-            except Exception as e:
-                logger.error(f"Error in initialize server handler: {str(e)})")
+        await mongo_store.call(lambda: self.db.insert_one(serverInitTemplate(guild)), retries=0)
 
     # ===== Background Tasks =====
     @tasks.loop(hours=1)
     async def update_server_premiums(self):
         """Update server premium status"""
+        self.bot.health.heartbeat('update_server_premiums')
         try:
-            servers = Server.query.filter_by(isPremium=True).all()
+            await mysql_store.run_sync(self.expire_premiums, deadline=60, retries=0)
+        except Exception as e:
+            logger.error(f"Error in update server premiums task: {str(e)}")
+
+    def expire_premiums(self):
+        """Blocking: drop premium from servers whose subscription expired"""
+        with get_session() as session:
+            servers = session.scalars(select(Server).filter_by(isPremium=True)).all()
             for server in servers:
                 # Check if server has a subscription
-                subscription = Subscriptions.query.filter_by(server_id=server.id).first()
-                if subscription and subscription.expiry_date < datetime.utcnow():
+                subscription = session.scalars(select(Subscriptions).filter_by(server_id=server.id)).first()
+                if subscription and subscription.expiry_date and subscription.expiry_date < datetime.utcnow():
                     # Update server premium status
                     server.isPremium = False
-                    dbSql.session.commit()
-        except Exception as e:
-            dbSql.session.rollback()
-            logger.error(f"Error in update server premiums task: {str(e)}")
-        finally:
-            dbSql.session.close()
+                    session.commit()
 
     @tasks.loop(seconds=15)
     async def automated_sends(self):
         """Perform miscellaneous tasks"""
-        for guild in self.bot.guilds:
-            try:
-                server_properties = await self.db.find_one({"server_id": guild.id})
-                if not server_properties:
-                    continue
+        self.bot.health.heartbeat('automated_sends')
+        await self.sends_fanout.run(self.bot.guilds, self.send_pending_messages)
 
-                server_properties = server_properties['configs']
-                
-                reaction_roles = server_properties.get("reaction_roles", None)
-                embedded_message = server_properties.get("embedded_message", None)
+    async def send_pending_messages(self, guild: discord.Guild):
+        """Send a guild's configured reaction role and embedded messages that were not sent yet"""
+        server_properties = await self.get_configs(guild.id, "reaction_roles", "embedded_message")
+        if not server_properties:
+            return
+
+        reaction_roles = server_properties.get("reaction_roles", None)
+        embedded_message = server_properties.get("embedded_message", None)
+
+        if reaction_roles and reaction_roles['active'] and not reaction_roles['sent']:
+            channel = guild.get_channel(int(reaction_roles['channel']))
+            if channel:
+                roles = [guild.get_role(role_id) for role_id in reaction_roles['content']['roles']]
+                roles = [r for r in roles if r is not None]
+
+                if roles:
+                    if reaction_roles['content']['type'] == 'select':
+                        view = ReactionRolesSelectView(guild.id)
+                        view.add_item(ReactionRolesSelect(roles, "React to update your roles", guild.id))
+                        self.bot.add_view(view)  # Register the view before sending
+                    else:
+                        view = ReactionRolesButtonView(guild.id)
+                        for role in roles:
+                            view.add_item(ReactionRolesButton(role, guild.id))
+
+                    embed = discord.Embed(
+                        title=reaction_roles['content']['title'],
+                        description=reaction_roles['content']['description'],
+                        color=discord.Color.dark_gold()
+                    )
+                    if reaction_roles['content']['thumbnail']:
+                        embed.set_thumbnail(url=reaction_roles['content']['thumbnail'].format(server=guild.icon))
+                    else:
+                        embed.set_thumbnail(url=guild.icon)
+                    embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+
+                    # Send message first
+                    message = await channel.send(embed=embed, view=view)
+
+
+                    # Update database after successful send
+                    await mongo_store.call(lambda: self.db.update_one(
+                        {"server_id": guild.id},
+                        {"$set": {
+                            "configs.reaction_roles.sent": True,
+                        }}
+                    ))
+
+        if embedded_message and embedded_message['active'] and not embedded_message['sent']:
+            channel = guild.get_channel(int(embedded_message['channel']))
+            if channel:
+                embed = discord.Embed(
+                    title=embedded_message['message']['title'].format(server=guild.name),
+                    description=embedded_message['message']['content'].format(server=guild.name, everyone=guild.default_role.mention),
+                    color=discord.Color.dark_gold()
+                )
+                logger.debug(f"Embedded message thumbnail: {embedded_message['message']['thumbnail']}")
+                if embedded_message['message']['thumbnail']:
+                    embed.set_thumbnail(url=embedded_message['message']['thumbnail'].format(server=guild.icon))
+
+                embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+
+                # Send message first
+                message = await channel.send(embed=embed)
+
+                # Update database after successful send
+                await mongo_store.call(lambda: self.db.update_one(
+                    {"server_id": guild.id},
+                    {"$set": {
+                        "configs.embedded_message.sent": True,
+                    }}
+                ))
 
-                if reaction_roles and reaction_roles['active'] and not reaction_roles['sent']:
-                    channel = guild.get_channel(int(reaction_roles['channel']))
-                    if channel:
-                        roles = [guild.get_role(role_id) for role_id in reaction_roles['content']['roles']]
-                        roles = [r for r in roles if r is not None]
-                        
-                        if roles:
-                            if reaction_roles['content']['type'] == 'select':
-                                view = ReactionRolesSelectView(guild.id)
-                                view.add_item(ReactionRolesSelect(roles, "React to update your roles", guild.id))
-                                self.bot.add_view(view)  # Register the view before sending
-                            else:
-                                view = ReactionRolesButtonView(guild.id)
-                                for role in roles:
-                                    view.add_item(ReactionRolesButton(role, guild.id))
-                                
-                            embed = discord.Embed(
-                                title=reaction_roles['content']['title'],
-                                description=reaction_roles['content']['description'],
-                                color=discord.Color.dark_gold()
-                            )
-                            if reaction_roles['content']['thumbnail']:
-                                embed.set_thumbnail(url=reaction_roles['content']['thumbnail'].format(server=guild.icon))
-                            else:
-                                embed.set_thumbnail(url=guild.icon)
-                            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
-                            
-                            # Send message first
-                            message = await channel.send(embed=embed, view=view)
-                            
-                            
-                            # Update database after successful send
-                            await self.db.update_one(
-                                {"server_id": guild.id},
-                                {"$set": {
-                                    "configs.reaction_roles.sent": True,
-                                }}
-                            )
-                
-                if embedded_message and embedded_message['active'] and not embedded_message['sent']:
-                    channel = guild.get_channel(int(embedded_message['channel']))
-                    if channel:
-                        embed = discord.Embed(
-                            title=embedded_message['message']['title'].format(server=guild.name),
-                            description=embedded_message['message']['content'].format(server=guild.name, everyone=guild.default_role.mention),
-                            color=discord.Color.dark_gold()
-                        )
-                        print(embedded_message['message']['thumbnail'])
-                        if embedded_message['message']['thumbnail']:
-                            embed.set_thumbnail(url=embedded_message['message']['thumbnail'].format(server=guild.icon))
-                        
-                        embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
-                        
-                        # Send message first
-                        message = await channel.send(embed=embed)
-                        
-                        # Update database after successful send
-                        await self.db.update_one(
-                            {"server_id": guild.id},
-                            {"$set": {
-                                "configs.embedded_message.sent": True,
-                            }}
-                        )
-                            
-            except Exception as e:
-                logger.error(f"Error in automated sends task: {str(e)}")
-              
     @tasks.loop(seconds=30)
     async def update_server_properties(self):
         """Update server properties in the database"""
-        for guild in self.bot.guilds:
-            try:
-                # Update server channels and roles
-                channels = [{'id': channel.id, 'name': channel.name} for channel in guild.text_channels]
-                # Get every non bot role in the server
-                roles = [{'id': role.id, 'name': role.name} for role in guild.roles if not role.is_bot_managed()]
+        self.bot.health.heartbeat('update_server_properties')
+        # Update server channels and roles
+        await self.snapshot_fanout.run(self.bot.guilds, self.save_snapshot)
 
-                # Update server properties
-                await self.db.update_one(
-                    {"server_id": guild.id},
-                    {"$set": {"channels": channels, "roles": roles}}
-                )
+    # ===== Event Listeners =====
+    @commands.Cog.listener('on_message')
+    async def cache_message(self, message: discord.Message):
+        """Remember recent guild messages so /quote can skip the REST lookup"""
+        self.message_cache.add(message)
+
+    @commands.Cog.listener('on_message')
+    async def filter_message(self, message: discord.Message):
+        """Delete messages containing one of the guild's banned terms"""
+        if message.guild is None or message.author.bot or not message.content:
+            return
+        try:
+            configs = await self.message_configs.get(message.guild.id)
+            config = configs.get("auto_mod") if configs else None
+            if not config or not config["active"] or not config.get("banned_terms"):
+                return
+            if not isinstance(message.author, discord.Member) or message.author.guild_permissions.manage_messages:
+                return
+            exempt = set(config.get("exempt_roles", []))
+            if exempt and any(role.id in exempt for role in message.author.roles):
+                return
 
-            except Exception as e:
-                logger.error(f"Error in update server properties task: {str(e)}")
+            term = self.content_filter.scan(message.guild.id, config["banned_terms"], message.content)
+            if term is None:
+                return
 
-    @tasks.loop(minutes=30)
-    async def cleanup_old_data(self):
-        """Clean up old warnings and join logs"""
-        try:
-            collections = [self.mongo_client.Protonn.DownloadActivities, self.mongo_client.Protonn.MusicActivites]
-            current_month_year = datetime.now().strftime("%Y-%m")
+            set_log_context(guild_id=message.guild.id, user_id=message.author.id)
+            deleted = False
+            if config.get("delete", True) and message.channel.permissions_for(message.guild.me).manage_messages:
+                try:
+                    await message.delete()
+                    deleted = True
+                except discord.NotFound:
+                    deleted = True
+            await self.modlog.record_automod(
+                message.guild.id, message.author.id, None, "banned_term",
+                "delete" if deleted else "alert", message.channel.id, message.content
+            )
 
-            # Define the filter to find entries not matching the current month and year
-            filter_criteria = {"month": {"$ne": current_month_year}}
+            embed = discord.Embed(
+                title="Banned Term Detected",
+                description=f"A message by {message.author.mention} contained a banned term.",
+                color=discord.Color.orange()
+            )
+            embed.add_field(name="Term", value=discord.utils.escape_markdown(term), inline=True)
+            embed.add_field(name="Action", value="Deleted" if deleted else "Logged", inline=True)
+            embed.add_field(name="Channel", value=message.channel.mention, inline=False)
+            embed.add_field(name="Content", value=message.content[:1024], inline=False)
+            embed.set_footer(text=f"User ID: {message.author.id}")
+            await self.send_automod_log(message.guild, config, embed)
+        except Exception as e:
+            logger.error(f"Error filtering message: {str(e)}")
 
-            # Perform the deletion
-            for collection in collections:
-                result = await collection.delete_many(filter_criteria)
+    @commands.Cog.listener('on_message')
+    async def detect_spam(self, message: discord.Message):
+        """Delete flood, duplicate, mention and copypasta spam, and time out senders over the per-user limits"""
+        if message.guild is None or message.author.bot or not isinstance(message.author, discord.Member):
+            return
+        try:
+            configs = await self.message_configs.get(message.guild.id)
+            config = configs.get("anti_spam") if configs else None
+            if not config or not config["active"] or message.author.guild_permissions.manage_messages:
+                return
+            exempt = set(config.get("exempt_roles", []))
+            if exempt and any(role.id in exempt for role in message.author.roles):
+                return
 
-                logger.info(f"Cleaned up {result.deleted_count} old records from {collection.name}")
+            mentions = len(message.raw_mentions) + len(message.raw_role_mentions) + (5 if message.mention_everyone else 0)
+            verdict = self.spam.check(message.guild.id, message.channel.id, message.author.id, message.content, mentions, config)
+            if verdict is None:
+                return
 
-            
+            set_log_context(guild_id=message.guild.id, user_id=message.author.id)
+            if config.get("delete", True) and message.channel.permissions_for(message.guild.me).manage_messages:
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
+
+            member = message.author
+            if not verdict.timeout:
+                # Copypasta is only deleted; one log embed per deleted message would flood the log channel
+                await self.modlog.record_automod(
+                    message.guild.id, member.id, None, f"spam_{verdict.kind}", "delete", message.channel.id, message.content
+                )
+                return
+            if member.is_timed_out() or not message.guild.me.guild_permissions.moderate_members or member.top_role >= message.guild.me.top_role:
+                return
+            duration = timeout_duration(config)
+            # Later messages of the same burst find the timeout already queued and stop here
+            if not self.moderation_queue.submit(message.guild.id, member.id, lambda: member.timeout(duration, reason=f"Spam: {verdict.detail}")):
+                return
+
+            await self.modlog.record_automod(
+                message.guild.id, member.id, None, f"spam_{verdict.kind}", "timeout", message.channel.id, message.content
+            )
+            embed = discord.Embed(
+                title="Spam Detected",
+                description=f"{member.mention} was timed out for {int(duration.total_seconds() // 60)} minutes.",
+                color=discord.Color.orange()
+            )
+            embed.add_field(name="Reason", value=verdict.detail, inline=True)
+            embed.add_field(name="Channel", value=message.channel.mention, inline=True)
+            embed.add_field(name="Content", value=(message.content or "No content available")[:1024], inline=False)
+            embed.set_footer(text=f"User ID: {member.id}")
+            await self.send_automod_log(message.guild, configs.get("auto_mod"), embed)
+        except Exception as e:
+            logger.error(f"Error checking message for spam: {str(e)}")
+
+    async def send_automod_log(self, guild: discord.Guild, config: Optional[dict], embed: discord.Embed):
+        """Post an AutoMod log embed to the guild's configured auto_mod channel, if any"""
+        channel_id = config.get("channel") if config else None
+        channel = guild.get_channel(int(channel_id)) if channel_id else None
+        if channel is not None and channel.permissions_for(guild.me).send_messages:
+            await channel.send(embed=embed)
+
+    @commands.Cog.listener('on_message')
+    async def award_xp(self, message: discord.Message):
+        """Give message XP and hand out level rewards"""
+        if message.guild is None or message.author.bot or message.webhook_id:
+            return
+        try:
+            configs = await self.message_configs.get(message.guild.id)
+            config = configs.get("level_rewards") if configs else None
+            if not config or not config["active"]:
+                return
+            level = await self.levels.award(message.guild.id, message.author.id)
+            if level is not None:
+                await self.announce_level_up(message, config, level)
         except Exception as e:
-            logger.error(f"Error in cleanup task: {str(e)}")
+            logger.error(f"Error awarding XP: {str(e)}")
+
+    async def announce_level_up(self, message: discord.Message, config: dict, level: int):
+        """Post the level-up message and add every reward role up to the new level"""
+        member = message.author
+        guild = message.guild
+        rewards = [reward for reward in config.get("rewards", []) if reward.get("level", 0) <= level]
+        roles = [guild.get_role(int(reward["role"])) for reward in rewards]
+        roles = [role for role in roles if role is not None and role not in member.roles and role < guild.me.top_role]
+        if roles and guild.me.guild_permissions.manage_roles:
+            await member.add_roles(*roles, reason=f"Reached level {level}")
+
+        template = config.get("message")
+        if not template:
+            return
+        channel = guild.get_channel(config["channel"]) if config.get("channel") else message.channel
+        if channel is None or not channel.permissions_for(guild.me).send_messages:
+            return
+        embed = discord.Embed(
+            title=template["title"].format(user=member.name, user_mention=member.mention, server=guild.name, level=level),
+            description=template["content"].format(user=member.name, user_mention=member.mention, server=guild.name, level=level),
+            color=discord.Color.gold()
+        )
+        if roles:
+            embed.add_field(name="Rewards", value=" ".join(role.mention for role in roles), inline=False)
+        embed.set_thumbnail(url=template["thumbnail"].format(user=member.display_avatar.url, server=guild.icon))
+        embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+        await channel.send(embed=embed)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Drop deleted messages from the quote cache"""
+        if payload.guild_id:
+            self.message_cache.remove(payload.guild_id, payload.message_id)
 
-    # ===== Event Listeners =====
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        """Handle voice channel cleanup when empty or when owner leaves"""
+        """Track voice sessions and handle private room cleanup when empty or when owner leaves"""
         try:
+            set_log_context(guild_id=member.guild.id)
+            self.voice_sessions.update(member, before, after)
+
             # Check if user left a channel
             if before.channel and (not after.channel or before.channel != after.channel):
                 # Check if bot has required permissions first
@@ -581,10 +1030,10 @@ class ModerationCog(commands.Cog):
                     logger.warning(f"Bot lacks manage_channels permission in guild {before.channel.guild.id}")
                     return
 
-                # Check if channel is a private room
-                channel_data = await self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
+                # Check if channel is a private room; rooms are left alone while Mongo is down
+                channel_data = await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
                     "channel_id": str(before.channel.id)
-                })
+                }), fallback=None)
                 
                 if channel_data:
                     # Check if the leaving member is the owner
@@ -599,9 +1048,9 @@ class ModerationCog(commands.Cog):
                             embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
                             await member.send(embed=embed, delete_after=300)
                  
-                            await self.mongo_client.Protonn.PrivateVoiceChannels.delete_one({
+                            await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.delete_one({
                                 "channel_id": str(before.channel.id)
-                            })
+                            }))
                             await before.channel.delete()
                                 
                         except discord.Forbidden:
@@ -614,9 +1063,9 @@ class ModerationCog(commands.Cog):
                         try:
                             # Delete empty private channel
                             await before.channel.delete()
-                            await self.mongo_client.Protonn.PrivateVoiceChannels.delete_one({
+                            await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.delete_one({
                                 "channel_id": str(before.channel.id)
-                            })
+                            }))
                         except discord.Forbidden:
                             logger.warning(f"Missing permissions to delete channel {before.channel.id}")
                         except Exception as e:
@@ -629,13 +1078,15 @@ class ModerationCog(commands.Cog):
     async def on_member_join(self, member: discord.Member):
         """Handle member joins"""
         try:
+            set_log_context(guild_id=member.guild.id)
             server_id = member.guild.id
           
             # Check if welcome system is active
-            welcome_system = await self.db.find_one({"server_id": server_id})
-            welcome_system = welcome_system['configs']['welcome_system'] if welcome_system else None
+            # Without configs (unset, or Mongo unavailable) the welcome message is skipped
+            configs = await self.get_configs(server_id, "welcome_system", "auto_roles")
+            welcome_system = configs.get('welcome_system') if configs else None
           
-            if welcome_system["active"]:
+            if welcome_system and welcome_system["active"]:
                 embed = discord.Embed(
                     title=welcome_system["message"]["title"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
                     description=welcome_system["message"]["content"].format(user=member.name, user_mention=member.mention, server=member.guild.name, everyone=member.guild.default_role.mention),
@@ -650,9 +1101,8 @@ class ModerationCog(commands.Cog):
                     await channel.send(embed=embed)
                     
 
-            auto_roles = await self.db.find_one({"server_id": server_id})
-            auto_roles = auto_roles['configs']['auto_roles']
-            if auto_roles["active"]:
+            auto_roles = configs.get('auto_roles') if configs else None
+            if auto_roles and auto_roles["active"]:
                 for role_id in auto_roles["roles"]:
                     role = member.guild.get_role(role_id)
                     if role:
@@ -663,23 +1113,27 @@ class ModerationCog(commands.Cog):
             logger.error(f"Error in member join handler: {str(e)}")
 
     @commands.Cog.listener()
-    async def on_member_remove(self, member: discord.Member):
-        """Handle member removals"""
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        """Handle member removals, including members that were never cached"""
         try:
-            server_id = member.guild.id
-            exit_system = await self.db.find_one({"server_id": server_id})
-            exit_system = exit_system['configs']['exit_system'] if exit_system else None
-            if exit_system["active"]:
+            set_log_context(guild_id=payload.guild_id)
+            guild = self.bot.get_guild(payload.guild_id)
+            if guild is None:
+                return
+            user = payload.user
+            exit_system = await self.get_configs(guild.id, "exit_system")
+            exit_system = exit_system['exit_system'] if exit_system else None
+            if exit_system and exit_system["active"]:
                 embed = discord.Embed(
-                    title=exit_system["message"]["title"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
-                    description=exit_system["message"]["content"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
+                    title=exit_system["message"]["title"].format(user=user.name, user_mention=user.mention, server=guild.name),
+                    description=exit_system["message"]["content"].format(user=user.name, user_mention=user.mention, server=guild.name),
                     color=discord.Color.dark_gold()
                 )
-                embed.set_thumbnail(url=exit_system["message"]["thumbnail"].format(user=member.display_avatar.url, server=member.guild.icon))
+                embed.set_thumbnail(url=exit_system["message"]["thumbnail"].format(user=user.display_avatar.url, server=guild.icon))
                 embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
 
                 # Send exit message
-                channel = member.guild.get_channel(exit_system["channel"]) if exit_system["channel"] else member.guild.system_channel
+                channel = guild.get_channel(exit_system["channel"]) if exit_system["channel"] else guild.system_channel
                 if channel:
                     await channel.send(embed=embed)
 
@@ -691,20 +1145,21 @@ class ModerationCog(commands.Cog):
     async def on_member_kick(self, guild: discord.Guild, user: discord.User):
         """Handle member kicks"""
         try:
-            server_id = member.guild.id
-            exit_system = await self.db.find_one({"server_id": server_id})
-            exit_system = exit_system['configs']['exit_system'] if exit_system else None
-            if exit_system["active"]:
+            set_log_context(guild_id=guild.id)
+            server_id = guild.id
+            exit_system = await self.get_configs(server_id, "exit_system")
+            exit_system = exit_system['exit_system'] if exit_system else None
+            if exit_system and exit_system["active"]:
                 embed = discord.Embed(
-                    title=exit_system["message"]["title"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
-                    description=exit_system["message"]["content"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
+                    title=exit_system["message"]["title"].format(user=user.name, user_mention=user.mention, server=guild.name),
+                    description=exit_system["message"]["content"].format(user=user.name, user_mention=user.mention, server=guild.name),
                     color=discord.Color.dark_gold()
                 )
-                embed.set_thumbnail(url=exit_system["message"]["thumbnail"].format(user=member.display_avatar.url, server=member.guild.icon))
+                embed.set_thumbnail(url=exit_system["message"]["thumbnail"].format(user=user.display_avatar.url, server=guild.icon))
                 embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
 
                 # Send exit message
-                channel = member.guild.get_channel(exit_system["channel"]) if exit_system["channel"] else member.guild.system_channel
+                channel = guild.get_channel(exit_system["channel"]) if exit_system["channel"] else guild.system_channel
                 if channel:
                     await channel.send(embed=embed)
             
@@ -715,21 +1170,22 @@ class ModerationCog(commands.Cog):
     async def on_member_ban(self, guild: discord.Guild, user: discord.User):
         """Handle member bans"""
         try:
-            server_id = member.guild.id
-            ban_system = await self.db.find_one({"server_id": server_id})
-            ban_system = ban_system['configs']['ban_system'] if ban_system else None
-            if ban_system["active"]:
+            set_log_context(guild_id=guild.id)
+            server_id = guild.id
+            ban_system = await self.get_configs(server_id, "ban_system")
+            ban_system = ban_system['ban_system'] if ban_system else None
+            if ban_system and ban_system["active"]:
                 embed = discord.Embed(
-                    title=ban_system["message"]["title"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
-                    description=ban_system["message"]["content"].format(user=member.name, user_mention=member.mention, server=member.guild.name),
+                    title=ban_system["message"]["title"].format(user=user.name, user_mention=user.mention, server=guild.name),
+                    description=ban_system["message"]["content"].format(user=user.name, user_mention=user.mention, server=guild.name),
                     color=discord.Color.dark_gold()
                 )
                 embed.add_field(name="Reason", value=ban_system["message"]["reason"], inline=False)
-                embed.set_thumbnail(url=ban_system["message"]["thumbnail"].format(user=member.display_avatar.url, server=member.guild.icon))
+                embed.set_thumbnail(url=ban_system["message"]["thumbnail"].format(user=user.display_avatar.url, server=guild.icon))
                 embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
 
                 # Send ban message
-                channel = member.guild.get_channel(ban_system["channel"]) if ban_system["channel"] else member.guild.system_channel
+                channel = guild.get_channel(ban_system["channel"]) if ban_system["channel"] else guild.system_channel
                 if channel:
                     await channel.send(embed=embed)
             
@@ -741,54 +1197,95 @@ class ModerationCog(commands.Cog):
     async def on_guild_join(self, guild: discord.Guild):
         """Handle bot joining a server"""
         try:
+            set_log_context(guild_id=guild.id)
 
-            # list of dictionaries of all channels with keys as channel id and values as channel name
-            channels = [{'id': channel.id, 'name': channel.name} for channel in guild.channels]
-
-            roles = [{'id': role.id, 'name': role.name} for role in guild.roles]
+            await self.save_snapshot(guild)
 
             # check for existing server properties
-            server_properties = await self.db.find_one({"server_id": guild.id})
+            server_properties = await mongo_store.call(lambda: self.db.find_one({"server_id": guild.id}, {"_id": 1}))
             if server_properties:
                 return
 
             # Create raid protection entry
-            await self.db.insert_one(serverInitTemplate(guild, channels, roles))
+            await mongo_store.call(lambda: self.db.insert_one(serverInitTemplate(guild)), retries=0)
         except Exception as e:
             logger.error(f"Error in guild join handler: {str(e)}")
 
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        """Forget the cached configs and filter of a guild the bot left"""
+        self.message_configs.invalidate(guild.id)
+        self.content_filter.forget(guild.id)
+
+    def first_automod_action(self, action: discord.AutoModAction, window: float = 10.0) -> bool:
+        """True for the first of the actions one rule takes on one message, whichever type arrives first"""
+        # Blocked messages have no message id and alerts carry their own, so the message is keyed on its content
+        key = (action.guild_id, action.rule_id, action.user_id, action.channel_id, action.content)
+        now = time.monotonic()
+        while self.automod_seen:
+            oldest = next(iter(self.automod_seen))
+            if now - self.automod_seen[oldest] <= window:
+                break
+            del self.automod_seen[oldest]
+        if key in self.automod_seen:
+            return False
+        self.automod_seen[key] = now
+        return True
+
     @commands.Cog.listener()
     async def on_automod_action(self, action: discord.AutoModAction):
         """Respond to AutoMod actions triggered by Discord's AutoMod."""
         try:
+            set_log_context(guild_id=action.guild_id, user_id=action.user_id)
             # Extract action details
             guild = action.guild
-            rule = action.rule
-            target_user = action.user
+            # Members are only cached when seen in voice or joining, so fall back to the user
+            target_user = action.member or self.bot.get_user(action.user_id)
             channel = action.channel
             action_type = action.action
             content = action.content
-            
 
+            await self.modlog.record_automod(
+                action.guild_id,
+                action.user_id,
+                action.rule_id,
+                action.rule_trigger_type.name,
+                action_type.type.name,
+                action.channel_id,
+                content
+            )
+
+            # A rule with several actions fires this event once per action; log and notify once
+            if not self.first_automod_action(action):
+                return
 
+            try:
+                rule_name = (await action.fetch_rule()).name
+            except discord.HTTPException:
+                rule_name = str(action.rule_id)
 
             embed = discord.Embed(
                 title="AutoMod Action Triggered",
-                description=f"A message by {target_user.mention} violated an AutoMod rule.",
+                description=f"A message by <@{action.user_id}> violated an AutoMod rule.",
                 color=discord.Color.orange()
             )
-            embed.add_field(name="Rule", value=rule.name, inline=True)
-            embed.add_field(name="Action", value=str(action_type), inline=True)
+            embed.add_field(name="Rule", value=rule_name, inline=True)
+            embed.add_field(name="Action", value=action_type.type.name.replace('_', ' ').title(), inline=True)
             embed.add_field(name="Channel", value=channel.mention if channel else "DM/Unknown", inline=False)
-            embed.add_field(name="Content", value=content or "No content available", inline=False)
-            embed.set_footer(text=f"User ID: {target_user.id} | Rule ID: {rule.id}")
-
+            embed.add_field(name="Content", value=(content or "No content available")[:1024], inline=False)
+            if action.matched_keyword:
+                embed.add_field(name="Matched", value=discord.utils.escape_markdown(action.matched_keyword), inline=True)
+            embed.set_footer(text=f"User ID: {action.user_id} | Rule ID: {action.rule_id}")
 
-
-            if log_channel:
-                await log_channel.send(embed=embed)
+            configs = await self.message_configs.get(action.guild_id)
+            await self.send_automod_log(guild, configs.get("auto_mod") if configs else None, embed)
 
             # Optional: Additional actions like notifying the user
+            if target_user is None:
+                try:
+                    target_user = await self.bot.fetch_user(action.user_id)
+                except discord.HTTPException:
+                    target_user = None
             if target_user:
                 try:
                     await target_user.send(
@@ -804,7 +1301,6 @@ class ModerationCog(commands.Cog):
     @update_server_properties.before_loop
     @update_server_premiums.before_loop
     @automated_sends.before_loop
-    @cleanup_old_data.before_loop
     async def before_tasks(self):
         """Wait for bot to be ready before starting tasks"""
         await self.bot.wait_until_ready()
@@ -841,11 +1337,41 @@ class ModerationCog(commands.Cog):
             value="`/warn @user reason`\nWarn a user",
             inline=True
         )
+        embed.add_field(
+            name="Warnings",
+            value="`/warnings @user`\nView the moderation history of the server or a user",
+            inline=True
+        )
         embed.add_field(
             name="Purge (Admin command)",
-            value="`/purge 5`\nDelete a specified amount of messages in the current channel",
+            value="`/purge 500 @user`\nDelete up to 50,000 messages in the current channel, optionally filtered by user, text or bots",
             inline=True
         )
+        embed.add_field(
+            name="Download",
+            value="`/download link audio`\nDownload the audio or video of a link as a file",
+            inline=False
+        )
+        embed.add_field(
+            name="Music",
+            value="`/play song or link`\nPlay music in your voice channel, `/queue`, `/skip` and `/stop` control it",
+            inline=False
+        )
+        embed.add_field(
+            name="Usage (Admin command)",
+            value="`/usage 30`\nShow the server's downloads and music plays over the last days",
+            inline=False
+        )
+        embed.add_field(
+            name="Levels",
+            value="`/rank @user`\nShow a member's level and XP, `/leaderboard` shows the server's top members",
+            inline=False
+        )
+        embed.add_field(
+            name="Reminders",
+            value="`/remind 2h30m message`\nGet reminded in this channel later, `/reminders` lists your pending ones",
+            inline=False
+        )
         embed.add_field(
             name="Create Private VC",
             value="`/create_room 5`\nCreate a private voice channel. This is turned off on the server by default",
@@ -906,9 +1432,27 @@ class ModerationCog(commands.Cog):
             description=f"✅ Warning has been sent to {user.mention}",
             color=discord.Color.green()
         )
+        await self.modlog.record_warn(interaction.guild.id, user.id, interaction.user.id, reason)
         await user.send(embed=warningEmbed)
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+    @app_commands.command(name="warnings", description="View the moderation history of the server or a user")
+    @app_commands.default_permissions(manage_messages=True)
+    async def warnings(
+        self,
+        interaction: discord.Interaction,
+        user: Optional[discord.Member] = None
+    ):
+        """Show moderation records, newest first, with a button for older pages"""
+        try:
+            view = ModLogPageView(self.modlog, interaction.guild, user)
+            embed = await view.load_page()
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error fetching moderation history: {str(e)}")
+            await interaction.response.send_message("An error occurred while fetching the moderation history.", ephemeral=True)
+
     @app_commands.command(name="userinfo", description="Get information about a user")
     @app_commands.default_permissions(manage_messages=True)
     async def userinfo(
@@ -961,20 +1505,82 @@ class ModerationCog(commands.Cog):
 
     @app_commands.command(name="purge", description="Deletes a specified amount of messages in current channel")
     @app_commands.default_permissions(manage_messages=True)
-    async def purge(self, interaction: discord.Interaction, limit: app_commands.Range[int, 1, 100]):
-        """Purge messages in the current channel"""
+    @app_commands.describe(
+        limit="Number of matching messages to delete",
+        user="Only delete messages from this user",
+        contains="Only delete messages containing this text",
+        bots="Only delete messages sent by bots"
+    )
+    async def purge(
+        self,
+        interaction: discord.Interaction,
+        limit: app_commands.Range[int, 1, 50000],
+        user: Optional[discord.User] = None,
+        contains: Optional[str] = None,
+        bots: Optional[bool] = False
+    ):
+        """Purge messages in the current channel as a background job"""
         try:
+            existing = self.purge_jobs.get(interaction.channel.id)
+            if existing and not existing.done:
+                embed = discord.Embed(
+                    title="Purge Already Running",
+                    description=f"A purge is already running in this channel ({existing.deleted}/{existing.limit} deleted).",
+                    color=discord.Color.red()
+                )
+                embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+                await interaction.response.send_message(embed=embed, ephemeral=True)
+                return
+
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            job = PurgeJob(
+                interaction.channel,
+                limit,
+                author=user,
+                contains=contains,
+                bots_only=bool(bots),
+                before=interaction
+            )
+            self.purge_jobs[interaction.channel.id] = job
+            job.task = asyncio.create_task(self.run_purge_job(interaction, job))
+        except Exception as e:
+            logger.error(f"Error purging messages: {str(e)}")
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while purging messages.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while purging messages.", ephemeral=True)
+
+    async def run_purge_job(self, interaction: discord.Interaction, job: PurgeJob):
+        """Run a purge job and keep the command response updated with its progress"""
+        async def report(job: PurgeJob):
             embed = discord.Embed(
-                title="Messages Purged",
-                description=f"{limit} messages have been purged in this channel.",
+                title="Messages Purged" if job.done else "Purging Messages",
+                description=(
+                    f"{job.deleted} of {job.limit} messages deleted ({job.scanned} scanned)\n"
+                    f"{job.rate:.1f} messages/s over {job.elapsed:.0f}s"
+                ),
                 color=discord.Color.dark_gold()
             )
+            if job.failed:
+                embed.add_field(name="", value=f"{job.failed} messages could not be deleted", inline=False)
             embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-            await interaction.channel.purge(limit=limit)
+            try:
+                await interaction.edit_original_response(embed=embed)
+            except discord.HTTPException:
+                # The interaction token expires after 15 minutes; keep purging regardless
+                pass
+
+        try:
+            await job.run(progress=report)
         except Exception as e:
-            logger.error(f"Error purging messages: {str(e)}")
-            await interaction.response.send_message("An error occurred while purging messages.", ephemeral=True)
+            logger.error(f"Error in purge job for channel {interaction.channel.id}: {str(e)}")
+            try:
+                await interaction.edit_original_response(content="An error occurred while purging messages.")
+            except discord.HTTPException:
+                pass
+        finally:
+            if self.purge_jobs.get(interaction.channel.id) is job:
+                del self.purge_jobs[interaction.channel.id]
 
     @app_commands.command(name="announce", description="Create a quick server announcement")
     @app_commands.default_permissions(manage_messages=True)
@@ -1089,7 +1695,7 @@ class ModerationCog(commands.Cog):
 
         try:
             server_id = str(interaction.guild.id)
-            existing_server = await self.mongo_client.Protonn.ClaimServer.find_one({"server_id": server_id})
+            existing_server = await mongo_store.call(lambda: self.mongo_client.Protonn.ClaimServer.find_one({"server_id": server_id}))
             if existing_server:
                 embed = discord.Embed(
                     title="Server Already Registered",
@@ -1116,7 +1722,7 @@ class ModerationCog(commands.Cog):
             }
 
             # Insert server data
-            await self.mongo_client.Protonn.ClaimServer.insert_one(server_data)
+            await mongo_store.call(lambda: self.mongo_client.Protonn.ClaimServer.insert_one(server_data), retries=0)
 
             embed = discord.Embed(
                 title="Server Claimed Successfully",
@@ -1143,7 +1749,7 @@ class ModerationCog(commands.Cog):
 
         try:
             server_id = str(interaction.guild.id)
-            existing_server = await self.mongo_client.Protonn.ClaimServer.find_one({"server_id": server_id})
+            existing_server = await mongo_store.call(lambda: self.mongo_client.Protonn.ClaimServer.find_one({"server_id": server_id}))
             if not existing_server:
                 embed = discord.Embed(
                     title="Server Not Registered",
@@ -1171,7 +1777,7 @@ class ModerationCog(commands.Cog):
                 }
             }
 
-            await self.mongo_client.Protonn.ClaimServer.update_one({"server_id": server_id}, update_data)
+            await mongo_store.call(lambda: self.mongo_client.Protonn.ClaimServer.update_one({"server_id": server_id}, update_data))
 
             embed = discord.Embed(
                 title="Server Reset Successfully",
@@ -1204,9 +1810,9 @@ class ModerationCog(commands.Cog):
     ):
         """Create a private voice channel with specified size limit"""
 
-        can_create = await self.db.find_one({"server_id": interaction.guild.id})
-        can_create = can_create['configs']['private_vc'] if can_create else None
-        if not can_create['active']:
+        can_create = await self.get_configs(interaction.guild.id, "private_vc")
+        can_create = can_create.get('private_vc') if can_create else None
+        if not can_create or not can_create['active']:
             embed = discord.Embed(
                 title="Private Rooms Disabled",
                 description="Private rooms have been disabled in this server. Please contact an admin for more information. If you believe this is an error, please contact support.",
@@ -1250,10 +1856,10 @@ class ModerationCog(commands.Cog):
         }
 
         # Check if user already has a private room
-        existing_channel = await self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
+        existing_channel = await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
             "owner_id": str(interaction.user.id),
             "guild_id": str(interaction.guild.id)
-        })
+        }))
         if existing_channel:
             embed = discord.Embed(
                 title="Private VC Already Exists",
@@ -1273,12 +1879,12 @@ class ModerationCog(commands.Cog):
         )
 
         # Store channel info in database
-        await self.mongo_client.Protonn.PrivateVoiceChannels.insert_one({
+        await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.insert_one({
             "channel_id": str(vc.id),
             "owner_id": str(interaction.user.id),
             "guild_id": str(interaction.guild.id),
             "created_at": datetime.utcnow()
-        })
+        }), retries=0)
 
         embed = discord.Embed(
             title="Private VC Created",
@@ -1299,10 +1905,12 @@ class ModerationCog(commands.Cog):
     ):
         """Send a join request to the owner of a private voice channel"""
         try:
+            # Looking the owner up can take longer than the interaction allows
+            await interaction.response.defer(ephemeral=True)
             # Verify channel is a private room
-            channel_data = await self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
+            channel_data = await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
                 "channel_id": str(channel.id)
-            })
+            }))
             
             if not channel_data:
                 embed = discord.Embed(
@@ -1311,11 +1919,16 @@ class ModerationCog(commands.Cog):
                     color=discord.Color.red()
                 )
                 embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
-                await interaction.response.send_message(embed=embed, ephemeral=True)
+                await interaction.followup.send(embed=embed, ephemeral=True)
                 return
 
-            # Get owner
+            # Get owner; only members in voice are cached, so fetch just this one otherwise
             owner = interaction.guild.get_member(int(channel_data["owner_id"]))
+            if owner is None:
+                try:
+                    owner = await interaction.guild.fetch_member(int(channel_data["owner_id"]))
+                except discord.NotFound:
+                    owner = None
             if not owner:
                 embed = discord.Embed(
                     title="Owner Not Found",
@@ -1323,7 +1936,7 @@ class ModerationCog(commands.Cog):
                     color=discord.Color.red()
                 )
                 embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
-                await interaction.response.send_message(embed=embed, ephemeral=True)
+                await interaction.followup.send(embed=embed, ephemeral=True)
                 return
 
             # Create request embed
@@ -1414,17 +2027,17 @@ class ModerationCog(commands.Cog):
                 description=f"✅ Join request sent to {owner.mention}. They will respond shortly.",
                 color=discord.Color.green()
             )
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 embed=embed,
                 ephemeral=True
             )
 
         except Exception as e:
             logger.error(f"Error handling join request: {str(e)}")
-            await interaction.response.send_message(
-                "An error occurred while processing your join request.",
-                ephemeral=True
-            )
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while processing your join request.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while processing your join request.", ephemeral=True)
 
     @app_commands.command(name="add_user", description="Give a user access to your private voice channel")
     async def add_user(
@@ -1435,10 +2048,10 @@ class ModerationCog(commands.Cog):
         """Grant a specific user access to your private voice channel"""
         try:
             # Check if command user owns any private room
-            channel_data = await self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
+            channel_data = await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
                 "owner_id": str(interaction.user.id),
                 "guild_id": str(interaction.guild.id)
-            })
+            }))
             
             if not channel_data:
                 embed = discord.Embed(
@@ -1529,10 +2142,10 @@ class ModerationCog(commands.Cog):
         """Remove a user from your private voice channel"""
         try:
             # Check if command user owns any private room
-            channel_data = await self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
+            channel_data = await mongo_store.call(lambda: self.mongo_client.Protonn.PrivateVoiceChannels.find_one({
                 "owner_id": str(interaction.user.id),
                 "guild_id": str(interaction.guild.id)
-            })
+            }))
             
             if not channel_data:
                 embed = discord.Embed(
@@ -1623,10 +2236,10 @@ class ModerationCog(commands.Cog):
     ):
         """Send a message as an embed"""
         try:
-            quote =  await self.db.find_one({"server_id": interaction.guild.id})
-            quote = quote['configs']['quote'] if quote else None
+            quote = await self.get_configs(interaction.guild.id, "quote")
+            quote = quote.get('quote') if quote else None
 
-            if quote["active"] == False:
+            if not quote or not quote["active"]:
                 embed = discord.Embed(
                     title="Quote System Disabled",
                     description="The quote system is disabled in this server. Please contact an admin for more information. If you believe this is an error, please contact support.",
@@ -1664,26 +2277,351 @@ class ModerationCog(commands.Cog):
                 return
 
             channel = interaction.guild.get_channel(quote_channel)
-            message = await interaction.channel.fetch_message(message_id)
+            # Most quotes target recent messages, so try the caches before any REST call
+            message = self.get_cached_message(interaction.guild, message_id, interaction.user)
+            if not message:
+                await interaction.response.defer(ephemeral=True)
+                fetched = await self.fetch_message_from_channels(interaction.guild, message_id, interaction.channel, interaction.user)
+                if fetched:
+                    self.message_cache.add(fetched)
+                    message = CachedMessage.from_message(fetched)
+            send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
             if not message:
-                await interaction.response.send_message("Message not found. Maybe the message was deleted?\n-# Make sure you are using this command in the channel the message was sent", ephemeral=True)
+                await send("Message not found. Maybe the message was deleted?\n-# Make sure you are using this command in the channel the message was sent or a recently active one", ephemeral=True)
                 return
 
             embed = discord.Embed(
                 title=f"Quoted Message",
-                description=f'"{message.content}"\n\n -{message.author.mention}',
+                description=f'"{message.content}"\n\n -<@{message.author_id}>',
                 color=discord.Color.dark_gold(),
                 timestamp=datetime.now()
             )
-            embed.set_thumbnail(url=message.author.display_avatar.url)
+            author = interaction.guild.get_member(message.author_id)
+            if author:
+                embed.set_thumbnail(url=author.display_avatar.url)
             embed.add_field(name="", value=f"[View Original]({message.jump_url})", inline=False)
             embed.set_footer(text=f"Quoted by {interaction.user.display_name}", icon_url=interaction.user.display_avatar.url)
-            channel.send(embed=embed)
-
+            await channel.send(embed=embed)
+            await send(f"✅ Message quoted in {channel.mention}", ephemeral=True)
             
         except Exception as e:
             logger.error(f"Error quoting message: {str(e)}")
-            await interaction.response.send_message("An error occurred while quoting the message.", ephemeral=True)
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while quoting the message.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while quoting the message.", ephemeral=True)
+
+    @app_commands.command(name="download", description="Download the audio or video of a link")
+    @app_commands.describe(link="Link to the media", kind="Download the audio (mp3) or the video")
+    @app_commands.choices(kind=[
+        app_commands.Choice(name="Audio", value="audio"),
+        app_commands.Choice(name="Video", value="video")
+    ])
+    @rate_limit(times=3, seconds=60)
+    async def download(
+        self,
+        interaction: discord.Interaction,
+        link: str,
+        kind: app_commands.Choice[str]
+    ):
+        """Download media in the process pool and upload it as a file"""
+        try:
+            feature = f"download_{kind.value}"
+            configs = await self.get_configs(interaction.guild.id, feature)
+            config = configs.get(feature) if configs else None
+            banned = set(config.get("ban_roles", [])) if config else set()
+            if not config or not config["active"] or any(role.id in banned for role in interaction.user.roles):
+                embed = discord.Embed(
+                    title="Downloads Disabled",
+                    description=f"{kind.name} downloads are not available to you in this server. Please contact an admin for more information.",
+                    color=discord.Color.red()
+                )
+                embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+                await interaction.response.send_message(embed=embed, ephemeral=True)
+                return
+
+            await interaction.response.defer(thinking=True)
+            for attempt in range(2):
+                try:
+                    result = await self.downloads.submit(
+                        interaction.guild.id, interaction.user.id, link, kind.value,
+                        max_bytes=interaction.guild.filesize_limit
+                    )
+                except DownloadError as e:
+                    embed = discord.Embed(title="Download Failed", description=str(e)[:4000], color=discord.Color.red())
+                    embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+                    await interaction.followup.send(embed=embed)
+                    return
+                try:
+                    fp = open(result.path, 'rb')
+                    break
+                except FileNotFoundError:
+                    if not result.cached or attempt:
+                        raise
+                    # Another process sharing the media cache evicted the file since it was indexed here
+                    self.downloads.forget(link, kind.value)
+
+            try:
+                # The upload streams from the open file, the media is never held in memory
+                with fp:
+                    await interaction.followup.send(
+                        content=f"**{discord.utils.escape_markdown(result.title)}**",
+                        file=discord.File(fp, filename=result.filename)
+                    )
+                await self.downloads.record(interaction.guild.id, interaction.user.id, kind.value, link, result)
+            finally:
+                self.downloads.discard(result)
+        except Exception as e:
+            logger.error(f"Error downloading media: {str(e)}")
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while downloading the media.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while downloading the media.", ephemeral=True)
+
+    async def check_music_access(self, interaction: discord.Interaction) -> bool:
+        """Reply with the reason and return False if the user can't control music here"""
+        configs = await self.get_configs(interaction.guild.id, "music_playback")
+        config = configs.get("music_playback") if configs else None
+        banned = set(config.get("ban_roles", [])) if config else set()
+        if not config or not config["active"] or any(role.id in banned for role in interaction.user.roles):
+            description = "Music playback is not available to you in this server. Please contact an admin for more information."
+        elif not interaction.user.voice or not interaction.user.voice.channel:
+            description = "Join a voice channel first."
+        else:
+            return True
+        embed = discord.Embed(title="Music Unavailable", description=description, color=discord.Color.red())
+        embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return False
+
+    @app_commands.command(name="play", description="Play a song or link in your voice channel")
+    @app_commands.describe(query="Song name or link")
+    @rate_limit(times=10, seconds=60)
+    async def play(self, interaction: discord.Interaction, query: str):
+        """Queue a track, joining the user's voice channel if needed"""
+        try:
+            if not await self.check_music_access(interaction):
+                return
+
+            await interaction.response.defer(thinking=True)
+            channel = interaction.user.voice.channel
+            try:
+                track = await self.music.resolve(query, interaction.user.id)
+                position = await self.music.enqueue(
+                    interaction.guild.id, track, connect=lambda: channel.connect(self_deaf=True)
+                )
+            except MusicError as e:
+                embed = discord.Embed(title="Could Not Play", description=str(e)[:4000], color=discord.Color.red())
+                embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+                await interaction.followup.send(embed=embed)
+                return
+
+            player = self.music.players.get(interaction.guild.id)
+            playing_now = player is not None and player.current is None and position == 1
+            embed = discord.Embed(
+                title="Now Playing" if playing_now else "Added to Queue",
+                description=f"**{discord.utils.escape_markdown(track.title)}**" + ("" if playing_now else f"\nPosition {position} in the queue"),
+                color=discord.Color.dark_gold()
+            )
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.followup.send(embed=embed)
+        except Exception as e:
+            logger.error(f"Error playing music: {str(e)}")
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while playing music.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while playing music.", ephemeral=True)
+
+    @app_commands.command(name="skip", description="Skip the current song")
+    async def skip(self, interaction: discord.Interaction):
+        """Skip to the next queued track"""
+        if not await self.check_music_access(interaction):
+            return
+        player = self.music.players.get(interaction.guild.id)
+        skipped = player is not None and player.skip()
+        await interaction.response.send_message("Skipped." if skipped else "Nothing is playing.", ephemeral=not skipped)
+
+    @app_commands.command(name="stop", description="Stop the music and leave the voice channel")
+    async def stop(self, interaction: discord.Interaction):
+        """Clear the queue and disconnect"""
+        if not await self.check_music_access(interaction):
+            return
+        stopped = await self.music.stop(interaction.guild.id)
+        await interaction.response.send_message("Stopped and left the channel." if stopped else "Nothing is playing.", ephemeral=not stopped)
+
+    @app_commands.command(name="queue", description="Show the music queue")
+    async def queue(self, interaction: discord.Interaction):
+        """Show the current track and the next ones"""
+        player = self.music.players.get(interaction.guild.id)
+        if player is None or (player.current is None and not player.queue):
+            await interaction.response.send_message("The queue is empty.", ephemeral=True)
+            return
+        lines = []
+        if player.current:
+            lines.append(f"**Now playing:** {discord.utils.escape_markdown(player.current.title)}")
+        for index, track in enumerate(list(player.queue)[:10], start=1):
+            lines.append(f"`{index}.` {discord.utils.escape_markdown(track.title)}")
+        if len(player.queue) > 10:
+            lines.append(f"...and {len(player.queue) - 10} more")
+        embed = discord.Embed(title="Music Queue", description="\n".join(lines), color=discord.Color.dark_gold())
+        embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+        await interaction.response.send_message(embed=embed)
+
+    async def deliver_reminder(self, job: dict):
+        """Post a due reminder using the guild's scheduler template"""
+        guild = self.bot.get_guild(job["guild_id"])
+        if guild is None:
+            raise DeliveryError(f"Guild {job['guild_id']} is not available")
+        configs = await self.get_configs(guild.id, "scheduler")
+        if configs is None:
+            raise DeliveryError("Could not load the scheduler config")
+        config = configs.get("scheduler")
+        if not config or not config["active"]:
+            return
+
+        channel = guild.get_channel(config["channel"]) if config.get("channel") else None
+        channel = channel or guild.get_channel_or_thread(job["channel_id"])
+        if channel is None:
+            raise DeliveryError(f"Channel {job['channel_id']} is not available")
+        member = guild.get_member(job["user_id"])
+        if member is None:
+            try:
+                member = await guild.fetch_member(job["user_id"])
+            except discord.NotFound:
+                member = None
+        name = member.name if member else str(job["user_id"])
+        mention = f"<@{job['user_id']}>"
+        embed = discord.Embed(
+            title=config["message"]["title"].format(user=name, user_mention=mention, server=guild.name),
+            description=config["message"]["content"].format(user=name, user_mention=mention, server=guild.name),
+            color=discord.Color.blurple()
+        )
+        embed.add_field(name="Message", value=job["content"], inline=False)
+        if member:
+            embed.set_thumbnail(url=config["message"]["thumbnail"].format(user=member.display_avatar.url, server=guild.icon))
+        embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+        await channel.send(content=mention, embed=embed, allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False))
+
+    @app_commands.command(name="remind", description="Get reminded about something later")
+    @app_commands.describe(when="Delay, like 10m, 2h30m or 1d", message="What to remind you about")
+    @rate_limit(times=5, seconds=60)
+    async def remind(self, interaction: discord.Interaction, when: str, message: app_commands.Range[str, 1, 1000]):
+        """Schedule a reminder in the current channel"""
+        try:
+            configs = await self.get_configs(interaction.guild.id, "scheduler")
+            config = configs.get("scheduler") if configs else None
+            if not config or not config["active"]:
+                await interaction.response.send_message("Reminders are not enabled in this server. Please contact an admin for more information.", ephemeral=True)
+                return
+
+            delay = parse_delay(when)
+            if delay is None or delay > timedelta(days=365):
+                await interaction.response.send_message("Use a delay like `10m`, `2h30m` or `1d`, up to a year.", ephemeral=True)
+                return
+            if await self.scheduler.pending_count(interaction.guild.id, interaction.user.id) >= 25:
+                await interaction.response.send_message("You already have 25 pending reminders in this server.", ephemeral=True)
+                return
+
+            due_at = datetime.utcnow() + delay
+            await self.scheduler.schedule(interaction.guild.id, interaction.channel.id, interaction.user.id, message, due_at)
+            embed = discord.Embed(
+                title="Reminder Set",
+                description=f"I'll remind you <t:{int(due_at.replace(tzinfo=timezone.utc).timestamp())}:R>",
+                color=discord.Color.blurple()
+            )
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error scheduling reminder: {str(e)}")
+            if interaction.response.is_done():
+                await interaction.followup.send("An error occurred while setting the reminder.", ephemeral=True)
+            else:
+                await interaction.response.send_message("An error occurred while setting the reminder.", ephemeral=True)
+
+    @app_commands.command(name="reminders", description="List your pending reminders")
+    async def reminders(self, interaction: discord.Interaction):
+        """Show the user's next reminders in this server"""
+        try:
+            jobs = await self.scheduler.upcoming(interaction.guild.id, interaction.user.id)
+            if not jobs:
+                await interaction.response.send_message("You have no pending reminders.", ephemeral=True)
+                return
+            lines = [
+                f"<t:{int(job['due_at'].replace(tzinfo=timezone.utc).timestamp())}:R> {discord.utils.escape_markdown(job['content'][:100])}"
+                for job in jobs
+            ]
+            embed = discord.Embed(title="Your Reminders", description="\n".join(lines), color=discord.Color.blurple())
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error listing reminders: {str(e)}")
+            await interaction.response.send_message("An error occurred while listing your reminders.", ephemeral=True)
+
+    @app_commands.command(name="rank", description="Show your level or another member's")
+    @app_commands.describe(user="Member to show, yourself by default")
+    async def rank(self, interaction: discord.Interaction, user: Optional[discord.Member] = None):
+        """Show a member's level, XP and position"""
+        try:
+            user = user or interaction.user
+            stats = await self.levels.rank(interaction.guild.id, user.id)
+            if stats is None:
+                await interaction.response.send_message(f"{user.display_name} has no XP yet.", ephemeral=True)
+                return
+            embed = discord.Embed(title=f"{user.display_name}'s Rank", color=discord.Color.gold())
+            embed.set_thumbnail(url=user.display_avatar.url)
+            embed.add_field(name="Level", value=str(stats["level"]), inline=True)
+            embed.add_field(name="Position", value=f"#{stats['position']}", inline=True)
+            embed.add_field(name="XP", value=f"{stats['level_xp']}/{stats['level_needed']} ({stats['xp']} total)", inline=True)
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed)
+        except Exception as e:
+            logger.error(f"Error showing rank: {str(e)}")
+            await interaction.response.send_message("An error occurred while fetching the rank.", ephemeral=True)
+
+    @app_commands.command(name="leaderboard", description="Show the server's top members by XP")
+    async def leaderboard(self, interaction: discord.Interaction):
+        """Show the top 10 members by XP"""
+        try:
+            rows = await self.levels.leaderboard(interaction.guild.id)
+            if not rows:
+                await interaction.response.send_message("Nobody has earned XP in this server yet.", ephemeral=True)
+                return
+            lines = [
+                f"`{index}.` <@{row['user_id']}> - Level {row['level']} ({row['xp']} XP)"
+                for index, row in enumerate(rows, start=1)
+            ]
+            embed = discord.Embed(title=f"{interaction.guild.name} Leaderboard", description="\n".join(lines), color=discord.Color.gold())
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+        except Exception as e:
+            logger.error(f"Error showing leaderboard: {str(e)}")
+            await interaction.response.send_message("An error occurred while fetching the leaderboard.", ephemeral=True)
+
+    @app_commands.command(name="usage", description="Show the server's download and music usage")
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.describe(days="Number of days to cover, up to 90")
+    async def usage_report(self, interaction: discord.Interaction, days: app_commands.Range[int, 1, 90] = 30):
+        """Summarise the daily usage rollups of the last days"""
+        try:
+            end = datetime.utcnow().date()
+            rows = await self.usage.daily(interaction.guild.id, end - timedelta(days=days - 1), end)
+            totals = {field: sum(row[field] for row in rows) for field in ("downloads", "downloads_audio", "downloads_video", "download_bytes", "plays")}
+            busiest = max(rows, key=lambda row: row["downloads"] + row["plays"])
+            embed = discord.Embed(title=f"Usage over the last {days} days", color=discord.Color.blurple())
+            embed.add_field(
+                name="Downloads",
+                value=f"{totals['downloads']} ({totals['downloads_audio']} audio, {totals['downloads_video']} video)\n"
+                      f"{totals['download_bytes'] / 1024 / 1024:.1f} MiB delivered",
+                inline=True
+            )
+            embed.add_field(name="Songs Played", value=str(totals["plays"]), inline=True)
+            if busiest["downloads"] or busiest["plays"]:
+                embed.add_field(name="Busiest Day", value=f"{busiest['day']} ({busiest['downloads']} downloads, {busiest['plays']} plays)", inline=False)
+            embed.set_footer(text="Developed by Pro-tonn", icon_url=self.bot.user.display_avatar)
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error showing usage: {str(e)}")
+            await interaction.response.send_message("An error occurred while fetching the usage.", ephemeral=True)
 
 async def setup(bot):
     """Setup function for the cog"""
@@ -1692,13 +2630,20 @@ async def setup(bot):
 # Create bot instance and run
 bot = ModBot()
 
+async def run_bot():
+    """Run the bot until SIGTERM/SIGINT, then drain and shut down within the deadline"""
+    bot.shutdown.install_signal_handlers()
+    runner = asyncio.create_task(bot.start(TOKEN))
+    stopper = asyncio.create_task(bot.shutdown.wait())
+    done, _ = await asyncio.wait({runner, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    stopper.cancel()
+    if runner in done and runner.exception():
+        logger.error(f"Unexpected error: {str(runner.exception())}")
+
+    logger.info("Bot shutdown initiated")
+    await bot.shutdown.run(bot)
+    await asyncio.gather(runner, return_exceptions=True)
+
 # Run the bot
 if __name__ == "__main__":
-    try:
-        asyncio.run(bot.start(TOKEN))
-    except KeyboardInterrupt:
-        logger.info("Bot shutdown initiated")
-        asyncio.run(bot.close())
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        asyncio.run(bot.close())
\ No newline at end of file
+    asyncio.run(run_bot())
\ No newline at end of file
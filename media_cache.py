@@ -0,0 +1,219 @@
+"""On-disk cache of downloaded media, keyed by source and format.
+
+Entries live under ``MEDIA_CACHE_DIR`` as ``objects/<ab>/<sha256><ext>`` with a
+JSON sidecar holding the title and size. Files are written to ``tmp/`` first
+and moved into place with ``os.replace``, so concurrent writers of the same key
+never expose a partial file and the last complete one wins. Lookups only touch
+memory; the keys they hit are mirrored to the files' mtimes by ``sync``, and
+the mtimes give the LRU order. Several processes may share the directory:
+``put`` re-reads it from its worker thread before evicting, so ``max_bytes``
+caps the total on disk, and a hit whose file another process evicted is
+dropped with ``forget``. On POSIX a file being uploaded stays readable after
+its eviction.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urldefrag
+
+logger = logging.getLogger('ModBot')
+
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'protonn-media-cache'))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_MB', '2048')) * 1024 * 1024
+# Temp files this old cannot belong to a running download
+STALE_TMP_SECONDS = 3600
+
+
+class CacheEntry:
+    def __init__(self, key: str, path: str, title: str, size: int):
+        self.key = key
+        self.path = path
+        self.title = title
+        self.size = size
+
+
+def cache_key(source: str, kind: str) -> str:
+    """Stable key of a request; local files also key on their size and mtime"""
+    source = source.strip()
+    if '://' in source and not source.startswith('file://'):
+        source = urldefrag(source)[0]
+    else:
+        path = source[len('file://'):] if source.startswith('file://') else source
+        try:
+            stat = os.stat(path)
+            source = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            pass
+    return hashlib.sha256(f"{kind}\0{source}".encode()).hexdigest()
+
+
+class MediaCache:
+    """Byte-capped LRU of media files on local disk"""
+
+    def __init__(self, root: str = MEDIA_CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        # Keys hit since the last sync, whose mtimes are behind
+        self._touched = set()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self._load()
+
+    def _object_path(self, key: str, ext: str = '') -> str:
+        return os.path.join(self.root, 'objects', key[:2], key + ext)
+
+    def _scan(self) -> OrderedDict:
+        """Every complete entry on disk, least recently used first; blocking"""
+        found = []
+        objects = os.path.join(self.root, 'objects')
+        for directory, _, files in os.walk(objects):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(directory, name)) as f:
+                        meta = json.load(f)
+                    path = self._object_path(meta['key'], meta['ext'])
+                    found.append((os.stat(path).st_mtime, CacheEntry(meta['key'], path, meta['title'], meta['size'])))
+                except (OSError, ValueError, KeyError):
+                    # An interrupted write or eviction; the orphan is harmless
+                    continue
+        return OrderedDict((entry.key, entry) for _, entry in sorted(found, key=lambda item: item[0]))
+
+    def _load(self):
+        """Rebuild the index from disk"""
+        self._entries = self._scan()
+        self.bytes = sum(entry.size for entry in self._entries.values())
+        # Leftovers from writers that died before their rename; another process may still be writing newer ones
+        cutoff = time.time() - STALE_TMP_SECONDS
+        for entry in os.scandir(os.path.join(self.root, 'tmp')):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        if self._entries:
+            logger.info(f"Media cache loaded {len(self._entries)} entries ({self.bytes / 1024 / 1024:.0f} MiB)")
+
+    def get(self, key: str, max_bytes: Optional[int] = None, count: bool = True) -> Optional[CacheEntry]:
+        """The entry for ``key`` if cached (and not over ``max_bytes``), marking it recently used.
+
+        Repeat lookups for the same request pass ``count=False`` to keep the hit/miss metrics per request.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (max_bytes is not None and entry.size > max_bytes):
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self._touched.add(key)
+            self.hits += count
+        return entry
+
+    def sync(self):
+        """Mirror recent hits to the files' mtimes and drop entries removed behind our back; blocking"""
+        with self._lock:
+            touched, self._touched = self._touched, set()
+            entries = [self._entries[key] for key in touched if key in self._entries]
+        missing = []
+        for entry in entries:
+            try:
+                os.utime(entry.path)
+            except FileNotFoundError:
+                missing.append(entry)
+            except OSError:
+                pass
+        with self._lock:
+            for entry in missing:
+                if self._entries.get(entry.key) is entry:
+                    del self._entries[entry.key]
+                    self.bytes -= entry.size
+
+    def put(self, key: str, source_path: str, title: str) -> CacheEntry:
+        """Move a finished file into the cache; blocking, run it in a thread"""
+        ext = os.path.splitext(source_path)[1]
+        path = self._object_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(source_path)
+
+        tmp = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        # A rename when the download dir is on the same filesystem, a copy otherwise
+        shutil.move(source_path, tmp + ext)
+        with open(tmp + '.json', 'w') as f:
+            json.dump({'key': key, 'ext': ext, 'title': title, 'size': size, 'stored_at': time.time()}, f)
+        os.replace(tmp + ext, path)
+        os.replace(tmp + '.json', self._object_path(key, '.json'))
+
+        entry = CacheEntry(key, path, title, size)
+        # Other processes sharing the directory store and evict too; re-read it so the cap covers
+        # everything on disk, with this process's recent hits in the mtimes first
+        self.sync()
+        entries = self._scan()
+        with self._lock:
+            previous = self._entries.get(key)
+            entries.pop(key, None)
+            entries[key] = entry
+            self._entries = entries
+            self.bytes = sum(item.size for item in entries.values())
+            self.stores += 1
+            evicted = self._evict()
+        if previous is not None and previous.path != path:
+            # Same request in a different container format; the sidecar was already replaced
+            try:
+                os.remove(previous.path)
+            except FileNotFoundError:
+                pass
+        for old in evicted:
+            self._remove_files(old)
+        return entry
+
+    def forget(self, key: str):
+        """Drop an entry whose file turned out to be gone, e.g. evicted by another process"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+    def _evict(self) -> list:
+        evicted = []
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.bytes -= old.size
+            self.evictions += 1
+            evicted.append(old)
+        return evicted
+
+    def _remove_files(self, entry: CacheEntry):
+        for path in (self._object_path(entry.key, '.json'), entry.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,81 @@
+"""Per-guild LRU of recently seen messages and recently active channels."""
+from collections import OrderedDict
+from typing import List, Optional
+
+import discord
+
+
+class CachedMessage:
+    """The parts of a message /quote needs, without the author, channel and guild objects"""
+    __slots__ = ('id', 'channel_id', 'author_id', 'content', 'jump_url')
+
+    def __init__(self, id: int, channel_id: int, author_id: int, content: str, jump_url: str):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.content = content
+        self.jump_url = jump_url
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> 'CachedMessage':
+        return cls(message.id, message.channel.id, message.author.id, message.content, message.jump_url)
+
+
+class GuildMessageCache:
+    """Bounded LRU caches keyed by guild.
+
+    Keeps the last ``per_guild`` messages and ``channels_per_guild`` active
+    channels for at most ``max_guilds`` guilds, evicting the least recently
+    active guild first.
+    """
+
+    def __init__(self, per_guild: int = 200, channels_per_guild: int = 10, max_guilds: int = 1000):
+        self.per_guild = per_guild
+        self.channels_per_guild = channels_per_guild
+        self.max_guilds = max_guilds
+        self._messages: OrderedDict = OrderedDict()
+        self._channels: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _guild_entry(self, store: OrderedDict, guild_id: int) -> OrderedDict:
+        entry = store.get(guild_id)
+        if entry is None:
+            entry = store[guild_id] = OrderedDict()
+            if len(store) > self.max_guilds:
+                store.popitem(last=False)
+        else:
+            store.move_to_end(guild_id)
+        return entry
+
+    def add(self, message: discord.Message):
+        if message.guild is None:
+            return
+        messages = self._guild_entry(self._messages, message.guild.id)
+        messages[message.id] = CachedMessage.from_message(message)
+        messages.move_to_end(message.id)
+        if len(messages) > self.per_guild:
+            messages.popitem(last=False)
+
+        channels = self._guild_entry(self._channels, message.guild.id)
+        channels[message.channel.id] = None
+        channels.move_to_end(message.channel.id)
+        if len(channels) > self.channels_per_guild:
+            channels.popitem(last=False)
+
+    def get(self, guild_id: int, message_id: int) -> Optional[CachedMessage]:
+        message = self._messages.get(guild_id, {}).get(message_id)
+        if message is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return message
+
+    def remove(self, guild_id: int, message_id: int):
+        messages = self._messages.get(guild_id)
+        if messages:
+            messages.pop(message_id, None)
+
+    def recent_channels(self, guild_id: int) -> List[int]:
+        """Channel ids with recent activity, most recent first"""
+        return list(reversed(self._channels.get(guild_id, ())))
@@ -0,0 +1,161 @@
+"""One-time Mongo data migrations, each recorded in the Migrations collection once applied."""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from usage import download_counters, play_counters
+
+logger = logging.getLogger('ModBot')
+
+
+async def split_server_snapshots(db, batch_size: int = 500):
+    """Move the channel/role snapshots out of ServerProperties into ServerSnapshots"""
+    moved = 0
+    snapshots = []
+    unsets = []
+    cursor = db.ServerProperties.find(
+        {"$or": [{"channels": {"$exists": True}}, {"roles": {"$exists": True}}]},
+        {"server_id": 1, "channels": 1, "roles": 1}
+    )
+    async for server in cursor:
+        snapshots.append(UpdateOne(
+            {"server_id": server['server_id']},
+            # Never overwrite a snapshot the running bot already refreshed
+            {"$setOnInsert": {"channels": server.get('channels', []), "roles": server.get('roles', [])}},
+            upsert=True
+        ))
+        unsets.append(UpdateOne({"_id": server['_id']}, {"$unset": {"channels": "", "roles": ""}}))
+
+        if len(snapshots) >= batch_size:
+            await db.ServerSnapshots.bulk_write(snapshots, ordered=False)
+            await db.ServerProperties.bulk_write(unsets, ordered=False)
+            moved += len(snapshots)
+            snapshots, unsets = [], []
+
+    if snapshots:
+        await db.ServerSnapshots.bulk_write(snapshots, ordered=False)
+        await db.ServerProperties.bulk_write(unsets, ordered=False)
+        moved += len(snapshots)
+    return moved
+
+
+async def date_raw_events(db):
+    """Give raw download and play events without a ``created_at`` date the time from their ObjectId.
+
+    Events from before ``created_at`` was recorded were only removed by the
+    month-based cleanup; with a date they expire through the TTL index. The
+    backfill has already rolled them up by their ObjectId time.
+    """
+    dated = 0
+    for collection_name in ('DownloadActivities', 'MusicActivites'):
+        result = await db[collection_name].update_many(
+            {"created_at": {"$not": {"$type": "date"}}},
+            [{"$set": {"created_at": {"$toDate": "$_id"}}}]
+        )
+        dated += result.modified_count
+    return dated
+
+
+def _event_counters(collection_name: str, event: dict) -> dict:
+    if collection_name != 'DownloadActivities':
+        return play_counters()
+    kind = event.get('kind')
+    counters = download_counters(kind, event.get('size') or 0, bool(event.get('cached')))
+    if kind not in ('audio', 'video'):
+        # Events from before the kind was recorded only count as downloads
+        del counters[f'downloads_{kind}']
+    return counters
+
+
+async def _apply_backfill_batch(db, collection_name: str, batch: ObjectId) -> int:
+    """Add one claimed batch of raw events to UsageDaily, at most once per rollup document"""
+    totals: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    cursor = db[collection_name].find({"backfill_batch": batch}, {"guild_id": 1, "created_at": 1, "kind": 1, "size": 1, "cached": 1})
+    async for event in cursor:
+        # Undated events are rolled up before date_raw_events runs, by the time in their ObjectId
+        created_at = event.get('created_at')
+        if not isinstance(created_at, datetime):
+            created_at = event['_id'].generation_time
+        counters = totals[(event['guild_id'], created_at.strftime("%Y-%m-%d"))]
+        for field, value in _event_counters(collection_name, event).items():
+            counters[field] += value
+    # The batch id on the rollup makes a repeated run (after a crash, or on another instance) a no-op
+    operations = [
+        UpdateOne(
+            {"guild_id": guild_id, "day": day, "backfilled": {"$ne": batch}},
+            {"$inc": {field: value for field, value in counters.items() if value}, "$addToSet": {"backfilled": batch}},
+            upsert=True
+        )
+        for (guild_id, day), counters in totals.items()
+    ]
+    if operations:
+        try:
+            await db.UsageDaily.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # A duplicate key means the rollup exists and already has this batch
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+    await db[collection_name].update_many({"backfill_batch": batch}, {"$set": {"rolled_up": True}, "$unset": {"backfill_batch": ""}})
+    # The events can no longer be claimed again, so the rollups don't need the batch id any more
+    await db.UsageDaily.update_many({"backfilled": batch}, {"$pull": {"backfilled": batch}})
+    return len(operations)
+
+
+async def backfill_usage_rollups(db, batch_size: int = 500):
+    """Roll the raw download and play events recorded before UsageDaily existed into it.
+
+    Events are claimed in batches and marked rolled up once their batch is in
+    UsageDaily, so the migration can be interrupted and rerun without counting
+    anything twice.
+    """
+    rolled = 0
+    for collection_name in ('DownloadActivities', 'MusicActivites'):
+        collection = db[collection_name]
+        # Batches claimed by a run that died before finishing them
+        for batch in await collection.distinct("backfill_batch", {"backfill_batch": {"$exists": True}}):
+            rolled += await _apply_backfill_batch(db, collection_name, batch)
+
+        while True:
+            # Events recorded since the rollups shipped are counted live and marked as such
+            cursor = collection.find(
+                {"rolled_up": {"$ne": True}, "backfill_batch": {"$exists": False}},
+                {"_id": 1}
+            ).sort("_id", 1).limit(batch_size)
+            ids = [event['_id'] for event in await cursor.to_list(length=batch_size)]
+            if not ids:
+                break
+            batch = ObjectId()
+            await collection.update_many(
+                {"_id": {"$in": ids}, "backfill_batch": {"$exists": False}},
+                {"$set": {"backfill_batch": batch}}
+            )
+            rolled += await _apply_backfill_batch(db, collection_name, batch)
+    return rolled
+
+
+# Applied in order; a name must never be reused once it has shipped.
+# The backfill goes before date_raw_events, so no dated event expires before it is rolled up.
+MIGRATIONS = [
+    ('split_server_snapshots', split_server_snapshots),
+    ('backfill_usage_rollups', backfill_usage_rollups),
+    ('date_raw_events', date_raw_events),
+]
+
+
+async def run_migrations(db):
+    """Apply every migration that has not been recorded as done yet"""
+    for name, migration in MIGRATIONS:
+        if await db.Migrations.find_one({"_id": name}):
+            continue
+        result = await migration(db)
+        try:
+            await db.Migrations.insert_one({"_id": name, "completed_at": datetime.utcnow(), "result": result})
+        except DuplicateKeyError:
+            # Another instance applied it concurrently; migrations are idempotent
+            pass
+        logger.info(f"Applied migration {name}: {result}")
@@ -0,0 +1,66 @@
+"""Moderation history for /warn and AutoMod actions."""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from write_behind import WriteBehindBuffer
+
+
+class ModLogStore:
+    """Write-behind store for moderation records with a paginated history query.
+
+    Records are buffered and inserted in batches, so a record only shows up in
+    ``history`` once its batch has been flushed (at most ``flush_interval`` later).
+    """
+
+    def __init__(self, collection, batch_size: int = 100, flush_interval: float = 0.5, max_pending: int = 10000):
+        self.collection = collection
+        self.buffer = WriteBehindBuffer(collection, batch_size=batch_size, flush_interval=flush_interval, max_pending=max_pending)
+
+    def start(self):
+        self.buffer.start()
+
+    async def close(self):
+        await self.buffer.close()
+
+    async def record_warn(self, guild_id: int, user_id: int, moderator_id: int, reason: str):
+        await self.buffer.put({
+            "type": "warn",
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "moderator_id": moderator_id,
+            "reason": reason,
+            "created_at": datetime.utcnow()
+        })
+
+    async def record_automod(self, guild_id: int, user_id: int, rule_id: Optional[int], trigger: str,
+                             action: str, channel_id: Optional[int], content: Optional[str]):
+        await self.buffer.put({
+            "type": "automod",
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "rule_id": rule_id,
+            "trigger": trigger,
+            "action": action,
+            "channel_id": channel_id,
+            "content": content,
+            "created_at": datetime.utcnow()
+        })
+
+    async def history(self, guild_id: int, user_id: Optional[int] = None, before: Optional[str] = None,
+                      limit: int = 10) -> Tuple[List[dict], Optional[str]]:
+        """Return a page of records, newest first, and the cursor for the next page.
+
+        Pages are keyed on ``_id`` rather than skipped, so every page is a
+        bounded range scan on the (guild_id, user_id, _id) index.
+        """
+        query = {"guild_id": guild_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        if before:
+            query["_id"] = {"$lt": ObjectId(before)}
+
+        records = await self.collection.find(query).sort("_id", -1).limit(limit + 1).to_list(length=limit + 1)
+        next_cursor = str(records[limit - 1]["_id"]) if len(records) > limit else None
+        return records[:limit], next_cursor
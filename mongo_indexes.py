@@ -0,0 +1,130 @@
+"""Index provisioning and query-plan checks for the bot's Mongo collections."""
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from usage import RAW_EVENT_RETENTION_DAYS
+
+logger = logging.getLogger('ModBot')
+
+# Indexes every collection needs, created idempotently at startup
+INDEXES: Dict[str, List[IndexModel]] = {
+    'ServerProperties': [
+        IndexModel([('server_id', ASCENDING)], name='server_id_unique', unique=True),
+    ],
+    'ServerSnapshots': [
+        IndexModel([('server_id', ASCENDING)], name='server_id_unique', unique=True),
+    ],
+    'PrivateVoiceChannels': [
+        IndexModel([('channel_id', ASCENDING)], name='channel_id_unique', unique=True),
+        IndexModel([('owner_id', ASCENDING), ('guild_id', ASCENDING)], name='owner_guild'),
+    ],
+    'ClaimServer': [
+        IndexModel([('claim_code', ASCENDING)], name='claim_code_unique', unique=True),
+        IndexModel([('server_id', ASCENDING)], name='server_id_unique', unique=True),
+    ],
+    'ModerationLogs': [
+        IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING), ('_id', DESCENDING)], name='guild_user_history'),
+        IndexModel([('guild_id', ASCENDING), ('_id', DESCENDING)], name='guild_history'),
+    ],
+    'VoiceActivities': [
+        IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING), ('month', ASCENDING)], name='guild_user_month', unique=True),
+    ],
+    # Raw events expire once they are past the retention; the daily rollups keep the history
+    'DownloadActivities': [
+        IndexModel([('created_at', ASCENDING)], name='created_at_ttl', expireAfterSeconds=RAW_EVENT_RETENTION_DAYS * 86400),
+    ],
+    'MusicActivites': [
+        IndexModel([('created_at', ASCENDING)], name='created_at_ttl', expireAfterSeconds=RAW_EVENT_RETENTION_DAYS * 86400),
+    ],
+    'UsageDaily': [
+        IndexModel([('guild_id', ASCENDING), ('day', ASCENDING)], name='guild_day_unique', unique=True),
+    ],
+    'MemberLevels': [
+        IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING)], name='guild_user_unique', unique=True),
+        IndexModel([('guild_id', ASCENDING), ('xp', DESCENDING)], name='guild_leaderboard'),
+    ],
+    'ScheduledJobs': [
+        # Only pending jobs are indexed on due time, so delivered ones don't grow the scheduler's index
+        IndexModel([('due_at', ASCENDING)], name='pending_due', partialFilterExpression={'status': 'pending'}),
+        IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING), ('due_at', ASCENDING)], name='guild_user_pending',
+                   partialFilterExpression={'status': 'pending'}),
+        IndexModel([('claimed_at', ASCENDING)], name='claimed', partialFilterExpression={'status': 'claimed'}),
+        IndexModel([('delivered_at', ASCENDING)], name='delivered_ttl', expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+# Representative filters for the queries the event handlers and commands run most often
+HOT_QUERIES: List[tuple] = [
+    ('ServerProperties', {'server_id': 0}),
+    ('ServerSnapshots', {'server_id': 0}),
+    ('PrivateVoiceChannels', {'channel_id': '0'}),
+    ('PrivateVoiceChannels', {'owner_id': '0', 'guild_id': '0'}),
+    ('ClaimServer', {'claim_code': '00000'}),
+    ('ClaimServer', {'server_id': '0'}),
+    ('ModerationLogs', {'guild_id': 0, 'user_id': 0}),
+    ('ModerationLogs', {'guild_id': 0}),
+    ('UsageDaily', {'guild_id': 0, 'day': {'$gte': '1970-01-01', '$lte': '1970-01-31'}}),
+    ('MemberLevels', {'guild_id': 0, 'user_id': 0}),
+    ('MemberLevels', {'guild_id': 0, 'xp': {'$gt': 0}}),
+    ('ScheduledJobs', {'status': 'pending', 'due_at': {'$lt': datetime(1970, 1, 1)}}),
+    ('ScheduledJobs', {'guild_id': 0, 'user_id': 0, 'status': 'pending'}),
+    ('ScheduledJobs', {'status': 'claimed', 'claimed_at': {'$lt': datetime(1970, 1, 1)}}),
+]
+
+
+def _is_ttl(index: IndexModel) -> bool:
+    return 'expireAfterSeconds' in index.document
+
+
+async def ensure_indexes(db, ttl: bool = True):
+    """Create any missing indexes; existing indexes with the same spec are left untouched.
+
+    With ``ttl`` False the expiring indexes are skipped, so the migrations can
+    roll up and date the raw events before the TTL monitor starts deleting them.
+    """
+    for collection_name, indexes in INDEXES.items():
+        indexes = [index for index in indexes if ttl or not _is_ttl(index)]
+        if not indexes:
+            continue
+        try:
+            created = await db[collection_name].create_indexes(indexes)
+            logger.info(f"Ensured indexes on {collection_name}: {', '.join(created)}")
+        except OperationFailure as e:
+            if e.code == 11000:
+                logger.error(f"Duplicate keys in {collection_name} prevent a unique index, clean them up: {str(e)}")
+            else:
+                logger.error(f"Error creating indexes on {collection_name}: {str(e)}")
+
+
+def _plan_stages(plan: dict):
+    """Yield every stage name in an explain() plan tree"""
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for stage in plan.get('inputStages', []):
+        yield from _plan_stages(stage)
+
+
+async def verify_query_plans(db) -> List[tuple]:
+    """Explain every registered hot query and warn about the ones that fall back to a COLLSCAN"""
+    collscans = []
+    for collection_name, query in HOT_QUERIES:
+        try:
+            explain = await db[collection_name].find(query).explain()
+        except Exception as e:
+            logger.error(f"Error explaining query on {collection_name}: {str(e)}")
+            continue
+
+        stages = set(_plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {})))
+        if 'COLLSCAN' in stages:
+            collscans.append((collection_name, query))
+            logger.warning(f"Query {query} on {collection_name} uses a COLLSCAN, check its indexes")
+    return collscans
@@ -0,0 +1,470 @@
+"""Per-guild music playback for the music_playback feature.
+
+Each guild gets a ``GuildPlayer`` with its own track queue. While a track plays,
+the next one is prepared ahead of time: its stream URL is resolved, its FFmpeg
+process is started and the first second of Opus packets is decoded into memory,
+so the next track starts without a gap when the current one ends. A
+process-wide ``StreamLimiter`` caps how many FFmpeg processes (playing or
+prefetched) exist at once; prefetching is skipped rather than queued when the
+cap is reached.
+
+Enqueue-to-first-packet latency and the gap between consecutive tracks are
+measured for every track. Local files are accepted as tracks when
+``MUSIC_ALLOW_LOCAL=1``, and running this module plays local files through a
+fake voice client without Discord:
+
+    python music.py first.mp3 second.ogg --realtime
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+import discord
+
+from downloads import DownloadError, check_public_url
+from usage import UsageRollups, play_counters
+from write_behind import WriteBehindBuffer
+
+logger = logging.getLogger('ModBot')
+
+MAX_STREAMS = int(os.getenv('MUSIC_MAX_STREAMS', '20'))
+# Opus frames are 20ms, so 50 frames is one second of audio decoded ahead
+PREFETCH_FRAMES = 50
+FFMPEG_BEFORE_OPTIONS = '-nostdin -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+
+class MusicError(Exception):
+    """A track could not be queued or played"""
+
+
+class MusicCapacityError(MusicError):
+    """Every stream slot of the process is in use"""
+
+
+class Track:
+    def __init__(self, source: str, title: str, requested_by: int, stream_url: Optional[str] = None,
+                 duration: Optional[float] = None):
+        self.source = source
+        self.title = title
+        self.requested_by = requested_by
+        self.stream_url = stream_url
+        self.duration = duration
+        self.enqueued_at = time.perf_counter()
+
+
+class StreamLimiter:
+    """Counts FFmpeg processes across all guilds; released from the voice threads"""
+
+    def __init__(self, max_streams: int = MAX_STREAMS):
+        self.max_streams = max_streams
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.active >= self.max_streams:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class PrefetchedSource(discord.AudioSource):
+    """An FFmpeg Opus stream with its first packets decoded ahead of playback.
+
+    Owns one ``StreamLimiter`` slot, acquired by the caller and released on
+    cleanup (which discord.py also runs when the source is garbage collected).
+    """
+
+    def __init__(self, track: Track, limiter: StreamLimiter, on_first_packet: Callable[[Track], None]):
+        self.track = track
+        self._limiter = limiter
+        self._on_first_packet = on_first_packet
+        self._buffer: Deque[bytes] = deque()
+        self._started = False
+        self._released = False
+        self._source: Optional[discord.FFmpegOpusAudio] = None
+        local = os.path.isfile(track.stream_url)
+        try:
+            self._source = discord.FFmpegOpusAudio(
+                track.stream_url,
+                bitrate=128,
+                before_options='-nostdin' if local else FFMPEG_BEFORE_OPTIONS,
+                options='-vn'
+            )
+        except Exception:
+            self.cleanup()
+            raise
+
+    def prime(self, frames: int = PREFETCH_FRAMES):
+        """Decode the first packets; blocking, run it in a thread"""
+        for _ in range(frames):
+            packet = self._source.read()
+            if not packet:
+                break
+            self._buffer.append(packet)
+
+    def read(self) -> bytes:
+        packet = self._buffer.popleft() if self._buffer else self._source.read()
+        if packet and not self._started:
+            self._started = True
+            self._on_first_packet(self.track)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._source is not None:
+            self._source.cleanup()
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+
+class GuildPlayer:
+    """Plays a guild's queue on one voice connection, preparing the next track ahead"""
+
+    def __init__(self, engine: 'MusicEngine', guild_id: int, voice_client, max_queue: int = 50,
+                 idle_timeout: float = 300.0):
+        self.engine = engine
+        self.guild_id = guild_id
+        self.voice_client = voice_client
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.queue: Deque[Track] = deque()
+        self.current: Optional[Track] = None
+        self.last_ended: Optional[float] = None
+        self._next: Optional[tuple] = None
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._finished)
+
+    def enqueue(self, track: Track) -> int:
+        if len(self.queue) >= self.max_queue:
+            raise MusicError(f"The queue is full ({self.max_queue} tracks)")
+        self.queue.append(track)
+        self._wakeup.set()
+        if self.current is not None:
+            self._schedule_prefetch()
+        return len(self.queue)
+
+    def skip(self) -> bool:
+        if self.voice_client.is_playing():
+            self.voice_client.stop()
+            return True
+        return False
+
+    async def stop(self):
+        self.queue.clear()
+        self._drop_prefetch()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _schedule_prefetch(self):
+        if self._next is None and self.queue:
+            track = self.queue[0]
+            self._next = (track, asyncio.create_task(self.engine.prepare(track, prefetch=True)))
+
+    def _drop_prefetch(self):
+        if self._next is None:
+            return
+        _, task = self._next
+        self._next = None
+        task.add_done_callback(_cleanup_prepared)
+        task.cancel()
+
+    async def _take_prefetched(self, track: Track) -> Optional[PrefetchedSource]:
+        if self._next is None or self._next[0] is not track:
+            # The queue changed since the prefetch started
+            self._drop_prefetch()
+            return None
+        _, task = self._next
+        self._next = None
+        try:
+            return await task
+        except Exception:
+            return None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not self.queue:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        return
+                    continue
+
+                track = self.queue.popleft()
+                source = await self._take_prefetched(track)
+                self.engine.record_prefetch(source is not None)
+                if source is None:
+                    try:
+                        source = await self.engine.prepare(track)
+                    except Exception as e:
+                        logger.warning(f"Could not play {track.title} in guild {self.guild_id}: {str(e)}")
+                        continue
+
+                finished = asyncio.Event()
+
+                def after(error):
+                    self.last_ended = time.perf_counter()
+                    if error:
+                        logger.error(f"Error playing {track.title} in guild {self.guild_id}: {str(error)}")
+                    loop.call_soon_threadsafe(finished.set)
+
+                self.current = track
+                self.voice_client.play(source, after=after)
+                self._schedule_prefetch()
+                await self.engine.record_play(self.guild_id, track)
+                await finished.wait()
+                self.current = None
+        finally:
+            if self.engine.players.get(self.guild_id) is self:
+                del self.engine.players[self.guild_id]
+            self._drop_prefetch()
+            if self.voice_client.is_playing():
+                self.voice_client.stop()
+            await self.voice_client.disconnect(force=True)
+
+    def _finished(self, task: asyncio.Task):
+        # Nothing awaits the task unless the player is stopped, so failures are reported here
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error in the music player of guild {self.guild_id}: {str(task.exception())}")
+
+
+def _cleanup_prepared(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is None and task.result() is not None:
+        task.result().cleanup()
+
+
+def resolve_query(query: str, allow_local: bool) -> dict:
+    """Find the title and stream URL of a link, search or local file; blocking"""
+    # Never look at the filesystem for users who may not play local files
+    if allow_local and os.path.isfile(query):
+        return {'title': os.path.splitext(os.path.basename(query))[0], 'url': query, 'duration': None}
+    if '://' in query:
+        _check_public(query)
+
+    import yt_dlp
+
+    options = {'format': 'bestaudio/best', 'noplaylist': True, 'quiet': True, 'no_warnings': True,
+               'default_search': 'ytsearch'}
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(query, download=False)
+    if 'entries' in info:
+        entries = [entry for entry in info['entries'] if entry]
+        if not entries:
+            raise MusicError(f"Nothing found for {query}")
+        info = entries[0]
+    # Redirects and extractors can end up somewhere else than the link; FFmpeg opens the stream URL itself
+    for resolved in (info.get('webpage_url'), info['url']):
+        if resolved:
+            _check_public(resolved)
+    return {'title': info.get('title') or query, 'url': info['url'], 'duration': info.get('duration')}
+
+
+def _check_public(url: str):
+    try:
+        check_public_url(url)
+    except DownloadError as e:
+        raise MusicError(str(e)) from None
+
+
+class MusicEngine:
+    """All guild players of the process, the stream cap and the latency metrics"""
+
+    def __init__(self, activities, max_streams: int = MAX_STREAMS, prefetch_frames: int = PREFETCH_FRAMES,
+                 allow_local: Optional[bool] = None, rollups: Optional[UsageRollups] = None):
+        self.activities = WriteBehindBuffer(activities, batch_size=50, flush_interval=5.0) if activities is not None else None
+        self.rollups = rollups
+        self.limiter = StreamLimiter(max_streams)
+        self.prefetch_frames = prefetch_frames
+        if allow_local is None:
+            allow_local = os.getenv('MUSIC_ALLOW_LOCAL', '0').lower() in ('1', 'true', 'yes')
+        self.allow_local = allow_local
+        self.players: Dict[int, GuildPlayer] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.latencies: Deque[float] = deque(maxlen=500)
+        self.gaps: Deque[float] = deque(maxlen=500)
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+
+    def start(self):
+        if self.activities is not None:
+            self.activities.start()
+
+    async def resolve(self, query: str, requested_by: int) -> Track:
+        try:
+            info = await asyncio.to_thread(resolve_query, query, self.allow_local)
+        except MusicError:
+            raise
+        except Exception as e:
+            raise MusicError(f"Could not load {query}: {str(e)}") from None
+        return Track(query, info['title'], requested_by, stream_url=info['url'], duration=info['duration'])
+
+    async def enqueue(self, guild_id: int, track: Track, connect: Callable[[], Awaitable]) -> int:
+        """Queue a track, connecting a player for the guild if needed; returns the queue position"""
+        player = self.players.get(guild_id)
+        if player is None:
+            if self.limiter.active >= self.limiter.max_streams:
+                raise MusicCapacityError("All music streams are in use, please try again later")
+            voice_client = await connect()
+            player = self.players[guild_id] = GuildPlayer(self, guild_id, voice_client)
+        return player.enqueue(track)
+
+    async def prepare(self, track: Track, prefetch: bool = False) -> Optional[PrefetchedSource]:
+        """Start FFmpeg for a track and decode its first packets"""
+        if not self.limiter.try_acquire():
+            if prefetch:
+                return None
+            raise MusicCapacityError("All music streams are in use, please try again later")
+        self._loop = asyncio.get_running_loop()
+        # On failure the source gives its slot back itself
+        source = await asyncio.to_thread(PrefetchedSource, track, self.limiter, self._first_packet)
+        try:
+            await asyncio.to_thread(source.prime, self.prefetch_frames)
+        except BaseException:
+            source.cleanup()
+            raise
+        return source
+
+    def _first_packet(self, track: Track):
+        # Called from the voice thread; the players are only read on the event loop
+        try:
+            self._loop.call_soon_threadsafe(self._record_first_packet, track, time.perf_counter())
+        except RuntimeError:
+            # The loop closed during shutdown
+            pass
+
+    def _record_first_packet(self, track: Track, now: float):
+        self.latencies.append(now - track.enqueued_at)
+        player = next((p for p in self.players.values() if p.current is track), None)
+        if player is not None and player.last_ended is not None:
+            self.gaps.append(now - player.last_ended)
+
+    def record_prefetch(self, hit: bool):
+        if hit:
+            self.prefetch_hits += 1
+        else:
+            self.prefetch_misses += 1
+
+    async def record_play(self, guild_id: int, track: Track):
+        if self.rollups is not None:
+            self.rollups.add(guild_id, play_counters())
+        if self.activities is None:
+            return
+        await self.activities.put({
+            "guild_id": guild_id,
+            "user_id": track.requested_by,
+            "title": track.title,
+            "source": track.source,
+            "rolled_up": self.rollups is not None,
+            "created_at": datetime.utcnow()
+        })
+
+    async def stop(self, guild_id: int) -> bool:
+        player = self.players.get(guild_id)
+        if player is None:
+            return False
+        await player.stop()
+        return True
+
+    async def close(self):
+        """Disconnect every player and flush the play records"""
+        await asyncio.gather(*(player.stop() for player in list(self.players.values())), return_exceptions=True)
+        if self.activities is not None:
+            await self.activities.close()
+
+    def stats(self) -> dict:
+        def percentile(values, q):
+            ordered = sorted(values)
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1) if ordered else None
+
+        return {
+            'players': len(self.players),
+            'streams': self.limiter.active,
+            'max_streams': self.limiter.max_streams,
+            'first_packet_ms_p50': percentile(self.latencies, 0.5),
+            'first_packet_ms_p95': percentile(self.latencies, 0.95),
+            'gap_ms_p50': percentile(self.gaps, 0.5),
+            'gap_ms_p95': percentile(self.gaps, 0.95),
+            'prefetch_hits': self.prefetch_hits,
+            'prefetch_misses': self.prefetch_misses,
+        }
+
+
+class _FakeVoiceClient:
+    """Reads packets like discord's player thread, at real time or as fast as possible"""
+
+    def __init__(self, realtime: bool):
+        self.realtime = realtime
+        self._playing = threading.Event()
+        self._stop = threading.Event()
+
+    def play(self, source: discord.AudioSource, after: Callable):
+        self._stop.clear()
+        self._playing.set()
+
+        def run():
+            next_at = time.perf_counter()
+            while not self._stop.is_set() and source.read():
+                if self.realtime:
+                    next_at += 0.02
+                    time.sleep(max(0.0, next_at - time.perf_counter()))
+            source.cleanup()
+            self._playing.clear()
+            after(None)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def is_playing(self) -> bool:
+        return self._playing.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+    async def disconnect(self, force: bool = False):
+        self.stop()
+
+
+async def _benchmark(paths, realtime: bool, max_streams: int):
+    engine = MusicEngine(None, max_streams=max_streams, allow_local=True)
+    voice_client = _FakeVoiceClient(realtime)
+    for path in paths:
+        track = await engine.resolve(path, 0)
+        await engine.enqueue(0, track, connect=lambda: asyncio.sleep(0, voice_client))
+    player = engine.players[0]
+    player.idle_timeout = 0.1
+    await player._task
+    print(engine.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play local files through the music engine with a fake voice client")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--realtime', action='store_true', help="Consume packets at playback speed")
+    parser.add_argument('--max-streams', type=int, default=MAX_STREAMS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_benchmark(args.paths, args.realtime, args.max_streams))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Background message purge jobs that go beyond the 100 message bulk-delete limit."""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, List, Optional
+
+import discord
+
+logger = logging.getLogger('ModBot')
+
+# Discord refuses to bulk delete messages older than 14 days; keep a margin for clock skew
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+BULK_DELETE_SIZE = 100
+
+
+class PurgeJob:
+    """Stream a channel's history and delete the matching messages.
+
+    Messages younger than 14 days are removed with bulk deletes of up to 100,
+    older ones are deleted one by one by a small pool of workers.
+    """
+
+    def __init__(self, channel: discord.abc.Messageable, limit: int, author: Optional[discord.abc.User] = None,
+                 contains: Optional[str] = None, bots_only: bool = False, before: Optional[discord.abc.Snowflake] = None,
+                 concurrency: int = 3):
+        self.channel = channel
+        self.limit = limit
+        self.author = author
+        self.contains = contains.lower() if contains else None
+        self.bots_only = bots_only
+        self.before = before
+        self.concurrency = concurrency
+        # Filtered purges may have to look further back to find enough matches
+        filtered = author is not None or contains or bots_only
+        self.scan_limit = min(limit * 10, 100000) if filtered else limit
+
+        self.scanned = 0
+        self.matched = 0
+        self.deleted = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Deleted messages per second"""
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def stop(self):
+        """Stop scanning; the matched messages already queued are still deleted"""
+        self.stopping = True
+
+    def matches(self, message: discord.Message) -> bool:
+        if self.author is not None and message.author.id != self.author.id:
+            return False
+        if self.bots_only and not message.author.bot:
+            return False
+        if self.contains is not None and self.contains not in message.content.lower():
+            return False
+        return True
+
+    async def _bulk_delete(self, messages: List[discord.Message]):
+        try:
+            if len(messages) == 1:
+                await messages[0].delete()
+            else:
+                await self.channel.delete_messages(messages)
+            self.deleted += len(messages)
+        except discord.NotFound:
+            # Some were already gone; the rest were still deleted
+            self.deleted += len(messages)
+        except discord.HTTPException as e:
+            self.failed += len(messages)
+            logger.error(f"Error bulk deleting {len(messages)} messages in {self.channel.id}: {str(e)}")
+
+    async def _delete_worker(self, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
+            try:
+                if message is None:
+                    return
+                await message.delete()
+                self.deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                self.failed += 1
+                logger.warning(f"Error deleting message {message.id}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def run(self, progress: Optional[Callable[['PurgeJob'], Awaitable[None]]] = None, progress_interval: float = 3.0):
+        """Run the purge, calling ``progress`` at most every ``progress_interval`` seconds"""
+        old_messages: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        workers = [asyncio.create_task(self._delete_worker(old_messages)) for _ in range(self.concurrency)]
+        chunk: List[discord.Message] = []
+        last_progress = time.monotonic()
+
+        try:
+            cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+            async for message in self.channel.history(limit=self.scan_limit, before=self.before):
+                self.scanned += 1
+                if not self.matches(message):
+                    continue
+                self.matched += 1
+
+                if message.created_at > cutoff:
+                    chunk.append(message)
+                    if len(chunk) == BULK_DELETE_SIZE:
+                        await self._bulk_delete(chunk)
+                        chunk = []
+                else:
+                    # Blocks while the workers are behind, which paces the history scan
+                    await old_messages.put(message)
+
+                if progress and time.monotonic() - last_progress >= progress_interval:
+                    last_progress = time.monotonic()
+                    await progress(self)
+
+                if self.matched >= self.limit or self.stopping:
+                    break
+
+            if chunk:
+                await self._bulk_delete(chunk)
+            for _ in workers:
+                await old_messages.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished = time.monotonic()
+
+        if progress:
+            await progress(self)
@@ -0,0 +1,362 @@
+"""Gateway event recording and replay harness for load testing.
+
+Recording is enabled on the live bot by setting ``GATEWAY_RECORD_PATH``; every
+recorded gateway dispatch is appended to that file as one JSON line.
+
+Replaying feeds a recording into ``ModBot``/``ModerationCog`` without a live
+Discord connection. Discord HTTP is pointed at a local stub server that records
+every call, and the handlers still talk to the Mongo/MySQL instances configured
+in the environment:
+
+    python replay.py events.jsonl --speed 10
+    python replay.py events.jsonl --speed 0   # as fast as possible
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import statistics
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger('ModBot.replay')
+
+# GUILD_CREATE is recorded so replays can rebuild the guild cache before the timed events
+RECORDED_EVENTS = (
+    'GUILD_CREATE',
+    'GUILD_MEMBER_ADD',
+    'GUILD_MEMBER_REMOVE',
+    'VOICE_STATE_UPDATE',
+    'INTERACTION_CREATE',
+)
+SEED_EVENTS = ('GUILD_CREATE',)
+
+STUB_APPLICATION_ID = '100000000000000001'
+STUB_USER = {
+    'id': STUB_APPLICATION_ID,
+    'username': 'Pro-tonn',
+    'discriminator': '0',
+    'global_name': None,
+    'avatar': None,
+    'bot': True,
+}
+
+# Set while a replayed event is being parsed, inherited by every task its handlers spawn
+_current_trace: contextvars.ContextVar[Optional['EventTrace']] = contextvars.ContextVar('replay_trace', default=None)
+
+
+class EventRecorder:
+    """Append selected gateway dispatches to a JSONL file"""
+
+    def __init__(self, path: str, events=RECORDED_EVENTS):
+        self.path = path
+        self.events = events
+        self.started = time.monotonic()
+        self.count = 0
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def install(self, bot):
+        """Wrap the connection state parsers so recorded events are written before they are handled"""
+        parsers = bot._connection.parsers
+        for event in self.events:
+            parser = parsers.get(event)
+            if parser is not None:
+                parsers[event] = self._wrap(event, parser)
+        logger.info(f"Recording gateway events {', '.join(self.events)} to {self.path}")
+
+    def _wrap(self, event: str, parser):
+        def recorded(data):
+            try:
+                self.write(event, data)
+            except Exception as e:
+                logger.error(f"Error recording {event} event: {str(e)}")
+            return parser(data)
+        return recorded
+
+    def write(self, event: str, data: dict):
+        record = {'t': round(time.monotonic() - self.started, 6), 'event': event, 'd': data}
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.count += 1
+        if self.count % 100 == 0:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def load_events(path: str) -> List[dict]:
+    """Load a JSONL recording, ordered by capture time"""
+    with open(path, encoding='utf-8') as fp:
+        events = [json.loads(line) for line in fp if line.strip()]
+    events.sort(key=lambda e: e['t'])
+    return events
+
+
+class StubDiscordServer:
+    """Minimal local stand-in for the Discord REST API that records every call"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.calls: List[tuple] = []
+        self._runner: Optional[web.AppRunner] = None
+        self._ids = 200000000000000000
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/api/v10'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/api/v10/{tail:.*}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def _json(data) -> web.Response:
+        # discord.py only decodes bodies whose content type is exactly application/json
+        return web.Response(body=json.dumps(data).encode(), headers={'Content-Type': 'application/json'})
+
+    def _next_id(self) -> str:
+        self._ids += 1
+        return str(self._ids)
+
+    def _message(self, channel_id: str, body: dict) -> dict:
+        return {
+            'id': self._next_id(),
+            'channel_id': channel_id,
+            'author': STUB_USER,
+            'content': body.get('content') or '',
+            'timestamp': '2024-01-01T00:00:00+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': body.get('embeds') or [],
+            'components': body.get('components') or [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = '/' + request.match_info['tail']
+        self.calls.append((request.method, path))
+        body = {}
+        if request.can_read_body and request.content_type == 'application/json':
+            body = await request.json()
+
+        parts = path.strip('/').split('/')
+        if path == '/users/@me':
+            return self._json(STUB_USER)
+        if path == '/oauth2/applications/@me':
+            return self._json({
+                'id': STUB_APPLICATION_ID,
+                'name': STUB_USER['username'],
+                'icon': None,
+                'description': '',
+                'bot_public': True,
+                'bot_require_code_grant': False,
+                'owner': STUB_USER,
+                'verify_key': '',
+                'flags': 0,
+            })
+        if path == '/users/@me/channels':
+            return self._json({'id': self._next_id(), 'type': 1, 'recipients': [{'id': body.get('recipient_id', '0'), 'username': 'user', 'discriminator': '0', 'avatar': None}]})
+        if request.method == 'PUT' and parts[-1] == 'commands':
+            return self._json([])
+        if request.method == 'DELETE' or parts[0] == 'interactions':
+            return web.Response(status=204)
+        if parts[0] == 'channels' and 'messages' in parts:
+            return self._json(self._message(parts[1], body))
+        if parts[0] == 'webhooks':
+            return self._json(self._message('0', body))
+        return self._json({})
+
+
+class EventTrace:
+    """Tracks the tasks spawned while handling one replayed event"""
+
+    __slots__ = ('event', 'started', 'finished', 'pending', 'rest_calls', 'done')
+
+    def __init__(self, event: str):
+        self.event = event
+        self.started = time.perf_counter()
+        self.finished = self.started
+        self.pending = 0
+        self.rest_calls = 0
+        self.done = asyncio.Event()
+        self.done.set()
+
+    def task_started(self, task: asyncio.Task):
+        self.pending += 1
+        self.done.clear()
+        task.add_done_callback(self._task_finished)
+
+    def _task_finished(self, task: asyncio.Task):
+        self.pending -= 1
+        self.finished = time.perf_counter()
+        if self.pending == 0:
+            self.done.set()
+
+    @property
+    def latency(self) -> float:
+        return self.finished - self.started
+
+
+def _tracing_task_factory(loop, coro, **kwargs):
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.task_started(task)
+    return task
+
+
+class Replayer:
+    """Feed a recording into a logged-in ``ModBot`` and measure the handlers"""
+
+    def __init__(self, bot, events: List[dict], speed: float = 1.0):
+        self.bot = bot
+        self.events = events
+        self.speed = speed
+        self.traces: List[EventTrace] = []
+        self.unknown = Counter()
+
+    def _count_requests(self):
+        request = self.bot.http.request
+
+        async def counted(route, **kwargs):
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.rest_calls += 1
+            return await request(route, **kwargs)
+
+        self.bot.http.request = counted
+
+    def seed(self):
+        """Build the guild cache from the recorded GUILD_CREATE payloads without dispatching events"""
+        state = self.bot._connection
+        seeded = 0
+        for event in self.events:
+            if event['event'] in SEED_EVENTS and not event['d'].get('unavailable'):
+                state._get_create_guild(event['d'])
+                seeded += 1
+        logger.info(f"Seeded {seeded} guilds from recording")
+
+    async def run(self) -> float:
+        loop = asyncio.get_running_loop()
+        loop.set_task_factory(_tracing_task_factory)
+        try:
+            self._count_requests()
+            parsers = self.bot._connection.parsers
+
+            timed = [e for e in self.events if e['event'] not in SEED_EVENTS]
+            if not timed:
+                return 0.0
+            first = timed[0]['t']
+            started = time.perf_counter()
+
+            for event in timed:
+                if self.speed > 0:
+                    delay = (event['t'] - first) / self.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                parser = parsers.get(event['event'])
+                if parser is None:
+                    self.unknown[event['event']] += 1
+                    continue
+
+                trace = EventTrace(event['event'])
+                token = _current_trace.set(trace)
+                try:
+                    parser(event['d'])
+                except Exception as e:
+                    logger.error(f"Error parsing replayed {event['event']} event: {str(e)}")
+                finally:
+                    _current_trace.reset(token)
+                self.traces.append(trace)
+                # Let the handlers run between events the way the gateway reader would
+                await asyncio.sleep(0)
+
+            await asyncio.gather(*(trace.done.wait() for trace in self.traces))
+        finally:
+            loop.set_task_factory(None)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float, stub: StubDiscordServer) -> str:
+        by_event: Dict[str, List[EventTrace]] = defaultdict(list)
+        for trace in self.traces:
+            by_event[trace.event].append(trace)
+
+        lines = [
+            f"Replayed {len(self.traces)} events in {elapsed:.3f}s "
+            f"({len(self.traces) / elapsed if elapsed else 0:.1f} events/s end-to-end, speed {self.speed or 'max'})",
+            '',
+            f"{'event':<22}{'count':>8}{'mean ms':>10}{'p95 ms':>10}{'REST':>8}{'REST/evt':>10}",
+        ]
+        for event, traces in sorted(by_event.items()):
+            latencies = sorted(t.latency * 1000 for t in traces)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            rest = sum(t.rest_calls for t in traces)
+            lines.append(
+                f"{event:<22}{len(traces):>8}{statistics.mean(latencies):>10.2f}{p95:>10.2f}{rest:>8}{rest / len(traces):>10.2f}"
+            )
+
+        routes = Counter(f"{method} {path}" for method, path in stub.calls)
+        if routes:
+            lines += ['', 'Stub REST calls:']
+            lines += [f"  {count:>6}  {route}" for route, count in routes.most_common(20)]
+        if self.unknown:
+            lines += ['', f"Skipped events without a parser: {dict(self.unknown)}"]
+        return '\n'.join(lines)
+
+
+async def replay(path: str, speed: float) -> str:
+    import discord
+    from main import ModBot
+
+    stub = StubDiscordServer()
+    await stub.start()
+    discord.http.Route.BASE = stub.base_url
+
+    bot = ModBot()
+    # There is no gateway to request member chunks from during a replay
+    bot._connection._chunk_guilds = False
+    bot.serve_health = False
+    try:
+        await bot.login('replay-token')
+        replayer = Replayer(bot, load_events(path), speed)
+        replayer.seed()
+        elapsed = await replayer.run()
+        return replayer.report(elapsed, stub)
+    finally:
+        await bot.close()
+        await stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded gateway events into ModBot")
+    parser.add_argument('path', help="JSONL recording written with GATEWAY_RECORD_PATH")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier, 0 replays as fast as possible")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv('REPLAY_LOG_LEVEL', 'WARNING'))
+    print(asyncio.run(replay(args.path, args.speed)))
+
+
+if __name__ == '__main__':
+    main()
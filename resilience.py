@@ -0,0 +1,194 @@
+"""Circuit breakers, deadlines and retries around the datastores.
+
+Every call made through a ``Datastore`` gets a deadline. Transient failures are
+retried with jittered exponential backoff while the deadline allows. Repeated
+failures open the store's breaker, after which calls fail immediately (or return
+the caller's fallback) until a probe call succeeds after ``reset_timeout``.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, WTimeoutError
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger('ModBot')
+
+_MISSING = object()
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a datastore whose breaker is open"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit is open, retrying in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures, half-opens after ``reset_timeout``"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.calls = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            logger.info(f"{self.name} circuit half-open, probing")
+        # While half-open a single call probes the store, everything else is rejected
+        if self.state == CLOSED or (self.state == HALF_OPEN and not self._probing):
+            self._probing = self.state == HALF_OPEN
+            self.calls += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def release(self):
+        """Give up a probe slot without an outcome, e.g. when the caller was cancelled"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+                logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'retry_in_s': round(self.retry_in(), 1) if self.state == OPEN else None,
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'trips': self.trips,
+        }
+
+
+class Datastore:
+    """Runs calls against one datastore with a deadline, retries and a circuit breaker.
+
+    ``transient`` lists the exceptions that count against the breaker and are
+    retried; anything else (a duplicate key, a bad query) is raised unchanged.
+    """
+
+    def __init__(self, name: str, transient: Tuple[type, ...], deadline: float = 3.0, retries: int = 2,
+                 backoff_base: float = 0.1, backoff_max: float = 1.0, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, sync_workers: int = 4):
+        self.name = name
+        self.sync_workers = sync_workers
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.transient = transient + (asyncio.TimeoutError,)
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    async def call(self, fn: Callable[[], Awaitable], deadline: float = None, retries: int = None,
+                   fallback: Any = _MISSING) -> Any:
+        """Await ``fn()`` within the deadline.
+
+        When the breaker is open or every attempt failed, ``fallback`` is returned
+        if given, otherwise the error is raised. Pass ``retries=0`` for writes
+        that are not safe to repeat.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        retries = self.retries if retries is None else retries
+        expires = time.monotonic() + deadline
+
+        if not self.breaker.allow():
+            if fallback is not _MISSING:
+                return fallback
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(fn(), timeout=max(0.01, expires - time.monotonic()))
+                self.breaker.record_success()
+                return result
+            except self.transient as e:
+                # Full jitter keeps retries from many handlers from arriving in waves
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if attempt < retries and time.monotonic() + delay < expires:
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                if fallback is not _MISSING:
+                    logger.warning(f"{self.name} call failed after {attempt + 1} attempts, using fallback: {str(e) or type(e).__name__}")
+                    return fallback
+                raise
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception:
+                # Not a datastore outage; the store answered
+                self.breaker.record_success()
+                raise
+
+    async def run_sync(self, fn: Callable[[], Any], **kwargs) -> Any:
+        """Run a blocking call (SQLAlchemy) in the store's own worker threads under the same policy.
+
+        A timed-out thread cannot be cancelled and keeps running, so sync calls
+        are not retried by default and use a small dedicated pool; a stalled
+        store then ties up ``sync_workers`` threads, not the default executor.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.sync_workers, thread_name_prefix=f"{self.name}-sync")
+        kwargs.setdefault('retries', 0)
+        loop = asyncio.get_running_loop()
+        return await self.call(lambda: loop.run_in_executor(self._executor, fn), **kwargs)
+
+    def shutdown(self):
+        """Stop the sync worker threads without waiting for stalled calls"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+mongo_store = Datastore('mongo', (ConnectionFailure, ExecutionTimeout, WTimeoutError))
+mysql_store = Datastore('mysql', (OperationalError, InterfaceError, PoolTimeoutError))
+
+# Driver-side timeouts, so abandoned calls do not hold connections for the driver defaults
+MONGO_CLIENT_OPTIONS = {
+    'serverSelectionTimeoutMS': 3000,
+    'connectTimeoutMS': 3000,
+    'socketTimeoutMS': 30000,
+}
+
+
+def breaker_states() -> Dict[str, dict]:
+    return {store.name: store.breaker.snapshot() for store in (mongo_store, mysql_store)}
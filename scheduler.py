@@ -0,0 +1,263 @@
+"""Persistent reminders and scheduled messages for the scheduler config.
+
+Jobs live in the ``ScheduledJobs`` collection, indexed on ``due_at`` for the
+pending ones only, so millions of future jobs cost nothing until they come
+due. The scheduler loads just the next ``window`` seconds of due jobs into a
+heap and sleeps until the earliest of them (or the end of the window). Each job
+is claimed with a conditional ``find_one_and_update`` before delivery, so when
+several processes load the same window only one of them fires it. Claims that
+are never completed (the process died) are released after ``lease`` seconds;
+a running delivery renews its claim so a slow send is never released. At most
+``max_deliveries`` jobs are claimed and delivered at once, and the next window
+is only loaded once the current deliveries have settled.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+logger = logging.getLogger('ModBot')
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class DeliveryError(Exception):
+    """A job could not be delivered yet; it is retried until ``max_attempts``"""
+
+
+class ReminderScheduler:
+    """Heap of the next window of due jobs with one wakeup for the earliest"""
+
+    def __init__(self, collection, deliver: Callable[[dict], Awaitable[None]], window: float = 300.0,
+                 max_window_jobs: int = 5000, lease: float = 300.0, max_attempts: int = 3,
+                 ready: Optional[Callable[[], Awaitable]] = None, max_deliveries: int = 20):
+        self.collection = collection
+        self.deliver = deliver
+        # Awaited before the first window is loaded, so nothing fires before the guild cache is filled
+        self.ready = ready
+        self.window = window
+        self.max_window_jobs = max_window_jobs
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._heap: List[Tuple[datetime, ObjectId]] = []
+        self._queued: Set[ObjectId] = set()
+        self._window_end = datetime.min
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+        self._delivery_slots = asyncio.Semaphore(max_deliveries)
+        # Jobs popped from the heap whose delivery task has not finished
+        self._firing: Set[ObjectId] = set()
+
+        self.fired = 0
+        self.lost_claims = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    async def schedule(self, guild_id: int, channel_id: int, user_id: int, content: str, due_at: datetime) -> ObjectId:
+        """Store a job; it joins the in-memory window right away if it falls inside it"""
+        job = {
+            "guild_id": guild_id,
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "content": content,
+            "due_at": due_at,
+            "status": PENDING,
+            "attempts": 0,
+            "created_at": datetime.utcnow()
+        }
+        result = await self.collection.insert_one(job)
+        if due_at < self._window_end:
+            self._push(due_at, result.inserted_id)
+        return result.inserted_id
+
+    async def upcoming(self, guild_id: int, user_id: int, limit: int = 10) -> List[dict]:
+        """A user's next pending jobs in a guild, soonest first"""
+        cursor = self.collection.find(
+            {"guild_id": guild_id, "user_id": user_id, "status": PENDING},
+            {"content": 1, "due_at": 1}
+        ).sort("due_at", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def pending_count(self, guild_id: int, user_id: int) -> int:
+        return await self.collection.count_documents({"guild_id": guild_id, "user_id": user_id, "status": PENDING})
+
+    def _push(self, due_at: datetime, job_id: ObjectId):
+        if job_id in self._queued or job_id in self._firing:
+            return
+        self._queued.add(job_id)
+        previous = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due_at, job_id))
+        if previous is None or due_at < previous:
+            # The earliest job changed, re-arm the single wakeup
+            self._changed.set()
+
+    async def _release_expired_claims(self, now: datetime):
+        result = await self.collection.update_many(
+            {"status": CLAIMED, "claimed_at": {"$lt": now - timedelta(seconds=self.lease)}},
+            {"$set": {"status": PENDING}, "$unset": {"claimed_by": "", "claimed_at": ""}}
+        )
+        if result.modified_count:
+            logger.warning(f"Released {result.modified_count} scheduled jobs whose claim expired")
+
+    async def _load_window(self):
+        """Load the pending jobs due before the end of the next window"""
+        now = datetime.utcnow()
+        await self._release_expired_claims(now)
+        window_end = now + timedelta(seconds=self.window)
+        cursor = self.collection.find(
+            {"status": PENDING, "due_at": {"$lt": window_end}},
+            {"due_at": 1}
+        ).sort("due_at", 1).limit(self.max_window_jobs)
+        jobs = await cursor.to_list(length=self.max_window_jobs)
+        for job in jobs:
+            self._push(job["due_at"], job["_id"])
+        # A full page means more jobs share the window; stop it at the last loaded one
+        self._window_end = jobs[-1]["due_at"] if len(jobs) == self.max_window_jobs else window_end
+
+    async def _run(self):
+        if self.ready is not None:
+            await self.ready()
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= self._window_end:
+                    # After downtime a full page can be overdue; loading the next one while its claims
+                    # are still pending would reload the same jobs over and over
+                    if self._deliveries:
+                        await asyncio.wait(set(self._deliveries))
+                    await self._load_window()
+                    now = datetime.utcnow()
+
+                while self._heap and self._heap[0][0] <= now:
+                    _, job_id = heapq.heappop(self._heap)
+                    self._queued.discard(job_id)
+                    self._firing.add(job_id)
+                    task = asyncio.create_task(self._fire(job_id))
+                    self._deliveries.add(task)
+                    task.add_done_callback(self._deliveries.discard)
+
+                wake_at = min(self._heap[0][0], self._window_end) if self._heap else self._window_end
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=max(0.0, (wake_at - datetime.utcnow()).total_seconds()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in scheduler loop: {str(e)}")
+                await asyncio.sleep(5)
+
+    async def _fire(self, job_id: ObjectId):
+        try:
+            async with self._delivery_slots:
+                await self._claim_and_deliver(job_id)
+        finally:
+            self._firing.discard(job_id)
+
+    async def _claim_and_deliver(self, job_id: ObjectId):
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {"_id": job_id, "status": PENDING, "due_at": {"$lte": now}},
+            {"$set": {"status": CLAIMED, "claimed_by": self.owner, "claimed_at": now}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            # Another process claimed it, or it was cancelled or rescheduled
+            self.lost_claims += 1
+            return
+
+        renewal = asyncio.create_task(self._renew_claim(job_id))
+        try:
+            await self.deliver(job)
+        except Exception as e:
+            logger.error(f"Error delivering scheduled job {job_id}: {str(e)}")
+            if job["attempts"] >= self.max_attempts:
+                self.failed += 1
+                await self.collection.update_one({"_id": job_id}, {"$set": {"status": FAILED, "error": str(e)}})
+            else:
+                retry_at = datetime.utcnow() + timedelta(seconds=30 * 2 ** job["attempts"])
+                await self.collection.update_one(
+                    {"_id": job_id},
+                    {"$set": {"status": PENDING, "due_at": retry_at}, "$unset": {"claimed_by": "", "claimed_at": ""}}
+                )
+                if retry_at < self._window_end:
+                    self._firing.discard(job_id)
+                    self._push(retry_at, job_id)
+            return
+        finally:
+            renewal.cancel()
+
+        self.fired += 1
+        await self.collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": DONE, "delivered_at": datetime.utcnow()}, "$unset": {"claimed_by": "", "claimed_at": ""}}
+        )
+
+    async def _renew_claim(self, job_id: ObjectId):
+        """Keep a claim fresh while its delivery runs, e.g. behind rate limits"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.collection.update_one(
+                    {"_id": job_id, "status": CLAIMED, "claimed_by": self.owner},
+                    {"$set": {"claimed_at": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew the claim of scheduled job {job_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'window_jobs': len(self._heap),
+            'delivering': len(self._deliveries),
+            'next_due': self._heap[0][0].isoformat() if self._heap else None,
+            'window_end': self._window_end.isoformat() if self._window_end != datetime.min else None,
+            'fired': self.fired,
+            'lost_claims': self.lost_claims,
+            'failed': self.failed,
+        }
+
+
+def parse_delay(text: str) -> Optional[timedelta]:
+    """Parse durations like ``90s``, ``10m``, ``2h30m`` or ``1d``"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    total = 0
+    number = ''
+    for char in text.strip().lower().replace(' ', ''):
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            total += int(number) * units[char]
+            number = ''
+        else:
+            return None
+    if number:
+        # A bare number means minutes
+        total += int(number) * 60
+    return timedelta(seconds=total) if total > 0 else None
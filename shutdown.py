@@ -0,0 +1,100 @@
+"""Graceful drain and shutdown sequence for SIGTERM/SIGINT."""
+import asyncio
+import inspect
+import logging
+import os
+import signal
+import time
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger('ModBot')
+
+# Docker sends SIGKILL after the stop grace period, keep the whole sequence inside it
+SHUTDOWN_DEADLINE = float(os.getenv('SHUTDOWN_DEADLINE', '25'))
+
+
+async def _call(fn: Callable):
+    result = fn()
+    if inspect.isawaitable(result):
+        await result
+
+
+class ShutdownCoordinator:
+    """Stop taking new work, drain in-flight work within a deadline, then close the pools.
+
+    Once ``accepting`` is False the bot stops dispatching gateway events, so
+    nothing feeds the buffers while they drain. Drainers (outbound work and
+    write-behind buffers) run concurrently and are cancelled once the drain
+    budget is spent. The bot is closed next, and the closers (database pools)
+    run last so drainers can still use them.
+    """
+
+    def __init__(self, deadline: float = SHUTDOWN_DEADLINE, close_reserve: float = 5.0):
+        self.deadline = deadline
+        self.close_reserve = close_reserve
+        self.accepting = True
+        self._drainers: List[Tuple[str, Callable]] = []
+        self._closers: List[Tuple[str, Callable]] = []
+        self._stopping: Optional[asyncio.Event] = None
+
+    def register_drain(self, name: str, fn: Callable):
+        self._drainers.append((name, fn))
+
+    def register_close(self, name: str, fn: Callable):
+        self._closers.append((name, fn))
+
+    def install_signal_handlers(self):
+        """Trigger the shutdown on SIGTERM (docker stop) and SIGINT (Ctrl+C)"""
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig)
+            except NotImplementedError:
+                # Windows event loops have no signal handler support
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.request_shutdown, signum))
+
+    def request_shutdown(self, sig=None):
+        if not self.accepting:
+            return
+        self.accepting = False
+        logger.info(f"Shutdown requested{f' by {signal.Signals(sig).name}' if sig else ''}, no longer accepting interactions")
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def wait(self):
+        await self._stopping.wait()
+
+    async def run(self, bot):
+        """Drain, close the bot, then close the pools, all within the deadline"""
+        self.accepting = False
+        started = time.monotonic()
+
+        drain_budget = max(0.0, self.deadline - self.close_reserve)
+        tasks = {asyncio.create_task(_call(fn)): name for name, fn in self._drainers}
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=drain_budget)
+            for task in done:
+                if task.exception():
+                    logger.error(f"Error draining {tasks[task]}: {str(task.exception())}")
+            for task in pending:
+                logger.warning(f"Drain of {tasks[task]} did not finish within {drain_budget:.0f}s, cancelling")
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+        try:
+            remaining = max(1.0, self.deadline - (time.monotonic() - started))
+            await asyncio.wait_for(bot.close(), timeout=remaining)
+        except asyncio.TimeoutError:
+            logger.warning("Closing the bot did not finish within the deadline")
+        except Exception as e:
+            logger.error(f"Error closing the bot: {str(e)}")
+
+        for name, fn in self._closers:
+            try:
+                await _call(fn)
+            except Exception as e:
+                logger.error(f"Error closing {name}: {str(e)}")
+
+        logger.info(f"Shutdown completed in {time.monotonic() - started:.1f}s")
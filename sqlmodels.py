@@ -0,0 +1,130 @@
+"""Standalone SQLAlchemy 2.0 models for the bot.
+
+Mirrors the tables declared in ``sqldb.py`` without constructing a Flask
+application, so the bot can use them without importing Flask, Werkzeug or
+Jinja. The engine and session factory are only created on first use.
+"""
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, create_engine, text
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, relationship, sessionmaker
+
+load_dotenv()
+
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Users(Base):
+    __tablename__ = 'users'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    username: Mapped[str] = mapped_column(String(20), unique=True, nullable=False)
+    email: Mapped[Optional[str]] = mapped_column(String(120), unique=True, nullable=True)
+    discord_id: Mapped[Optional[str]] = mapped_column(String(25), unique=True, nullable=True)
+    icon_url: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    date_created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    isAdmin: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    isStaff: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    isBanned: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    isPremium: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+
+    server: Mapped[List['Server']] = relationship(back_populates='server_admin')
+    subscriptions: Mapped[List['Subscriptions']] = relationship(back_populates='user')
+
+    def __repr__(self):
+        return f"User: '{self.username}'"
+
+# Server Model
+class Server(Base):
+    __tablename__ = 'server'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    discord_id: Mapped[str] = mapped_column(String(20), nullable=False, unique=True)
+    server_name: Mapped[str] = mapped_column(String(100), nullable=False)
+    isPremium: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    member_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    channel_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    icon_url: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    server_admin_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
+    server_admin: Mapped['Users'] = relationship(back_populates='server')
+    voice_time: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    download_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    subscriptions: Mapped[List['Subscriptions']] = relationship(back_populates='server')
+
+    def __repr__(self):
+        return f"<Server(name='{self.server_name}', discord_id='{self.discord_id}')>"
+
+# Subscriptions Model
+class Subscriptions(Base):
+    __tablename__ = 'subscriptions'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
+    user: Mapped['Users'] = relationship(back_populates='subscriptions')
+    tier: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    server_id: Mapped[int] = mapped_column(Integer, ForeignKey('server.id'), nullable=False)
+    server: Mapped['Server'] = relationship(back_populates='subscriptions')
+    service: Mapped[int] = mapped_column(Integer, nullable=False)
+    date_created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    expiry_date: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Subscription(service='{self.service}', user_id={self.user_id}, server_id={self.server_id})>"
+
+
+def database_url() -> URL:
+    """Build the MySQL URL from the same environment variables as ``sqldb.py``"""
+    return URL.create(
+        'mysql+pymysql',
+        username=os.getenv('MYSQL_USER'),
+        password=os.getenv('MYSQL_PASSWORD'),
+        host=os.getenv('MYSQL_HOST'),
+        port=int(os.getenv('MYSQL_PORT') or 3306),
+        database=os.getenv('MYSQL_DATABASE'),
+    )
+
+
+def get_engine() -> Engine:
+    """Create the engine on first use and reuse it afterwards"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            database_url(),
+            pool_size=10,
+            pool_recycle=280,  # Close connections after 280 seconds to prevent timeout
+            pool_pre_ping=True,  # Test connections before using them
+            pool_timeout=3,  # Fail fast instead of queueing behind a stalled server
+            connect_args={'connect_timeout': 3, 'read_timeout': 10, 'write_timeout': 10},
+        )
+    return _engine
+
+
+def get_session() -> Session:
+    """Open a new session bound to the lazily created engine"""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    return _session_factory()
+
+
+
+def ping_database():
+    """Round-trip a trivial query through the pool"""
+    with get_engine().connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+
+def dispose_engine():
+    """Close every pooled connection, e.g. on shutdown"""
+    global _engine, _session_factory
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+        _session_factory = None
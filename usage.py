@@ -0,0 +1,140 @@
+"""Daily per-guild usage rollups of downloads and music plays.
+
+Every recorded event adds its counters to an in-memory ``(guild_id, day)``
+entry, and every ``flush_interval`` seconds the entries are applied to
+``UsageDaily`` as one unordered ``bulk_write`` of ``$inc`` upserts. Usage
+charts then read one document per guild per day from the ``guild_id, day``
+index instead of scanning raw events, so the raw ``DownloadActivities`` and
+``MusicActivites`` documents only need to live for ``RAW_EVENT_RETENTION_DAYS``
+and expire through a TTL index.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger('ModBot')
+
+RAW_EVENT_RETENTION_DAYS = int(os.getenv('RAW_EVENT_RETENTION_DAYS', '35'))
+
+# Counters every rollup document reports, zero when absent
+FIELDS = ('downloads', 'downloads_audio', 'downloads_video', 'downloads_cached', 'download_bytes', 'plays')
+
+
+def download_counters(kind: str, size: int, cached: bool) -> Dict[str, int]:
+    return {'downloads': 1, f'downloads_{kind}': 1, 'downloads_cached': int(cached), 'download_bytes': size}
+
+
+def play_counters() -> Dict[str, int]:
+    return {'plays': 1}
+
+
+class UsageRollups:
+    """Accumulate per-guild daily counters and flush them as ``$inc`` upserts"""
+
+    def __init__(self, collection, flush_interval: float = 30.0):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        # (guild_id, 'YYYY-MM-DD') -> field -> delta
+        self._deltas: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.last_flush_ops = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._deltas)
+
+    def add(self, guild_id: int, counters: Dict[str, int], at: Optional[datetime] = None):
+        """Count an event towards its guild's UTC day"""
+        deltas = self._deltas[(guild_id, (at or datetime.utcnow()).strftime("%Y-%m-%d"))]
+        for field, value in counters.items():
+            if value:
+                deltas[field] += value
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="usage-rollups")
+
+    async def close(self, retries: int = 3):
+        """Stop the periodic flush and flush whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for attempt in range(retries):
+            if await self.flush():
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logger.error(f"Lost usage rollups for {self.pending} guild days on shutdown")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        async with self._lock:
+            if not self._deltas:
+                return True
+            deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(int))
+            keys = [key for key, counters in deltas.items() if counters]
+            operations = [
+                UpdateOne({"guild_id": guild_id, "day": day}, {"$inc": dict(deltas[(guild_id, day)])}, upsert=True)
+                for guild_id, day in keys
+            ]
+            try:
+                if operations:
+                    await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # An unordered bulk write applies every op that has no error, so only those are retried
+                failed = [keys[error['index']] for error in e.details.get('writeErrors', [])]
+                logger.error(f"Error flushing {len(failed)} of {len(operations)} usage rollups: {str(e)}")
+                self._requeue(deltas, failed)
+                return False
+            except Exception as e:
+                logger.error(f"Error flushing {len(operations)} usage rollups: {str(e)}")
+                self._requeue(deltas, keys)
+                return False
+            self.last_flush_ops = len(operations)
+            return True
+
+    def _requeue(self, deltas: Dict[Tuple[int, str], Dict[str, int]], keys: Iterable[Tuple[int, str]]):
+        for key in keys:
+            for field, value in deltas[key].items():
+                self._deltas[key][field] += value
+
+    async def daily(self, guild_id: int, start: date, end: date) -> List[dict]:
+        """One row per day from ``start`` to ``end`` inclusive, zero-filled, oldest first"""
+        cursor = self.collection.find(
+            {"guild_id": guild_id, "day": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+            {"_id": 0, "guild_id": 0, "backfilled": 0}
+        )
+        stored = {row["day"]: row async for row in cursor}
+        rows = []
+        for offset in range((end - start).days + 1):
+            day = (start + timedelta(days=offset)).isoformat()
+            row = stored.get(day, {})
+            rows.append({"day": day, **{field: row.get(field, 0) for field in FIELDS}})
+        return rows
+
+    async def totals(self, guild_id: int, days: int = 30) -> Dict[str, int]:
+        """Sum of every counter over the last ``days`` days, today included"""
+        end = datetime.utcnow().date()
+        rows = await self.daily(guild_id, end - timedelta(days=days - 1), end)
+        return {field: sum(row[field] for row in rows) for field in FIELDS}
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending,
+            'last_flush_ops': self.last_flush_ops,
+        }
@@ -1,4 +1,4 @@
-def serverInitTemplate(guild, channels, roles):
+def serverInitTemplate(guild):
     return {"server_id": guild.id,
             "configs": {
                 'auto_roles':{
@@ -33,10 +33,23 @@ def serverInitTemplate(guild, channels, roles):
                     'channel': None
                 },
                 'auto_mod': {
-                    'active': False
+                    'active': False,
+                    'banned_terms': [],
+                    'delete': True,
+                    'exempt_roles': [],
+                    'channel': None
+                },
+                'anti_spam': {
+                    'active': False,
+                    'delete': True,
+                    'timeout_minutes': 10,
+                    'exempt_roles': []
                 },
                 'level_rewards': {
                     'active': False,
+                    'message': {'title': "Level Up!", 'content': "{user_mention} reached level {level}!", 'thumbnail': '{user}'},
+                    'channel': None,
+                    'rewards': []
                 },
                 'scheduler': {
                     'active': False,
@@ -64,7 +77,12 @@ def serverInitTemplate(guild, channels, roles):
                     'active': False,
                     'ban_roles': []
                 }
-            },
+            }
+        }
+
+def serverSnapshotTemplate(guild, channels, roles):
+    # Channel and role lists change often and can be large, so they live outside the config document
+    return {"server_id": guild.id,
             "channels": channels,
             "roles": roles
         }
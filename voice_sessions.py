@@ -0,0 +1,150 @@
+"""In-memory voice session tracking with batched time rollups."""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from counters import ServerCounters
+
+logger = logging.getLogger('ModBot')
+
+
+class VoiceSessionTracker:
+    """Track who is in voice per guild and roll the time up without I/O per event.
+
+    Open sessions are kept as ``{guild_id: {member_id: joined_at}}`` so joins and
+    leaves are single dict operations. Closed durations go to ``ServerCounters``
+    for ``Server.voice_time`` and to per-user monthly totals that are flushed to
+    Mongo with one ``bulk_write`` every ``flush_interval`` seconds.
+    """
+
+    def __init__(self, collection, counters: ServerCounters, flush_interval: float = 60.0):
+        self.collection = collection
+        self.counters = counters
+        self.flush_interval = flush_interval
+        self._sessions: Dict[int, Dict[int, float]] = defaultdict(dict)
+        # (guild_id, user_id, month) -> [seconds, sessions]
+        self._rollups: Dict[Tuple[int, int, str], list] = defaultdict(lambda: [0.0, 0])
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def open_sessions(self) -> int:
+        return sum(len(members) for members in self._sessions.values())
+
+    def join(self, guild_id: int, member_id: int, now: Optional[float] = None):
+        self._sessions[guild_id].setdefault(member_id, now or time.time())
+
+    def leave(self, guild_id: int, member_id: int, now: Optional[float] = None) -> float:
+        """Close a member's session and return its duration in seconds"""
+        members = self._sessions.get(guild_id)
+        if not members:
+            return 0.0
+        joined_at = members.pop(member_id, None)
+        if not members:
+            del self._sessions[guild_id]
+        if joined_at is None:
+            return 0.0
+
+        now = now or time.time()
+        duration = max(0.0, now - joined_at)
+        self.counters.add_voice_time(guild_id, duration)
+        rollup = self._rollups[(guild_id, member_id, datetime.utcfromtimestamp(now).strftime("%Y-%m"))]
+        rollup[0] += duration
+        rollup[1] += 1
+        return duration
+
+    def update(self, member, before, after):
+        """Apply a voice state change; moves close the old session and open a new one"""
+        if member.bot or before.channel == after.channel:
+            return
+        guild = member.guild
+        now = time.time()
+        if before.channel is not None:
+            self.leave(guild.id, member.id, now)
+        # Time spent in the AFK channel is not counted
+        if after.channel is not None and after.channel != guild.afk_channel:
+            self.join(guild.id, member.id, now)
+
+    def recover(self, guilds: Iterable):
+        """Reconcile open sessions with the live voice state, e.g. after a restart or reconnect"""
+        now = time.time()
+        for guild in guilds:
+            live = set()
+            for channel in guild.voice_channels + guild.stage_channels:
+                if channel == guild.afk_channel:
+                    continue
+                for member_id in channel.voice_states:
+                    member = guild.get_member(member_id)
+                    if member is not None and member.bot:
+                        continue
+                    live.add(member_id)
+                    self.join(guild.id, member_id, now)
+
+            for member_id in set(self._sessions.get(guild.id, ())) - live:
+                self.leave(guild.id, member_id, now)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="voice-sessions")
+
+    async def close(self):
+        """Close every open session and flush the rollups"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        now = time.time()
+        for guild_id, members in list(self._sessions.items()):
+            for member_id in list(members):
+                self.leave(guild_id, member_id, now)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        async with self._lock:
+            if not self._rollups:
+                return True
+            rollups, self._rollups = self._rollups, defaultdict(lambda: [0.0, 0])
+            keys = list(rollups)
+            operations = [
+                UpdateOne(
+                    {"guild_id": guild_id, "user_id": user_id, "month": month},
+                    {"$inc": {"voice_seconds": rollups[(guild_id, user_id, month)][0],
+                              "sessions": rollups[(guild_id, user_id, month)][1]}},
+                    upsert=True
+                )
+                for guild_id, user_id, month in keys
+            ]
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # An unordered bulk write applies every op that has no error, so only those are retried
+                failed = [keys[error['index']] for error in e.details.get('writeErrors', [])]
+                logger.error(f"Error flushing {len(failed)} of {len(operations)} voice rollups: {str(e)}")
+                self._requeue(rollups, failed)
+                return False
+            except Exception as e:
+                logger.error(f"Error flushing {len(operations)} voice rollups: {str(e)}")
+                self._requeue(rollups, keys)
+                return False
+            return True
+
+    def _requeue(self, rollups: Dict[Tuple[int, int, str], list], keys: Iterable[Tuple[int, int, str]]):
+        for key in keys:
+            seconds, sessions = rollups[key]
+            self._rollups[key][0] += seconds
+            self._rollups[key][1] += sessions
@@ -0,0 +1,103 @@
+"""Buffered Mongo inserts that keep writes off the command and event paths."""
+import asyncio
+import logging
+import random
+from typing import List, Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger('ModBot')
+
+
+class WriteBehindBuffer:
+    """Buffer documents in memory and flush them to a collection with ``insert_many``.
+
+    A flush happens whenever ``batch_size`` documents are pending or every
+    ``flush_interval`` seconds, whichever comes first. ``put`` waits once
+    ``max_pending`` documents are buffered, so a slow database pushes back on
+    the producers instead of growing memory without bound.
+    """
+
+    def __init__(self, collection, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_pending: int = 10000, retries: int = 3):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.flushed = 0
+        self.dropped = 0
+        self._full = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"write-behind:{self.collection.name}")
+
+    async def put(self, document: dict):
+        """Queue a document, waiting while the buffer is full"""
+        if self._closed:
+            raise RuntimeError(f"Write-behind buffer for {self.collection.name} is closed")
+        await self.queue.put(document)
+        if self.queue.qsize() >= self.batch_size:
+            self._full.set()
+
+    async def close(self):
+        """Stop accepting documents and flush everything still buffered"""
+        self._closed = True
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    def _drain(self) -> List[dict]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            if not self._closed and self.queue.qsize() < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+
+            batch = self._drain()
+            if batch:
+                await self._write(batch)
+            elif self._closed:
+                return
+
+    async def _write(self, batch: List[dict]):
+        for attempt in range(self.retries + 1):
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                self.flushed += len(batch)
+                return
+            except BulkWriteError as e:
+                # insert_many assigns _ids in place, so a retried batch only reports
+                # duplicates for the documents that already made it in
+                errors = e.details.get('writeErrors', [])
+                if errors and all(error.get('code') == 11000 for error in errors):
+                    self.flushed += len(batch)
+                    return
+                logger.error(f"Error flushing {len(batch)} documents to {self.collection.name}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error flushing {len(batch)} documents to {self.collection.name}: {str(e)}")
+
+            if attempt < self.retries:
+                await asyncio.sleep(min(5.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+        self.dropped += len(batch)
+        logger.error(f"Dropped {len(batch)} documents for {self.collection.name} after {self.retries} retries")